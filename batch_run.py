@@ -0,0 +1,120 @@
+# file: batch_run.py
+
+"""
+Headless runner for the demo_vuln scenarios, without the topology loader GUI.
+
+Reads the config.cfg of a scenario directory, applies the overrides given on the command line and writes the merged
+config into a new output directory for the run. The world is built in-process with demo_vuln.create_scenario; the
+simulators read the config of the run through the MOSAIK_CONFIG environment variable and write times.csv,
+readings.csv, the HDF5 database and the refreshed grid topology into the run directory, so runs do not touch
+data/config.cfg or outputs/. Run from the repository root:
+
+    python batch_run.py data/basic_normal --end 3600
+    python batch_run.py data/basic_normal --rt-factor 0.0167 --stats --record-times --set rtu_step_size=10
+    python batch_run.py data/basic_normal --port-offset 100 --rtu-ip 127.0.0.1
+
+Relative paths of the RTU output files (rtu_readings_hdf5, rtu_register_file, rtu_modbus_stats) are taken relative
+to the run directory. Runs in parallel need distinct --port-offset values, since each run binds the Modbus ports of
+the RTU XML plus the offset.
+
+The path of the run directory is printed when the run has finished.
+"""
+import argparse
+import os
+import sys
+import time
+
+from topology_loader.topology_loader import CONFIG_ENV, PATH_KEYS, read_config
+
+
+def load_scenario(directory):
+    """
+    Loads the config of a scenario directory with absolute paths to its files.
+    :param directory: scenario directory with a config.cfg
+    :return: configuration as a dict
+    """
+    directory = os.path.abspath(directory)
+    conf = read_config(os.path.join(directory, "config.cfg"))
+    conf['grid_file'] = os.path.join(directory, conf['grid_name'] + ".json")
+    for key in PATH_KEYS:
+        if key in conf:
+            conf[key] = os.path.join(directory, conf[key])
+    conf.setdefault('rt_factor', '0')
+    conf.setdefault('rtu_stats_output', 'False')
+    conf.setdefault('recordtimes', 'False')
+    return conf
+
+
+def make_run_dir(root, name):
+    """
+    Creates a new directory for the outputs of a run.
+    :return: absolute path of the directory
+    """
+    run_dir = os.path.abspath(os.path.join(root, "{}-{}-{}".format(name, time.strftime("%Y%m%d-%H%M%S"), os.getpid())))
+    os.makedirs(run_dir)
+    return run_dir
+
+
+def write_config(conf, path):
+    """
+    Writes a config dict in the "key value" format of config.cfg.
+    """
+    with open(path, "w") as out_stream:
+        for key, value in conf.items():
+            out_stream.write("{} {}\n".format(key, value))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a demo_vuln scenario without the topology loader GUI.')
+    parser.add_argument('scenario', help='scenario directory with a config.cfg (e.g. data/basic_normal)')
+    parser.add_argument('--end', type=int, help='simulated seconds (overrides the config)')
+    parser.add_argument('--rt-factor', type=float, help='real-time factor, 0 runs as fast as possible')
+    parser.add_argument('--stats', action='store_true', help='write the RTU readings to readings.csv')
+    parser.add_argument('--record-times', action='store_true', help='write the event times to times.csv')
+    parser.add_argument('--port-offset', type=int, help='added to the Modbus ports of the RTUs [default: 0]')
+    parser.add_argument('--rtu-ip', help='address for the Modbus servers of the RTUs instead of the one of the XML')
+    parser.add_argument('--web', action='store_true', help='start the web visualization')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='override any other config key (repeatable)')
+    parser.add_argument('--output', default=os.path.join('outputs', 'runs'),
+                        help='directory for the run directories [default: %(default)s]')
+    parser.add_argument('--name', help='prefix of the run directory [default: name of the scenario]')
+    args = parser.parse_args(argv)
+
+    conf = load_scenario(args.scenario)
+    if args.end is not None:
+        conf['end'] = str(args.end)
+    if args.rt_factor is not None:
+        conf['rt_factor'] = str(args.rt_factor)
+    if args.stats:
+        conf['rtu_stats_output'] = 'True'
+    if args.record_times:
+        conf['recordtimes'] = 'True'
+    if args.port_offset is not None:
+        conf['rtu_port_offset'] = str(args.port_offset)
+    if args.rtu_ip:
+        conf['rtu_ip'] = args.rtu_ip
+    conf['webvis'] = str(args.web)
+    for item in args.set:
+        key, sep, value = item.partition('=')
+        if not sep:
+            parser.error('--set needs KEY=VALUE, got "{}"'.format(item))
+        conf[key] = value
+
+    name = args.name or os.path.basename(os.path.normpath(args.scenario))
+    run_dir = make_run_dir(args.output, name)
+    conf['output_dir'] = run_dir
+    conf_file = os.path.join(run_dir, "config.cfg")
+    write_config(conf, conf_file)
+    os.environ[CONFIG_ENV] = conf_file  # Read by the simulators, also by the ones started as processes
+
+    import demo_vuln
+    demo_vuln.configure(conf)
+    elapsed_time = demo_vuln.run()
+    with open(os.path.join(run_dir, "elapsed_time"), "w") as out_stream:
+        out_stream.write("{}\n".format(elapsed_time))
+    print(run_dir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
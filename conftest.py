@@ -0,0 +1,6 @@
+# file: conftest.py
+
+"""
+Puts the repository root on sys.path, so the tests in tests/ import mosaikrtu, scada_server and output_writer with
+plain ``pytest tests`` as well as with ``python -m pytest tests``.
+"""
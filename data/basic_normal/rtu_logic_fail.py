@@ -1,27 +1,17 @@
-
 ################################################################################################################################################
-# This is the logic of the PLC. We assume it controls the balance between lines 16 and 16a connecting node a_2 with d_1. It contains a possible failure.
+# This is the logic of the PLC. We assume it controls the supply of node b_5: branch_19 (from b_4) feeds it, branch_24 (from b_17) is the
+# backup feed that is switched in when branch_19 gets loaded. It contains a possible failure: the backup feed is turned off without
+# checking its own current.
+# The logic runs in a namespace with reg (the registers by label), max_current (the max-* limit registers by branch) and time.
 ################################################################################################################################################
-
-
 import random
 
-for  measurements in self.cached_val.values():
-    if "sensor" in measurements["dev"]:
-        self.to_db(measurements["reg_type"], measurements["index"], measurements["value"][0])
-    if "switch" in measurements["dev"]:
-        if measurements["place"] == "branch_16":
-            if (float(self.cached_val["sensor_1-branch_16"]["value"][0]) > 0.6*self.max_current["branch_16"]) and not self.db("co", 2):
-                self.to_db("co", 2, 1)
-                print("Turning the branch_16a ON, because the current increased above 0.6 of max current.")
-            elif (float(self.cached_val["sensor_1-branch_16"]["value"][0]) < 0.3*self.max_current["branch_16"]) and self.db("co", 2): 
-                self.to_db("co", 2, 0)
-                print("Turning the branch_16a OFF, because the current decreased below 0.3 of max current.")
-                ###### Faking a failure ######
-                # if bool(random.getrandbits(1)):
-                #     self.to_db("co", 0, 0)
-                #     print("Turning the branch 16 also OFF to see if this works ")
+feed = abs(reg["sensor_1-branch_19"])  # The sign of a branch current depends on the direction of the flow
 
-print("Current branch 16 : {}".format(float(self.cached_val["sensor_1-branch_16"]["value"][0])))
-print("Current branch 16a: {}".format(float(self.cached_val["sensor_3-branch_16a"]["value"][0])))
-print("Current branch 17 : {}".format(float(self.cached_val["sensor_2-branch_17"]["value"][0])))
\ No newline at end of file
+if feed > 0.6 * max_current["branch_19"] and not reg["switch_2-branch_24"]:
+    reg["switch_2-branch_24"] = True  # Turn the backup feed ON, the current increased above 0.6 of max current
+elif feed < 0.3 * max_current["branch_19"] and reg["switch_2-branch_24"]:
+    reg["switch_2-branch_24"] = False  # Turn the backup feed OFF, the current decreased below 0.3 of max current
+    ###### Faking a failure ######
+    # if bool(random.getrandbits(1)):
+    #     reg["switch_1-branch_19"] = False  # Turning branch_19 also OFF to see if this works
@@ -57,7 +57,13 @@ logger = logging.getLogger('demo_main')
 def main():
     topoloader = topology_loader()
     conf = topoloader.get_config()
+    configure(conf)
+    run()
 
+def configure(conf):
+    """
+    Sets the scenario parameters from a config dict (see topology_loader.get_config()). Paths are relative to data/.
+    """
     global START
     START = conf['start']
     global END
@@ -83,10 +89,25 @@ def main():
     RTU_STATS_OUTPUT = bool(strtobool(conf['rtu_stats_output'].lower()))
     global RECORD_TIMES
     RECORD_TIMES = bool(strtobool(conf['recordtimes'].lower()))  # TODO read it from GUI
-
+    global RTU_STEP_SIZE
+    RTU_STEP_SIZE = int(conf.get('rtu_step_size', 60))
+    global RTU_MAX_STEP_SIZE  # RTUs step adaptively up to this interval while the grid is quiet
+    RTU_MAX_STEP_SIZE = int(conf.get('rtu_max_step_size', RTU_STEP_SIZE))
+    global OUTPUT_DIR  # times.csv, readings.csv and the HDF5 database of the run
+    OUTPUT_DIR = conf.get('output_dir', 'outputs')
+    global HDF5_FILE
+    HDF5_FILE = os.path.join(OUTPUT_DIR, 'demo.hdf5') if 'output_dir' in conf else 'demo.hdf5'
+    global WEB_VIS  # Headless runs can leave out the web visualization
+    WEB_VIS = bool(strtobool(conf.get('webvis', 'True').lower()))
+
+def run():
+    """
+    Builds the world of the configured scenario and runs it until END.
+    :return: elapsed wall-clock time in seconds
+    """
     if RECORD_TIMES :
         try:
-            os.remove('./outputs/times.csv')
+            os.remove(os.path.join(OUTPUT_DIR, 'times.csv'))
         except OSError:
             pass
     random.seed(23)
@@ -100,6 +121,7 @@ def main():
         world.run(until=END, rt_factor=RT_FACTOR)  # As fast as possilb
     elapsed_time = time.time() - start_time
     print("Elapsed time: {}".format(elapsed_time))
+    return elapsed_time
 
 def create_scenario(world):
     # Start simulators
@@ -108,7 +130,7 @@ def create_scenario(world):
     pvsim = world.start('CSV', sim_start=START, datafile=PV_DATA)
     if not GEN_DATA == None:
         gensim = world.start('HouseholdSim')
-    rtusim = world.start('RTUSim')
+    rtusim = world.start('RTUSim', step_size=RTU_STEP_SIZE, max_step_size=RTU_MAX_STEP_SIZE)
 
 
     # Instantiate models
@@ -138,7 +160,7 @@ def create_scenario(world):
 
     # Database
     db = world.start('DB', step_size=60, duration=END)
-    hdf5 = db.Database(filename='demo.hdf5')
+    hdf5 = db.Database(filename=HDF5_FILE)
     connect_many_to_one(world, houses, hdf5, 'P_out')
     connect_many_to_one(world, pvs, hdf5, 'P')
     if not GEN_DATA == None:
@@ -158,9 +180,18 @@ def create_scenario(world):
     connect_many_to_one(world, branches, hdf5,
                         'P_from', 'Q_from', 'P_to', 'Q_to')
 
+    # Entity types, start date and step size for replays with mosaik_web.replay
+    recorded = houses + pvs + nodes + branches
+    if not GEN_DATA == None:
+        recorded += gens
+    db.set_meta_data({'start_date': START, 'step_size': 60})
+    db.set_static_data({e.full_id: {'type': e.type} for e in recorded})
+
 
 
     # Web visualization
+    if not WEB_VIS:
+        return
     webvis = world.start('WebVis', start_date=START, step_size=60)
     webvis.set_config(ignore_types=['Topology', 'ResidentialLoads', 'Grid',
                                     'Database', 'TopologyModel', 'RTU', 'sensor', 'switch'])
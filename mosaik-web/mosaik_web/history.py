@@ -0,0 +1,183 @@
+"""
+Multi-resolution history of the node values for the timeline.
+
+Only the nodes a client requested a timeline for are recorded (at most
+*max_nodes* of them, the least recently requested one is dropped first), so
+the memory does not grow with the size of the grid.  A node's history starts
+with its first request.
+
+Level 0 stores the value of a node for each step.  Each further level stores
+the mean, min and max of *factor* rows of the level below it, so a long time
+span can be sent to the client with a few hundred points instead of one point
+per step.
+
+"""
+from array import array
+from collections import OrderedDict
+
+
+TIMELINE_POINTS = 1024  # Rows kept per level
+LEVEL_FACTOR = 8  # Rows of a level aggregated into one row of the next level
+TIMELINE_NODES = 64  # Nodes recorded at most
+
+
+class Level(object):
+    """Ring buffer with *capacity* rows of aggregated values of one node.
+
+    Each row has a start time and a mean, min and max value.  Rows are
+    allocated as they are appended.
+
+    """
+    def __init__(self, bucket, capacity):
+        self.bucket = bucket  # Seconds covered by one row
+        self.capacity = capacity
+        self.times = array('d')
+        self.means = array('f')
+        self.mins = array('f')
+        self.maxs = array('f')
+        self.head = 0  # Index of the oldest row once the buffer is full
+        self.pending = []  # Rows for the next row of the level above
+
+    def __len__(self):
+        return len(self.times)
+
+    def append(self, time, mean, min, max):
+        if len(self.times) < self.capacity:
+            self.times.append(time)
+            self.means.append(mean)
+            self.mins.append(min)
+            self.maxs.append(max)
+        else:
+            i = self.head
+            self.times[i] = time
+            self.means[i] = mean
+            self.mins[i] = min
+            self.maxs[i] = max
+            self.head = (i + 1) % self.capacity
+
+    def oldest(self):
+        return self.times[self.head] if self.times else None
+
+    def rows(self, start, end):
+        """Return the rows between *start* and *end* as list of
+        ``(time, mean, min, max)``."""
+        n = len(self.times)
+        rows = []
+        for j in range(n):
+            k = (self.head + j) % n
+            t = self.times[k]
+            if start <= t <= end:
+                rows.append((t, self.means[k], self.mins[k], self.maxs[k]))
+        return rows
+
+
+class NodeHistory(object):
+    """History of the values of one node.
+
+    Enough levels are created to cover *span* seconds with steps of
+    *step_size* seconds.
+
+    """
+    def __init__(self, step_size, span, points=TIMELINE_POINTS,
+                 factor=LEVEL_FACTOR):
+        self.factor = factor
+        self.levels = [Level(step_size, points)]
+        while self.levels[-1].bucket * points < span:
+            self.levels.append(Level(self.levels[-1].bucket * factor, points))
+
+    def record(self, time, value):
+        """Add the *value* at *time*."""
+        self._append(0, time, value, value, value)
+
+    def _append(self, k, time, mean, min_, max_):
+        level = self.levels[k]
+        level.append(time, mean, min_, max_)
+        if k + 1 == len(self.levels):
+            return
+
+        level.pending.append((time, mean, min_, max_))
+        if len(level.pending) == self.factor:
+            self._append(k + 1, *_aggregate(level.pending))
+            level.pending = []
+
+    def query(self, start, end, points):
+        """Return the history between *start* and *end* with at most about
+        *points* rows.
+
+        Return a dict with the bucket size in seconds and lists with the
+        *time*, *mean*, *min* and *max* of each row.
+
+        """
+        for k, level in enumerate(self.levels):
+            fits = (end - start) / level.bucket <= points
+            covers = (len(level) < level.capacity or
+                      level.oldest() <= start)
+            if (fits and covers) or k + 1 == len(self.levels):
+                break
+        rows = level.rows(start, end)
+        partial = self._partial(k)
+        if partial is not None and (not rows or partial[0] > rows[-1][0]):
+            rows.append(partial)
+
+        return {
+            'bucket': level.bucket,
+            'time': [r[0] for r in rows],
+            'mean': [r[1] for r in rows],
+            'min': [r[2] for r in rows],
+            'max': [r[3] for r in rows],
+        }
+
+    def _partial(self, k):
+        """Return the not yet completed row of level *k*."""
+        if k == 0:
+            return None
+        rows = list(self.levels[k - 1].pending)
+        below = self._partial(k - 1)
+        if below is not None:
+            rows.append(below)
+        if not rows:
+            return None
+        return _aggregate(rows)
+
+
+class History(object):
+    """History of the values of the nodes clients requested a timeline for.
+
+    See :class:`NodeHistory` for *step_size*, *span*, *points* and *factor*.
+
+    """
+    def __init__(self, step_size, span, points=TIMELINE_POINTS,
+                 factor=LEVEL_FACTOR, max_nodes=TIMELINE_NODES):
+        self.step_size = step_size
+        self.span = span
+        self.points = points
+        self.factor = factor
+        self.max_nodes = max_nodes
+        self.nodes = OrderedDict()  # Maps node indexes to their NodeHistory
+
+    def record(self, time, values):
+        """Add the *values* of all nodes (in node index order) at *time*."""
+        for i, node in self.nodes.items():
+            node.record(time, values[i])
+
+    def query(self, i, start, end, points):
+        """Return the history of node *i* (see :meth:`NodeHistory.query()`).
+
+        Start recording the node if it is not recorded yet.
+
+        """
+        node = self.nodes.get(i)
+        if node is None:
+            node = self.nodes[i] = NodeHistory(self.step_size, self.span,
+                                               self.points, self.factor)
+            if len(self.nodes) > self.max_nodes:
+                self.nodes.popitem(last=False)
+        else:
+            self.nodes.move_to_end(i)
+        return node.query(start, end, points)
+
+
+def _aggregate(rows):
+    """Aggregate a list of ``(time, mean, min, max)`` rows into one."""
+    return (rows[0][0], sum(r[1] for r in rows) / len(rows),
+            min(r[2] for r in rows), max(r[3] for r in rows))
@@ -35,7 +35,10 @@ var topology_config = {
 // Global state :-)
 //
 var etypes = null;  // Entity types (will be set in setup());
+var node_index = {};  // Maps node names to their index in the topology
+var node_values = null;  // Current value of each node in node index order
 var progressbar = ProgressBar();
+var replay = ReplayControls();
 var topology = Topology(topology_config);
 var timeline = Timeline();
 var svg = d3.select('#canvas').attr('width', width).attr('height', height);
@@ -51,14 +54,29 @@ var ws = make_websocket();
 function make_websocket() {
     var callbacks = {
         setup_topology: setup,
-        update_data: update
+        update_data: update,
+        timeline: function(data) { timeline.receive(data); }
     };
 
+    // Updates are binary unless the page is opened with "?json".  With
+    // "?view=<name>", only the nodes of that view are shown.
+    var cmd = 'get_topology';
+    if (query_param('json') === null) {
+        cmd += ' binary';
+    }
+    if (query_param('view')) {
+        cmd += ' view=' + query_param('view');
+    }
     var ws = new WebSocket('ws://' + location.host + '/websocket');
+    ws.binaryType = 'arraybuffer';
     ws.onopen = function get_topology(evt) {
-        ws.send('get_topology');
+        ws.send(cmd);
     };
     ws.onmessage = function dispatch(evt) {
+        if (evt.data instanceof ArrayBuffer) {
+            update(decode_binary(evt.data));
+            return;
+        }
         var msg = JSON.parse(evt.data);
         var msg_type = callbacks[msg[0]];
         if (msg_type) {
@@ -75,6 +93,21 @@ function make_websocket() {
     return ws;
 }
 
+/**
+ * Return the value of the URL query parameter *name* (``''`` if it has no
+ * value, ``null`` if it is missing).
+ */
+function query_param(name) {
+    var params = location.search.substring(1).split('&');
+    for (var i = 0; i < params.length; i++) {
+        var param = params[i].split('=');
+        if (decodeURIComponent(param[0]) == name) {
+            return (param.length > 1) ? decodeURIComponent(param[1]) : '';
+        }
+    }
+    return null;
+}
+
 /**
  * Create and initialize the topology graph.
  *
@@ -86,7 +119,13 @@ function make_websocket() {
  */
 function setup(data) {
     etypes = data.etypes;  // Set global variable
+    data.nodes.forEach(function(node, i) {
+        node_index[node.name] = i;
+    });
+    node_values = new Float64Array(data.nodes.length);
     progressbar.set_progress(0);
+    replay.init(data);
+    make_view_selection(data);
     topology.create(data);
     timeline.init(data);
 }
@@ -97,15 +136,92 @@ function setup(data) {
  * *data* is an object with two attributes:
  *
  * - ``data.progress`` is a number with the current sim. progress in [0, 100].
- * - ``data.nodes`` is a dict/object mapping node names to a new "value".
+ * - ``data.node_data`` is a list of deltas, one per step (see
+ *   ``expand_frames()``).
  */
 function update(data) {
+    expand_frames(data);
     progressbar.set_progress(data.progress);
+    replay.update(data);
     topology.update(data);
     timeline.update(data);
 }
 
 
+/**
+ * Decode a binary update (see ``encode_binary()`` in server.py).
+ *
+ * Return an object like a JSON update, but with the deltas as
+ * ``{indexes: Uint32Array, values: Float32Array}`` and the keyframe as
+ * Float32Array in node index order.
+ */
+function decode_binary(buf) {
+    var header = new DataView(buf, 0, 24);
+    var flags = header.getUint8(1);
+    var n_steps = header.getUint16(2, true);
+    var n_nodes = header.getUint32(16, true);
+    var data = {
+        progress: header.getFloat32(4, true),
+        time: header.getFloat64(8, true),
+        node_data: []
+    };
+    var offset = 24;
+    for (var i = 0; i < n_steps; i++) {
+        var k = new DataView(buf, offset, 4).getUint32(0, true);
+        offset += 4;
+        data.node_data.push({
+            indexes: new Uint32Array(buf, offset, k),
+            values: new Float32Array(buf, offset + 4 * k, k)
+        });
+        offset += 8 * k;
+    }
+    if (flags & 1) {
+        data.keyframe = new Float32Array(buf, offset, n_nodes);
+    }
+    return data;
+}
+
+/**
+ * Turn the deltas of an update into full frames.
+ *
+ * Each delta in ``data.node_data`` only contains the nodes whose value changed
+ * (an object mapping node names to values, or indexes and values from
+ * ``decode_binary()``).  ``data.keyframe`` (sent periodically and to new
+ * clients) contains the values of all nodes after the update.  Afterwards,
+ * ``data.node_data`` contains one array per step with the values of all nodes
+ * in node index order.
+ */
+function expand_frames(data) {
+    var frames = data.node_data.map(function(delta) {
+        if (delta.indexes) {
+            for (var i = 0; i < delta.indexes.length; i++) {
+                node_values[delta.indexes[i]] = delta.values[i];
+            }
+        }
+        else {
+            for (var name in delta) {
+                node_values[node_index[name]] = delta[name];
+            }
+        }
+        return node_values.slice();
+    });
+    if (data.keyframe) {
+        if (data.keyframe instanceof Float32Array) {
+            node_values.set(data.keyframe);
+        }
+        else {
+            for (var name in data.keyframe) {
+                node_values[node_index[name]] = data.keyframe[name];
+            }
+        }
+        if (frames.length == 0) {
+            frames.push(node_values.slice());
+        }
+    }
+    data.node_data = frames;
+}
+
+
 function ProgressBar() {
     var progress_bar = d3.select('#progress');
     var progress_scale = d3.scale.linear()
@@ -121,6 +237,83 @@ function ProgressBar() {
 }
 
 
+/**
+ * Show a selection of the topology's views (if it has any).  Selecting one
+ * reloads the page with only the nodes of that view.
+ */
+function make_view_selection(data) {
+    if (!data.views || data.views.length == 0) {
+        return;
+    }
+    var select = d3.select('#views')
+        .style('display', 'block')
+        .append('select');
+    select.selectAll('option')
+            .data([''].concat(data.views))
+        .enter().append('option')
+            .attr('value', function(d) { return d; })
+            .text(function(d) { return d || 'all nodes'; });
+    select.property('value', data.view || '');
+    select.on('change', function() {
+        var search = (query_param('json') === null) ? '' : '?json';
+        if (this.value) {
+            search += (search ? '&' : '?') + 'view=' +
+                encodeURIComponent(this.value);
+        }
+        location.search = search;
+    });
+}
+
+/**
+ * Seek slider and speed selection for replays (see replay.py).  Only shown if
+ * the topology contains a ``replay`` object.
+ */
+function ReplayControls() {
+    var self = {};
+    self.enabled = false;
+    self.seeking = false;  // Don't move the slider while the user drags it
+
+    var controls = d3.select('#replay');
+    var seek = d3.select('#replay_seek');
+    var speed = d3.select('#replay_speed');
+    var time = d3.select('#replay_time');
+
+    seek.on('mousedown', function() { self.seeking = true; });
+    seek.on('change', function() {
+        self.seeking = false;
+        ws.send('seek ' + this.value);
+    });
+    speed.on('change', function() {
+        ws.send('speed ' + this.value);
+    });
+
+    self.init = function(data) {
+        if (!data.replay) {
+            return;
+        }
+        self.enabled = true;
+        self.start_date = new Date(data.start_date);
+        controls.style('display', 'block');
+        seek.attr('max', data.replay.end)
+            .attr('step', data.update_interval);
+        speed.property('value', data.replay.speed);
+    };
+
+    self.update = function(data) {
+        if (!self.enabled) {
+            return;
+        }
+        if (!self.seeking) {
+            seek.property('value', data.time);
+        }
+        var date = new Date(self.start_date.getTime() + data.time * 1000);
+        time.text(date.toLocaleString());
+    };
+
+    return self;
+}
+
+
 function Topology(conf) {
     var self = {};
     self.disable_heatmap = false;
@@ -266,7 +459,7 @@ function Topology(conf) {
         var node_data = data.node_data[data.node_data.length - 1];
         var nodes = svg.selectAll('#topology .node');
         nodes.data().forEach(function(node, i) {
-            node.value = node_data[node.name].value;
+            node.value = node_data[i];
         });
 
         // Update the fill color of all nodes.
@@ -319,11 +512,11 @@ function Timeline() {
     var self = {};
     self.start_date = null;
     self.update_interval = null;
-    self.timeline_backlog = null;
+    self.span = null;  // Visible time span in milli seconds
+    self.max_span = null;
     self.time = 0;
     self.timeline_node = null;
     self.timeline_circle = null; // Highlighted circle element of the topo.
-    self.backlog_data = {};
     self.timeline_buf = [];  // Buffer for the currently active timeline
 
     // Margin and size of the actual drawing area
@@ -352,38 +545,47 @@ function Timeline() {
         ]));
     self.make_y_axis = d3.svg.axis().scale(self.y).ticks(5).orient('left');
 
-    // Function mapping data to (x, y) coordinates in the plot, set in init().
-    self.make_line = null;
+    // Functions mapping data points (objects with a time "t" and a "mean",
+    // "min" and "max" value) to coordinates in the plot.
+    self.make_line = d3.svg.line()
+        .x(function(d) { return self.x(d.t); })
+        .y(function(d) { return self.y(d.mean); });
+    self.make_band = d3.svg.area()
+        .x(function(d) { return self.x(d.t); })
+        .y0(function(d) { return self.y(d.min); })
+        .y1(function(d) { return self.y(d.max); });
 
     /**
      * Return the domain based on the current time. This will be like
-     * [current_time - backlog_size, current_time].
+     * [current_time - span, current_time].
      */
     function get_domain() {
-        var domain_left = self.time -
-            (self.timeline_backlog * self.update_interval);
-        var domain_right = self.time;
-        return [domain_left, domain_right];
+        return [self.time - self.span, self.time];
     }
 
     /**
-     * Create the ring buffers for node data. This is done once when the
-     * app starts.
+     * Initialize the time span.  This is done once when the app starts.
      */
     function init(data) {
         self.start_date = new Date(data.start_date);
         self.update_interval = data.update_interval * 1000;  // milli seconds
-        self.timeline_backlog = data.timeline_hours * 60;  // minutes
-        data.nodes.forEach(function(node) {
-            self.backlog_data[node.name] = RingBuffer(
-                self.timeline_backlog + 1, null);
-        });
-        self.make_line = d3.svg.line()
-            .x(function(d, i) {
-                return self.x(self.time -
-                    ((self.timeline_backlog - i) * self.update_interval));
-            })
-            .y(function(d) { return self.y(d); });
+        self.max_span = data.timeline_hours * 3600 * 1000;
+        self.span = self.max_span;
+    }
+
+    /**
+     * Request the history of the timeline node for the current span from the
+     * server.  It is aggregated to about one point per pixel (see
+     * ``receive()``).
+     */
+    function request() {
+        var start = self.start_date.getTime();
+        ws.send('timeline ' + JSON.stringify({
+            node: self.timeline_node,
+            start: (self.time - self.span - start) / 1000,
+            end: (self.time - start) / 1000,
+            points: Math.round(self.w)
+        }));
     }
 
     /**
@@ -404,6 +606,7 @@ function Timeline() {
         }
         self.timeline_node = node.name;
         self.timeline_circle = circle.classed('highlight', true);
+        self.timeline_buf = [];
 
         var etype_conf = (node.type in etypes) ? etypes[node.type] :
                                                  default_etype;
@@ -421,6 +624,15 @@ function Timeline() {
             .attr('width', self.w + self.m.left + self.m.right)
             .attr('height', self.h + self.m.top + self.m.bottom);
 
+        // Zoom in and out with the mouse wheel
+        timeline.on('wheel', function() {
+            var factor = (d3.event.deltaY > 0) ? 2 : 0.5;
+            self.span = Math.min(self.max_span, Math.max(
+                10 * self.update_interval, self.span * factor));
+            d3.event.preventDefault();
+            request();
+        });
+
         // Title
         var title = node.name;
         if (!(node.type in etypes)) {
@@ -437,7 +649,7 @@ function Timeline() {
             .attr('transform',
                   'translate(' + self.m.left + ', ' + self.m.top + ')');
 
-        // Clip path for animated timeline
+        // Clip path for the timeline
         graph.append('defs').append('clipPath')
                 .attr('id', 'clip')
             .append('rect')
@@ -470,16 +682,45 @@ function Timeline() {
                 .attr('dy', '.32em')  // or: #y_axis -> g[2/5] -> text.dy
                 .text(etype_conf.unit);
 
-        graph.append('g')
-                .attr('clip-path', 'url(#clip)')
-            .append('path')
-                .datum(self.backlog_data[node.name].data())
-                .attr('class', 'line')
-                .attr('d', self.make_line);
+        var plot = graph.append('g')
+                .attr('clip-path', 'url(#clip)');
+        plot.append('path')
+                .datum([])
+                .attr('class', 'band');
+        plot.append('path')
+                .datum([])
+                .attr('class', 'line');
 
+        request();
         tick();
     }
 
+    /**
+     * Replace the timeline data with the history sent by the server.
+     *
+     * *data* contains the *node* name and lists with the *time* (in
+     * simulation seconds), *mean*, *min* and *max* of each point.
+     */
+    function receive(data) {
+        if (data.node !== self.timeline_node) {
+            return;
+        }
+        var start = self.start_date.getTime();
+        var points = data.time.map(function(t, i) {
+            return {t: start + t * 1000, mean: data.mean[i],
+                    min: data.min[i], max: data.max[i]};
+        });
+        // Keep the live values that are newer than the history
+        var last = points.length ? points[points.length - 1].t : -Infinity;
+        svg.select('#timeline .line').datum().forEach(function(d) {
+            if (d.t > last) {
+                points.push(d);
+            }
+        });
+        svg.select('#timeline .line').datum(points);
+        svg.select('#timeline .band').datum(points);
+    }
+
     /**
      * Redraw the timeline with the new data from the timeline_buf.
      */
@@ -489,101 +730,65 @@ function Timeline() {
             return;
         }
 
-        var data = self.timeline_buf;
-        self.timeline_buf = [];
         var line = svg.select('#timeline .line');
-        data.forEach(function(d) { line.datum().push(d); });
+        var band = svg.select('#timeline .band');
+        var points = line.datum();
+        self.timeline_buf.forEach(function(d) { points.push(d); });
+        self.timeline_buf = [];
+
+        // Drop points that are no longer visible
+        var domain = get_domain();
+        var drop = 0;
+        while (drop < points.length - 1 && points[drop + 1].t < domain[0]) {
+            drop++;
+        }
+        points.splice(0, drop);
 
         // Update domains
-        self.x.domain(get_domain());
-        self.y.domain([Math.min(self.y_pos, d3.min(line.datum())),
-                       Math.max(self.y_pos, d3.max(line.datum()))]);
+        self.x.domain(domain);
+        var min = d3.min(points, function(d) { return d.min; });
+        var max = d3.max(points, function(d) { return d.max; });
+        if (min !== undefined) {
+            self.y.domain([Math.min(self.y_pos, min),
+                           Math.max(self.y_pos, max)]);
+        }
 
-        // slide the x-axis left
         self.x_axis.attr('transform', 'translate(0, ' + self.y(self.y_pos) + ')')
-        self.x_axis.transition()
-            .duration(1000)
-            .ease("linear")
-            .call(self.make_x_axis);
+        self.x_axis.call(self.make_x_axis);
         self.y_axis.call(self.make_y_axis);
 
-        // Update the line and slide it left
-        var translate_x = self.x(self.time -
-                ((line.datum().length - 1 )* self.update_interval));
-        line.attr('d', self.make_line)
-            .attr('transform', null);
+        band.datum(points).attr('d', self.make_band);
+        line.datum(points).attr('d', self.make_line);
         line.transition()
             .duration(1000)
-            .ease('linear')
-            .attr('transform', 'translate(' + translate_x + ', 0)')
             .each('end', tick);
-
-        while (line.datum().length > (self.timeline_backlog + 1)) {
-            line.datum().shift();
-        }
     }
 
     /**
      * Update the timeline with new values.
      */
     function update(data) {
-        self.time = self.start_date.getTime() + (data.time * 1000);
-        // Update ring buffes with new data
-        data.node_data.forEach(function(nodes) {
-            d3.map(nodes).forEach(function(k, v) {
-                self.backlog_data[k].push(v.value);
+        var start = self.start_date.getTime();
+        self.time = start + (data.time * 1000);
+        if (self.timeline_node === null) {
+            return;
+        }
+        // All node_data frames but the last one belong to earlier steps.
+        var i = node_index[self.timeline_node];
+        var n = data.node_data.length;
+        data.node_data.forEach(function(values, j) {
+            var v = values[i];
+            self.timeline_buf.push({
+                t: self.time - (n - 1 - j) * self.update_interval,
+                mean: v, min: v, max: v
             });
-
-            if (self.timeline_node !== null) {
-                self.timeline_buf.push(nodes[self.timeline_node].value);
-            }
         });
     }
 
     return {
         init: init,
         create: create,
+        receive: receive,
         update: update
     };
 }
-
-
-/**
- * A simple ring buffer with stores at most *size* elements.
- *
- * If it reaches its capacity and another item is pushed, the oldest item is
- * dropped.
- *
- * ``data()``
- *   Return an array containing all data. The oldest item will be at position
- *   0 and the newest item on the end.
- *
- * ``push(item)``
- *   Push *item* to the buffer removing the oldest item if necessary.
- */
-function RingBuffer(size, init_val) {
-    var zero = 0;  // Points to element "0"
-    var buffer = [];
-    for (var i = 0; i < size; i ++) {
-        buffer.push(init_val);
-    }
-
-    function get(key) {
-        key = (size + zero + key) % size;
-        return buffer[key];
-    }
-
-    return {
-        data: function() {
-            ret = [];
-            for (var i = 0; i < buffer.length; i ++) {
-                ret.push(get(i));
-            }
-            return ret;
-        },
-        push: function(item) {
-            buffer[zero] = item;
-            zero = (zero + 1) % size;
-        }
-    };
-}
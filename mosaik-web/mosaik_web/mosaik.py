@@ -1,12 +1,14 @@
+from array import array
 from dateutil import tz
+import copy
 import json
 import logging
 
 import arrow
 import mosaik_api
-import networkx as nx
 
 from mosaik_web import server
+from mosaik_web.topology import make_topology
 
 
 logger = logging.getLogger('mosaik_web.mosaik')
@@ -23,6 +25,7 @@ meta = {
     'extra_methods': [
         'set_config',
         'set_etypes',
+        'set_views',
     ],
 }
 
@@ -32,7 +35,12 @@ default_config = {
     'merge_types': ['Branch', 'Transformer'],
     'disable_heatmap': False,
     'timeline_hours': 24,
+    'delta_epsilon': 0,  # Don't send value changes up to this threshold
+    'keyframe_interval': 10,  # Seconds between two full updates
+    'client_queue': 8,  # Updates queued per client before they are collapsed
+    'client_max_lag': 30,  # Drop clients lagging more seconds behind
     'etypes': {},
+    'views': {},  # Maps view names to node filters
 }
 
 DATE_FORMAT = 'YYYY-MM-DD HH:mm:ss'
@@ -48,7 +56,9 @@ class MosaikWeb(mosaik_api.Simulator):
         self.server = None
         self.sid = None
         self.eid = None
-        self.config = default_config
+        self.config = copy.deepcopy(default_config)
+        self.attr_idx = None  # Maps attrs to {node name: node index}
+        self.node_values = None  # Node values in node index order
 
     def configure(self, args, backend, env):
         #logger.warning("WebViz: configure")
@@ -88,21 +98,17 @@ class MosaikWeb(mosaik_api.Simulator):
 
         progress = yield self.mosaik.get_progress()
 
-        etype_conf = self.config['etypes']
-        node_data = {}
-        for node in self.server.topology['nodes']:
-            node_id = node['name']
-            try:
-                attr = etype_conf[node['type']]['attr']
-            except KeyError:
-                val = 0
-            else:
-                # val = data[node_id][attr]
-                val = inputs[attr][node_id]
-            node_data[node_id] = {
-                'value': val,
-            }
-        self.server.set_new_data(time, progress, node_data)
+        attr_idx = self.attr_idx
+        node_values = self.node_values
+        for attr, values in inputs.items():
+            node_idx = attr_idx.get(attr)
+            if node_idx is None:
+                continue
+            for node_id, val in values.items():
+                i = node_idx.get(node_id)
+                if i is not None and val is not None:  # None: no value yet
+                    node_values[i] = val
+        self.server.set_new_data(time, progress, node_values)
 
         return time + self.step_size
 
@@ -114,77 +120,60 @@ class MosaikWeb(mosaik_api.Simulator):
     def set_etypes(self, etype_conf):
         self.config['etypes'].update(etype_conf)
 
+    def set_views(self, views):
+        """Add named views of the topology that clients can subscribe to.
+
+        *views* maps view names to filters, e.g.::
+
+            {'feeder_1': {'include': [r'node_b1\\d$'], 'neighbors': 1}}
+
+        See :func:`mosaik_web.topology.filter_topology()` for the filter keys.
+
+        """
+        self.config['views'].update(views)
+
     def _build_topology(self):
         """Get all related entities, create the topology and set it to the
         web server."""
         logger.info('Creating topology ...')
 
         data = yield self.mosaik.get_related_entities()
-        nxg = nx.Graph()
-        nxg.add_nodes_from(data['nodes'].items())
-        nxg.add_edges_from(data['edges'])
 
         # Required for get_data() calls.
         full_id = '%s.%s' % (self.sid, self.eid)
-        self.related_entities = [(e, nxg.node[e]['type'])
-                                 for e in nxg.neighbors(full_id)]
-
-        self._clean_nx_graph(nxg)
-        self.server.topology = self._make_d3js_topology(nxg)
+        self.related_entities = []
+        for edge in data['edges']:
+            if full_id in edge[:2]:
+                other = edge[1] if edge[0] == full_id else edge[0]
+                self.related_entities.append(
+                    (other, data['nodes'][other]['type']))
+
+        self.server.topology = make_topology(
+            data['nodes'], data['edges'], self.config, self.start_date,
+            self.step_size)
+        self._make_attr_idx(self.server.topology['nodes'])
+        self.server.set_views(self.config['views'])
+        self.server.delta_epsilon = self.config['delta_epsilon']
+        self.server.keyframe_interval = self.config['keyframe_interval']
+        self.server.client_queue = self.config['client_queue']
+        self.server.client_max_lag = self.config['client_max_lag']
         self.server.topology_ready.succeed()
 
         logger.info('Topology created')
 
-    def _clean_nx_graph(self, nxg):
-        """Remove and merge nodes and edges according to ``self.ignore_types``
-        and ``self.merge_types``."""
-        nxg.remove_nodes_from([n for n, d in nxg.node.items()
-                               if d['type'] in self.config['ignore_types']])
-        for node in [n for n, d in nxg.node.items()
-                     if d['type'] in self.config['merge_types']]:
-
-
-
-            new_edge = nxg.neighbors(node)
-
-              # unroll key iterator
-            new_edge = [key for key in new_edge]
-            assert len((new_edge)) == 2, new_edge
-            nxg.remove_node(node)
-            nxg.add_edge(*new_edge)
-
-    def _make_d3js_topology(self, nxg):
-        """Create the topology for D3JS."""
-        # We have to use two loops to make sure "node_idx" is filled for the
-        # second one.
-        topology = {
-            'start_date': self.start_date,
-            'update_interval': self.step_size,
-            'timeline_hours': self.config['timeline_hours'],
-            'disable_heatmap': self.config['disable_heatmap'],
-            'etypes': self.config['etypes'],
-            'nodes': [],
-            'links': [],
-        }
-        node_idx = {}
-
-        for node, attrs in nxg.node.items():
-            node_idx[node] = len(topology['nodes'])
-            type = attrs['type']
-            topology['nodes'].append({
-                'name': node,
-                'type': type,
-                'value': 0,
-            })
-
-        for source, target in nxg.edges():
-            topology['links'].append({
-                'source': node_idx[source],
-                'target': node_idx[target],
-                'length': 0,  # TODO: Add eddge data['length'],
-            })
-
-        return topology
+    def _make_attr_idx(self, nodes):
+        """Map each input attribute to the indexes of the nodes displaying it
+        (see the *attr* of the etypes) and allocate the value array for
+        :meth:`step()`.  Nodes without an *attr* keep the value ``0``."""
+        etype_conf = self.config['etypes']
+        self.attr_idx = {}
+        for i, node in enumerate(nodes):
+            try:
+                attr = etype_conf[node['type']]['attr']
+            except KeyError:
+                continue
+            self.attr_idx.setdefault(attr, {})[node['name']] = i
+        self.node_values = array('d', [0]) * len(nodes)
 
 
 def main():
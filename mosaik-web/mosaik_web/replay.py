@@ -0,0 +1,252 @@
+"""
+Replay a simulation recorded by the mosaik-hdf5 database in the browser.
+
+The entities and their relations are read from the *Relations* group of
+the file, the node values from the *Series* group.  Values are read lazily
+in chunks of *chunk_size* steps, so recordings do not have to fit into
+memory.
+
+The start date and step size are read from the attributes of the file's
+root group and the entity types from the *type* attribute of each series
+(see ``set_meta_data()`` and ``set_static_data()`` of mosaik-hdf5).  For
+recordings without them, use ``--start-date``, ``--step-size`` and the
+*replay_types* config value (a list of ``[regex, type]`` pairs matched
+against the entity IDs).
+
+The config file is a JSON object with the same keys as
+:func:`mosaik_web.mosaik.MosaikWeb.set_config()`, e.g.::
+
+    {
+        "ignore_types": ["Topology", "ResidentialLoads", "Grid"],
+        "etypes": {
+            "PQBus": {"cls": "pqbus", "attr": "Vm", "unit": "U [V]",
+                      "default": 10000, "min": 9000, "max": 11000}
+        }
+    }
+
+Clients can change the replay speed (``speed <factor>``, ``0`` pauses it)
+and jump to a simulation time (``seek <seconds>``).
+
+"""
+import argparse
+import copy
+import json
+import logging
+import re
+
+from dateutil import tz
+import arrow
+import h5py
+import numpy as np
+
+from mosaik_web import server
+from mosaik_web.mosaik import DATE_FORMAT, default_config
+from mosaik_web.topology import make_topology
+
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1000  # Number of steps read at once
+TICK = 0.05  # Seconds between two checks for new steps
+
+
+class Replay(object):
+    """Stream the recording *filename* to the web *server* with *speed*
+    simulated seconds per second."""
+    def __init__(self, env, server, filename, config, speed=1.0,
+                 start_date=None, step_size=None, chunk_size=CHUNK_SIZE):
+        self.env = env
+        self.server = server
+        self.db = h5py.File(filename, 'r')
+        self.config = config
+        self.chunk_size = chunk_size
+
+        attrs = self.db.attrs
+        self.step_size = step_size or int(attrs.get('step_size', 60))
+        start_date = start_date or _str(attrs.get('start_date', ''))
+        if start_date:
+            dt = arrow.parser.DateTimeParser().parse(start_date, DATE_FORMAT)
+            start_date = arrow.get(dt, tz.tzlocal()).isoformat()
+        else:
+            start_date = arrow.get(0).isoformat()
+
+        nodes, edges = self._read_graph()
+        topology = make_topology(nodes, edges, config, start_date,
+                                 self.step_size)
+        self.datasets = self._find_datasets(topology['nodes'])
+        self.num_steps = max([len(ds) for ds in self.datasets
+                              if ds is not None] or [0])
+        topology['replay'] = {
+            'end': self.num_steps * self.step_size,
+            'speed': speed,
+        }
+        logger.info('Replaying %d steps of %d nodes from "%s"' %
+                    (self.num_steps, len(topology['nodes']), filename))
+
+        self.speed = speed
+        self.step = 0  # Next step to send
+        self._origin = (env.now, 0)  # Wall time and step of the last (re)start
+        self.chunk = None  # Values of the current chunk (steps x nodes)
+        self.chunk_start = None
+
+        server.topology = topology
+        server.set_views(config['views'])
+        server.delta_epsilon = config['delta_epsilon']
+        server.keyframe_interval = config['keyframe_interval']
+        server.client_queue = config['client_queue']
+        server.client_max_lag = config['client_max_lag']
+        server.commands['seek'] = self.seek
+        server.commands['speed'] = self.set_speed
+        server.topology_ready.succeed()
+
+        env.process(self._run())
+
+    def seek(self, client, time):
+        """Continue the replay at the simulation time *time* (in seconds)."""
+        step = int(float(time) // self.step_size)
+        self.step = min(max(step, 0), max(self.num_steps - 1, 0))
+        self._origin = (self.env.now, self.step)
+        self.server.history = None  # The timeline starts again
+        logger.info('Seeking to step %d' % self.step)
+
+    def set_speed(self, client, speed):
+        """Set the replay *speed* (``0`` pauses the replay)."""
+        speed = float(speed)
+        if speed < 0:
+            raise ValueError('speed must be >= 0')
+        self.speed = speed
+        self.server.topology['replay']['speed'] = speed
+        self._origin = (self.env.now, self.step)
+
+    def values(self, step):
+        """Return the values of all nodes at *step* in node index order."""
+        if (self.chunk is None or
+                not 0 <= step - self.chunk_start < len(self.chunk)):
+            self._read_chunk(step - step % self.chunk_size)
+        return self.chunk[step - self.chunk_start].tolist()
+
+    def _run(self):
+        server = self.server
+        max_steps = server.max_buffered_steps
+        while True:
+            yield self.env.timeout(TICK)
+            if self.speed == 0 or self.step >= self.num_steps:
+                continue
+
+            t0, step0 = self._origin
+            target = step0 + int((self.env.now - t0) * self.speed /
+                                 self.step_size)
+            target = min(target, self.num_steps - 1)
+            if target - self.step >= max_steps:
+                # Too fast to send every step, skip to the latest ones
+                self.step = target - max_steps + 1
+            while self.step <= target:
+                progress = 100 * (self.step + 1) / self.num_steps
+                server.set_new_data(self.step * self.step_size, progress,
+                                    self.values(self.step))
+                self.step += 1
+
+    def _read_chunk(self, start):
+        end = min(start + self.chunk_size, self.num_steps)
+        chunk = np.zeros((end - start, len(self.datasets)))
+        for i, ds in enumerate(self.datasets):
+            if ds is not None and start < len(ds):
+                data = ds[start:end]
+                chunk[:len(data), i] = data
+        self.chunk = chunk
+        self.chunk_start = start
+
+    def _read_graph(self):
+        """Return the recorded entities with their type and the edges
+        between them (like mosaik's ``get_related_entities()``)."""
+        series = self.db['Series']
+        rels = self.db['Relations']
+        types = [(re.compile(pattern), type) for pattern, type
+                 in self.config.get('replay_types', [])]
+
+        nodes = {}
+        for name in series:
+            type = _str(series[name].attrs.get('type', ''))
+            if not type:
+                type = _guess_type(name, types)
+            nodes[name] = {'type': type}
+
+        edges = []
+        for name in rels:
+            if name not in nodes:
+                continue
+            for rel in rels[name][:]:
+                other = _str(rel[0]).rsplit('/', 1)[1]
+                if other in nodes and name < other:
+                    edges.append((name, other))
+
+        return nodes, edges
+
+    def _find_datasets(self, nodes):
+        """Return the dataset with the values of each node (``None`` for
+        nodes without an *attr* or without data)."""
+        etypes = self.config['etypes']
+        series = self.db['Series']
+        datasets = []
+        for node in nodes:
+            try:
+                ds = series[node['name']][etypes[node['type']]['attr']]
+            except KeyError:
+                ds = None
+            datasets.append(ds)
+        return datasets
+
+
+def _str(value):
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+def _guess_type(name, types):
+    """Guess the entity type from its ID, e.g. ``House`` for
+    ``HouseholdSim-0.House_3``."""
+    for regex, type in types:
+        if regex.search(name):
+            return type
+    eid = name.split('.', 1)[-1]
+    eid = re.sub(r'^\d+-', '', eid)
+    return re.sub(r'_?\d+$', '', eid)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Replay a mosaik-hdf5 recording in the browser.')
+    parser.add_argument('filename', help='HDF5 file written by mosaik-hdf5')
+    parser.add_argument('-s', '--serve', default='127.0.0.1:8000',
+                        help='host and port for the webserver '
+                             '[default: %(default)s]')
+    parser.add_argument('-c', '--config',
+                        help='JSON file with the mosaik-web config')
+    parser.add_argument('--speed', type=float, default=60.0,
+                        help='simulated seconds per second '
+                             '[default: %(default)s]')
+    parser.add_argument('--start-date',
+                        help='start date of the recording (%s)' % DATE_FORMAT)
+    parser.add_argument('--step-size', type=int,
+                        help='step size of the recording in seconds')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    config = copy.deepcopy(default_config)
+    if args.config:
+        with open(args.config) as f:
+            config.update(json.load(f))
+
+    host, port = args.serve.rsplit(':', 1)
+    env = server.backend.Environment()
+    server_sock = server.backend.TCPSocket.server(env, (host, int(port)))
+    web = server.Server(env, server_sock)
+    Replay(env, web, args.filename, config, args.speed, args.start_date,
+           args.step_size)
+    try:
+        env.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -2,19 +2,301 @@
 This module contains a simple simpy.io based webserver with websockets.
 
 """
+from collections import deque
+import functools
+import gzip
+import hashlib
 import json
 import logging
 import mimetypes
 import os.path
+import struct
+from array import array
 
 from simpy.io import select as backend
 from simpy.io.http import Service
 from simpy.io.websocket import WebSocket
 
+from mosaik_web.history import History, TIMELINE_POINTS
+from mosaik_web.topology import filter_topology
+
 
 logger = logging.getLogger(__name__)
 
 UPDATE_INTERVAL = 0.25
+KEYFRAME_INTERVAL = 10  # Seconds between two keyframes (full node states)
+CLIENT_QUEUE = 8  # Updates queued per client before they are collapsed
+CLIENT_MAX_LAG = 30  # Clients lagging more seconds behind are dropped
+MAX_BUFFERED_STEPS = 100  # Steps buffered per update before they are merged
+STATS_INTERVAL = 60  # Seconds between two client statistics log messages
+STATIC_MAX_AGE = 60  # Seconds browsers may use static files without asking
+
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct('<BBHfdII')
+"""Header of binary updates: version, flags (1: keyframe), number of steps,
+progress, time, number of nodes and four reserved bytes."""
+FLAG_KEYFRAME = 1
+
+
+def encode_binary(data):
+    """Encode the update *data* as binary websocket message.
+
+    The header (see :data:`BINARY_HEADER`) is followed by one block per step
+    with the number of changed nodes *k* (uint32), their indexes (*k* uint32)
+    and values (*k* float32).  A keyframe adds the values of all nodes in
+    node index order (float32).  All numbers are little-endian.
+
+    """
+    keyframe = data.get('keyframe')
+    parts = [BINARY_HEADER.pack(
+        BINARY_VERSION, FLAG_KEYFRAME if keyframe is not None else 0,
+        len(data['node_data']), data['progress'], data['time'],
+        data['num_nodes'], 0)]
+    for idx, vals in data['node_data']:
+        parts += [struct.pack('<I', len(idx)), _le(idx),
+                  _le(array('f', vals))]
+    if keyframe is not None:
+        parts.append(_le(array('f', keyframe)))
+    return b''.join(parts)
+
+
+def encode_json(data, node_names):
+    """Encode the update *data* as JSON websocket message.
+
+    The deltas and the keyframe map node names to values.
+
+    """
+    msg = {
+        'time': data['time'],
+        'progress': data['progress'],
+        'node_data': [{node_names[i]: val for i, val in zip(idx, vals)}
+                      for idx, vals in data['node_data']],
+    }
+    keyframe = data.get('keyframe')
+    if keyframe is not None:
+        msg['keyframe'] = dict(zip(node_names, keyframe))
+    return json.dumps(['update_data', msg])
+
+
+def merge_deltas(deltas):
+    """Merge a list of ``(indexes, values)`` deltas into one delta with the
+    latest value of each node."""
+    merged = {}
+    for idx, vals in deltas:
+        merged.update(zip(idx, vals))
+    idx = sorted(merged)
+    return array('I', idx), array('d', [merged[i] for i in idx])
+
+
+def _le(arr):
+    if struct.pack('=H', 1) != struct.pack('<H', 1):
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+class Update(object):
+    """An update for the clients, encoded at most once per format.
+
+    *data* contains the *time*, *progress* and number of nodes (*num_nodes*)
+    of the update, the deltas of the steps since the last update as list of
+    ``(indexes, values)`` arrays (*node_data*) and optionally the values of
+    all nodes (*keyframe*).
+
+    """
+    def __init__(self, data, node_names, created=None):
+        self.data = data
+        self.node_names = node_names
+        self.created = created
+        """Time at which the oldest data of the update was available."""
+        self._msgs = {}
+
+    def encode(self, binary=False):
+        msg = self._msgs.get(binary)
+        if msg is None:
+            if binary:
+                msg = encode_binary(self.data)
+            else:
+                msg = encode_json(self.data, self.node_names)
+            self._msgs[binary] = msg
+        return msg
+
+
+class StaticFile(object):
+    """A static file with its precompressed content and ETag."""
+    def __init__(self, path):
+        stat = os.stat(path)
+        self.mtime = stat.st_mtime
+        self.size = stat.st_size
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        self.etag = '"%s"' % hashlib.sha1(self.data).hexdigest()[:20]
+
+        content_type = mimetypes.guess_type(path)[0]
+        if content_type is None:
+            content_type = 'application/octet-stream'
+        compressible = (content_type.startswith('text/') or
+                        content_type.endswith(('javascript', 'json', 'xml')))
+        if content_type.startswith('text/'):
+            content_type = '%s; charset=utf-8' % content_type
+        self.content_type = content_type
+
+        self.gzip_data = None
+        if compressible:
+            data = gzip.compress(self.data, 9)
+            if len(data) < len(self.data):
+                self.gzip_data = data
+
+    def is_current(self, stat):
+        return stat.st_mtime == self.mtime and stat.st_size == self.size
+
+
+def etag_matches(header, etag):
+    """Return whether the *If-None-Match* *header* matches *etag*.
+
+    The header is a comma separated list of (weak or strong) entity tags or
+    ``*``.
+
+    """
+    if not header:
+        return False
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == '*' or tag == etag:
+            return True
+    return False
+
+
+class View(object):
+    """A named part of the topology that clients can subscribe to.
+
+    *indexes* are the indexes of the view's nodes in the full topology.
+
+    """
+    def __init__(self, name, topology, indexes):
+        self.name = name
+        self.topology = topology
+        self.node_names = [node['name'] for node in topology['nodes']]
+        self.indexes = indexes
+        self.position = {i: j for j, i in enumerate(indexes)}
+
+    def filter(self, data):
+        """Return the update *data* reduced to the nodes of the view."""
+        position = self.position
+        node_data = []
+        for idx, vals in data['node_data']:
+            view_idx = array('I')
+            view_vals = array('d')
+            for i, val in zip(idx, vals):
+                j = position.get(i)
+                if j is not None:
+                    view_idx.append(j)
+                    view_vals.append(val)
+            node_data.append((view_idx, view_vals))
+
+        view_data = dict(data, num_nodes=len(self.indexes),
+                         node_data=node_data)
+        keyframe = data.get('keyframe')
+        if keyframe is not None:
+            view_data['keyframe'] = array('d',
+                                          [keyframe[i] for i in self.indexes])
+        return view_data
+
+
+class Reply(object):
+    """A JSON message for one client (e.g., the answer to a command)."""
+    def __init__(self, msg, created):
+        self.msg = msg
+        self.created = created
+
+    def encode(self, binary=False):
+        return self.msg
+
+
+class Client(object):
+    """A websocket client with a bounded queue of pending updates.
+
+    If more than *max_queue* updates are pending, they are replaced with one
+    keyframe of the current state.  Clients whose oldest pending update is
+    more than *max_lag* seconds old are dropped.
+
+    """
+    def __init__(self, env, addr, max_queue, max_lag):
+        self.env = env
+        self.addr = addr
+        self.max_queue = max_queue
+        self.max_lag = max_lag
+        self.view = None  # Name of the subscribed view (None: all nodes)
+        self.queue = deque()
+        self.replies = deque()  # Replies are sent before queued updates
+        self.wakeup = None  # Triggered when the queue is no longer empty
+        self.dropped = env.event()
+        self.sent = 0
+        self.collapsed = 0  # Number of times the queue was collapsed
+        self.lag = 0  # Lag of the last update that was sent
+        self.lag_sum = 0
+        self.lag_max = 0
+
+    def push(self, update, make_keyframe):
+        """Queue *update* or, if the queue is full, a keyframe created with
+        *make_keyframe(created)*."""
+        queue = self.queue
+        if len(queue) >= self.max_queue:
+            created = queue[0].created
+            queue.clear()
+            queue.append(make_keyframe(created))
+            self.collapsed += 1
+        else:
+            queue.append(update)
+
+        if self.env.now - queue[0].created > self.max_lag:
+            self.drop()
+        elif self.wakeup is not None and not self.wakeup.triggered:
+            self.wakeup.succeed()
+
+    def reply(self, msg):
+        """Send the JSON message *msg* to the client."""
+        self.replies.append(Reply(msg, self.env.now))
+        if self.wakeup is not None and not self.wakeup.triggered:
+            self.wakeup.succeed()
+
+    def get(self):
+        """Wait for and return the next update or reply (``None`` if the
+        client was dropped)."""
+        while not (self.queue or self.replies):
+            self.wakeup = self.env.event()
+            yield self.wakeup | self.dropped
+            if self.dropped.triggered:
+                return None
+        if self.replies:
+            return self.replies.popleft()
+        return self.queue.popleft()
+
+    def done(self, update):
+        """Record that *update* has been sent."""
+        self.lag = self.env.now - update.created
+        self.lag_sum += self.lag
+        self.lag_max = max(self.lag_max, self.lag)
+        self.sent += 1
+
+    def drop(self):
+        if not self.dropped.triggered:
+            logger.warning('Dropping websocket client %s (%s)' %
+                           (self.addr, self.stats()))
+            self.dropped.succeed()
+
+    def stats(self):
+        return {
+            'view': self.view,
+            'sent': self.sent,
+            'queued': len(self.queue),
+            'collapsed': self.collapsed,
+            'lag': round(self.lag, 3),
+            'lag_mean': round(self.lag_sum / max(self.sent, 1), 3),
+            'lag_max': round(self.lag_max, 3),
+        }
 
 
 class Server(object):
@@ -25,27 +307,107 @@ class Server(object):
         self.basedir = os.path.abspath(os.path.join(os.path.dirname(__file__),
                                                     'html'))
         """Base directory for static files."""
+        self.static_files = {}  # Maps paths to StaticFile instances
+        self.static_max_age = STATIC_MAX_AGE
 
         self.topology_ready = env.event()
         self.topology = None
+        self.delta_epsilon = 0
+        """Value changes up to this threshold are not sent to the clients."""
+        self.keyframe_interval = KEYFRAME_INTERVAL
+        self.client_queue = CLIENT_QUEUE
+        self.client_max_lag = CLIENT_MAX_LAG
+        self.max_buffered_steps = MAX_BUFFERED_STEPS
+        self.state = None  # Node values as known by the clients
+        self.values = None  # Node values of the last step, for the timeline
+        self.node_names = None  # Node names in node index order
+        self.node_idx = None  # Maps node names to their index in the topology
+        self.time = None
+        self.progress = None
         self.data_buf = None
-        self.wait_for_update = []  # List of events to be triggered on updates
+        self.data_created = None  # Time of the first step in data_buf
+        self.clients = []  # List of connected websocket clients
+        self.commands = {}
+        """Maps names of commands that clients may send to functions called
+        with the :class:`Client` and the rest of the message (e.g.,
+        ``'seek'`` for replays)."""
+        self.commands['timeline'] = self._send_timeline
+        self.history = None  # History of the node values for the timeline
+        self.views = {}  # Maps view names to View instances
+        self.timeline_points = TIMELINE_POINTS
         self._reset_data_buf()
 
         self.env.process(self._broadcast_update())
         self.env.process(self._serve())
 
     def _broadcast_update(self):
+        last_keyframe = self.env.now
+        last_stats = self.env.now
         while True:
             yield self.env.timeout(UPDATE_INTERVAL)
+            if self.clients and self.env.now - last_stats >= STATS_INTERVAL:
+                last_stats = self.env.now
+                for client in self.clients:
+                    logger.info('Websocket client %s: %s' %
+                                (client.addr, client.stats()))
+
+            created = self.data_created
             new_data = self._reset_data_buf()
             if new_data['progress'] is None:
                 continue
 
-            msg = json.dumps(['update_data', new_data])
-            for evt in self.wait_for_update:
-                evt.succeed(msg)
-            self.wait_for_update = []
+            if self.env.now - last_keyframe >= self.keyframe_interval:
+                # Let clients resync from time to time
+                new_data['keyframe'] = array('d', self.state)
+                last_keyframe = self.env.now
+            # Only compute and encode the views that clients subscribed to
+            updates = {None: Update(new_data, self.node_names, created)}
+            for client in self.clients:
+                update = updates.get(client.view)
+                if update is None:
+                    view = self.views[client.view]
+                    update = updates[client.view] = Update(
+                        view.filter(new_data), view.node_names, created)
+                client.push(update, functools.partial(self._keyframe,
+                                                      view=client.view))
+
+    def _keyframe(self, created=None, view=None):
+        """Return an update with the current state of all nodes (of
+        *view*)."""
+        data = {
+            'time': self.time,
+            'progress': self.progress,
+            'num_nodes': len(self.state),
+            'node_data': [],
+            'keyframe': array('d', self.state),
+        }
+        node_names = self.node_names
+        if view is not None:
+            data = self.views[view].filter(data)
+            node_names = self.views[view].node_names
+        return Update(data, node_names,
+                      self.env.now if created is None else created)
+
+    def set_views(self, specs):
+        """Create the views for the filters in *specs* (a dict mapping view
+        names to filters, see :func:`~mosaik_web.topology.filter_topology()`).
+
+        Must be called after setting the *topology*.
+
+        """
+        self.views = {}
+        for name, spec in specs.items():
+            topology, indexes = filter_topology(self.topology, spec)
+            topology['view'] = name
+            self.views[name] = View(name, topology, indexes)
+            logger.info('View "%s" with %d nodes' % (name, len(indexes)))
+        self.topology['views'] = sorted(self.views)
+        for view in self.views.values():
+            view.topology['views'] = self.topology['views']
+
+    def client_stats(self):
+        """Return a dict with statistics for each websocket client."""
+        return {client.addr: client.stats() for client in self.clients}
 
     def _serve(self):
         """Webserver main process."""
@@ -65,7 +427,7 @@ class Server(object):
                 request = yield service.recv()
                 yield request.read(all=True)
 
-                uri = request.uri
+                uri = request.uri.split('?', 1)[0]
                 if uri.endswith('/'):
                     uri += 'index.html'
 
@@ -74,15 +436,34 @@ class Server(object):
                     break
 
                 try:
-                    ctype, data = self.serve_static(uri)
+                    static = self.serve_static(uri)
                 except ValueError:
-                    yield request.respond(404, {
-                        'content-type': 'text/plain; charset=utf-8',
+                    yield request.respond(404, 'Not Found', {
+                        'Content-Type': 'text/plain; charset=utf-8',
                     }, data=b'Not found')
-                else:
-                    yield request.respond(200, {
-                        'content-type': ctype,
-                    }, data=data)
+                    continue
+
+                req_headers = {k.lower(): v
+                               for k, v in request.headers.items()}
+                headers = {
+                    'Cache-Control': 'public, max-age=%d' %
+                                     self.static_max_age,
+                    'ETag': static.etag,
+                    'Vary': 'Accept-Encoding',
+                }
+                if etag_matches(req_headers.get('if-none-match'),
+                                static.etag):
+                    yield request.respond(304, 'Not Modified', headers,
+                                          data=b'')
+                    continue
+
+                headers['Content-Type'] = static.content_type
+                data = static.data
+                if (static.gzip_data is not None and
+                        'gzip' in req_headers.get('accept-encoding', '')):
+                    headers['Content-Encoding'] = 'gzip'
+                    data = static.gzip_data
+                yield request.respond(200, 'OK', headers, data=data)
 
         except ConnectionError:
             logger.warning('socket ConnectionError in "Server.handler()"')
@@ -92,47 +473,184 @@ class Server(object):
         excess_data = service.decommission()
         socket = WebSocket(service.sock)
         socket.configure(False, headers=request.headers)
+        client = Client(self.env, service.sock.peer_address,
+                        self.client_queue, self.client_max_lag)
 
         try:
+            # "get_topology [binary] [view=<name>]": "binary" requests binary
+            # updates (see encode_binary()), else they are JSON.  Only the
+            # nodes of the view are sent (all nodes without a view).
             msg = yield socket.read()
-            assert msg == 'get_topology'
+            args = msg.split()
+            assert args[0] == 'get_topology'
+            binary = ('binary' in args[1:])
             yield self.topology_ready
-            yield socket.write(json.dumps(['setup_topology', self.topology]))
+            topology = self.topology
+            for arg in args[1:]:
+                if arg.startswith('view='):
+                    if arg[5:] in self.views:
+                        client.view = arg[5:]
+                        topology = self.views[client.view].topology
+                    else:
+                        logger.warning('Unknown view "%s"' % arg[5:])
+            yield socket.write(json.dumps(['setup_topology', topology]))
+            self.clients.append(client)
+            self.env.process(self._read_commands(socket, client))
+            if self.progress is not None:
+                # Late joiners start with a keyframe of the current state
+                make_keyframe = functools.partial(self._keyframe,
+                                                  view=client.view)
+                client.push(make_keyframe(), make_keyframe)
 
             while True:
-                evt_new_data = self.env.event()
-                self.wait_for_update.append(evt_new_data)
-                msg = yield evt_new_data
-                yield socket.write(msg)
+                update = yield from client.get()
+                if update is None:
+                    break
+                write = socket.write(update.encode(binary))
+                yield write | client.dropped
+                if not write.triggered:
+                    write.defused = True  # It fails when the socket closes
+                    break
+                client.done(update)
 
         except ConnectionError:
             logger.warning('websocket ConnectionError in "Server.websock()"')
         except OSError as e:
             logger.warning('websocket OSError in "Server.websocket()": %s' % e)
+        finally:
+            if client in self.clients:
+                self.clients.remove(client)
+            if client.dropped.triggered:
+                service.sock.close()
+
+    def _read_commands(self, socket, client):
+        """Process for the commands sent by a websocket client."""
+        try:
+            while not client.dropped.triggered:
+                read = socket.read()
+                yield read | client.dropped
+                if not read.triggered:
+                    read.defused = True
+                    break
+                cmd, _, arg = read.value.partition(' ')
+                if cmd not in self.commands:
+                    logger.warning('Unknown websocket command "%s"' % cmd)
+                    continue
+                try:
+                    self.commands[cmd](client, arg)
+                except ValueError as e:
+                    logger.warning('Invalid websocket command "%s": %s' %
+                                   (read.value, e))
+        except (ConnectionError, OSError):
+            pass
+
+    def _send_timeline(self, client, arg):
+        """Send the history of a node to *client*.
+
+        *arg* is a JSON object with the *node* name, the *start* and *end*
+        time (in simulation seconds) and the maximum number of *points*.
+
+        """
+        try:
+            req = json.loads(arg)
+            i = self.node_idx[req['node']]
+            start, end = float(req['start']), float(req['end'])
+            points = max(int(req['points']), 1)
+        except (TypeError, KeyError) as e:
+            raise ValueError(e)
+        data = self._get_history().query(i, start, end, points)
+        data['node'] = req['node']
+        client.reply(json.dumps(['timeline', data]))
 
     def serve_static(self, uri):
-        """Try to read and return a static file and its mime type."""
+        """Return the :class:`StaticFile` for *uri*.
+
+        Files are read once and reloaded when their mtime or size changes.
+        Raise a :exc:`ValueError` if there is no such file.
+
+        """
         req_path = os.path.abspath(os.path.join(self.basedir, uri.lstrip('/')))
-        if not req_path.startswith(self.basedir):
+        if not req_path.startswith(self.basedir + os.sep):
+            raise ValueError
+        try:
+            stat = os.stat(req_path)
+        except OSError:
             raise ValueError
         if not os.path.isfile(req_path):
             raise ValueError
 
-        content_type = mimetypes.guess_type(req_path)[0]
-        if content_type.startswith('text/'):
-            content_type = '%s; charset=utf-8' % content_type
-        return content_type, open(req_path, 'rb').read()
+        static = self.static_files.get(req_path)
+        if static is None or not static.is_current(stat):
+            static = self.static_files[req_path] = StaticFile(req_path)
+        return static
 
     def set_new_data(self, time, progress, node_data):
-        self.data_buf['time'] = time
-        self.data_buf['progress'] = progress
-        self.data_buf['node_data'].append(node_data)
+        """Buffer the node values of a step for the next update.
+
+        *node_data* is a sequence (e.g., an :class:`array.array`) with the
+        values of all nodes in node index order or a dict mapping node names
+        to values.  Only the nodes whose value changed by more than
+        *delta_epsilon* since it was last sent are buffered.
+
+        """
+        if self.node_idx is None:
+            self.node_names = [node['name'] for node in self.topology['nodes']]
+            self.node_idx = {name: i for i, name in enumerate(self.node_names)}
+        if isinstance(node_data, dict):
+            node_idx = self.node_idx
+            node_data = sorted((node_idx[node], val)
+                               for node, val in node_data.items())
+        else:
+            node_data = enumerate(node_data)
+
+        idx = array('I')
+        vals = array('d')
+        values = self.values
+        if values is None:
+            values = self.values = array('d', [0]) * len(self.node_names)
+        state = self.state
+        if state is None:
+            # Nothing sent yet; the first delta contains all nodes.
+            state = self.state = array('d', [0]) * len(self.node_names)
+            eps = -1
+        else:
+            eps = self.delta_epsilon
+        for i, val in node_data:
+            values[i] = val
+            if abs(val - state[i]) > eps:
+                idx.append(i)
+                vals.append(val)
+                state[i] = val
+        self._get_history().record(time, values)
+
+        self.time = time
+        self.progress = progress
+        buf = self.data_buf
+        buf['time'] = time
+        buf['progress'] = progress
+        buf['num_nodes'] = len(state)
+        if self.data_created is None:
+            self.data_created = self.env.now
+        if len(buf['node_data']) >= self.max_buffered_steps:
+            # The simulation is much faster than the updates; only keep the
+            # latest values of the buffered steps.
+            buf['node_data'] = [merge_deltas(buf['node_data'])]
+        buf['node_data'].append((idx, vals))
+
+    def _get_history(self):
+        if self.history is None:
+            self.history = History(self.topology['update_interval'],
+                                   self.topology['timeline_hours'] * 3600,
+                                   self.timeline_points)
+        return self.history
 
     def _reset_data_buf(self):
         data = self.data_buf
+        self.data_created = None
         self.data_buf = {
             'time': None,
             'progress': None,
+            'num_nodes': 0,
             'node_data': [],
         }
         return data
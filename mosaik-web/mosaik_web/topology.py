@@ -0,0 +1,145 @@
+"""
+Create the topology for the web client from the entity graph of a
+simulation.
+
+"""
+import re
+
+
+def make_topology(nodes, edges, config, start_date, update_interval):
+    """Create the topology for D3JS.
+
+    *nodes* maps entity IDs to dicts with their *type*, *edges* is a list of
+    entity ID pairs (as returned by mosaik's ``get_related_entities()``).
+
+    Nodes with one of the *ignore_types* of *config* are removed together
+    with their edges.  Nodes with one of the *merge_types* are replaced by
+    an edge between their two neighbors (chains of such nodes by one edge
+    between the ends of the chain).
+
+    """
+    ignore_types = set(config['ignore_types'])
+    merge_types = set(config['merge_types'])
+    topology = {
+        'start_date': start_date,
+        'update_interval': update_interval,
+        'timeline_hours': config['timeline_hours'],
+        'disable_heatmap': config['disable_heatmap'],
+        'etypes': config['etypes'],
+        'nodes': [],
+        'links': [],
+    }
+
+    node_idx = {}  # Maps the IDs of the visible nodes to their index
+    merged = {}  # Maps the IDs of nodes to merge to their neighbors
+    for node, attrs in nodes.items():
+        type = attrs['type']
+        if type in ignore_types:
+            continue
+        if type in merge_types:
+            merged[node] = []
+            continue
+        node_idx[node] = len(topology['nodes'])
+        topology['nodes'].append({
+            'name': node,
+            'type': type,
+            'value': 0,
+        })
+
+    links = set()
+    for edge in edges:
+        source, target = edge[0], edge[1]
+        if source in merged and (target in merged or target in node_idx):
+            if target not in merged[source]:
+                merged[source].append(target)
+        if target in merged and (source in merged or source in node_idx):
+            if source not in merged[target]:
+                merged[target].append(source)
+        if source in node_idx and target in node_idx:
+            links.add(_link(node_idx[source], node_idx[target]))
+
+    # Replace chains of merged nodes with a link between their two ends
+    visited = set()
+    for node in merged:
+        if node in visited:
+            continue
+        ends = []
+        stack = [node]
+        visited.add(node)
+        while stack:
+            current = stack.pop()
+            neighbors = merged[current]
+            assert len(neighbors) == 2, (current, neighbors)
+            for neighbor in neighbors:
+                if neighbor in node_idx:
+                    ends.append(node_idx[neighbor])
+                elif neighbor not in visited:
+                    visited.add(neighbor)
+                    stack.append(neighbor)
+        if len(ends) == 2 and ends[0] != ends[1]:
+            links.add(_link(*ends))
+
+    for source, target in sorted(links):
+        topology['links'].append({
+            'source': source,
+            'target': target,
+            'length': 0,  # TODO: Add eddge data['length'],
+        })
+
+    return topology
+
+
+def _link(a, b):
+    return (a, b) if a < b else (b, a)
+
+
+def filter_topology(topology, spec):
+    """Return the part of *topology* selected by the filter *spec* and the
+    indexes of its nodes in *topology*.
+
+    *spec* is a dict with these optional keys:
+
+    - *include*: list of regular expressions; only nodes whose name matches
+      one of them are selected.
+    - *exclude*: list of regular expressions for nodes not to select.
+    - *types*: list of node types to select.
+    - *neighbors*: also select the nodes up to this many links away from the
+      selected ones (e.g., the houses of a feeder's buses).
+
+    """
+    include = [re.compile(p) for p in spec.get('include', [])]
+    exclude = [re.compile(p) for p in spec.get('exclude', [])]
+    types = set(spec.get('types', []))
+
+    nodes = topology['nodes']
+    selected = set()
+    for i, node in enumerate(nodes):
+        name = node['name']
+        if include and not any(r.search(name) for r in include):
+            continue
+        if any(r.search(name) for r in exclude):
+            continue
+        if types and node['type'] not in types:
+            continue
+        selected.add(i)
+
+    neighbors = {}
+    for link in topology['links']:
+        neighbors.setdefault(link['source'], []).append(link['target'])
+        neighbors.setdefault(link['target'], []).append(link['source'])
+    frontier = selected
+    for _ in range(spec.get('neighbors', 0)):
+        frontier = {j for i in frontier for j in neighbors.get(i, [])
+                    if j not in selected}
+        selected |= frontier
+
+    indexes = sorted(selected)
+    position = {i: j for j, i in enumerate(indexes)}
+    view = dict(topology)
+    view['nodes'] = [nodes[i] for i in indexes]
+    view['links'] = [dict(link, source=position[link['source']],
+                          target=position[link['target']])
+                     for link in topology['links']
+                     if link['source'] in position and
+                     link['target'] in position]
+    return view, indexes
@@ -14,14 +14,17 @@ setup(
     install_requires=[
         'arrow>=0.4.2',
         'mosaik-api>=2.0',
-        'networkx>=1.9',
         'simpy.io>=0.2',
     ],
+    extras_require={
+        'replay': ['h5py>=2.2', 'numpy'],
+    },
     packages=find_packages(),
     include_package_data=True,
     entry_points={
         'console_scripts': [
             'mosaik-web = mosaik_web.mosaik:main',
+            'mosaik-web-replay = mosaik_web.replay:main',
         ],
     },
     classifiers=[
@@ -0,0 +1,57 @@
+from array import array
+
+import pytest
+
+from mosaik_web.history import History, NodeHistory
+
+
+def test_level_0_returns_each_step():
+    node = NodeHistory(60, 3600, points=100)
+    for t in range(0, 600, 60):
+        node.record(t, t / 60)
+    data = node.query(120, 300, 100)
+    assert data['bucket'] == 60
+    assert data['time'] == [120, 180, 240, 300]
+    assert data['mean'] == data['min'] == data['max'] == [2, 3, 4, 5]
+
+
+def test_long_spans_use_aggregated_levels():
+    node = NodeHistory(1, 1000, points=16, factor=4)
+    assert [level.bucket for level in node.levels] == [1, 4, 16, 64]
+    for t in range(100):
+        node.record(t, t % 4)
+    data = node.query(0, 99, 10)
+    assert data['bucket'] == 16
+    assert data['time'][:2] == [0, 16]
+    assert data['mean'][0] == pytest.approx(1.5)
+    assert data['min'][0] == 0
+    assert data['max'][0] == 3
+    # The last row aggregates the steps of the incomplete bucket
+    assert data['time'][-1] == 96
+    assert data['mean'][-1] == pytest.approx(1.5)
+
+
+def test_level_ring_buffer_overwrites_the_oldest_rows():
+    node = NodeHistory(1, 8, points=8)
+    for t in range(20):
+        node.record(t, t)
+    assert node.query(0, 20, 100)['time'] == list(range(12, 20))
+
+
+def test_only_requested_nodes_are_recorded():
+    history = History(60, 3600, max_nodes=2)
+    values = array('d', [1, 2, 3])
+    history.record(0, values)
+    assert history.query(1, 0, 60, 10)['time'] == []  # Recorded from now on
+    history.record(60, values)
+    assert history.query(1, 0, 60, 10)['mean'] == [2]
+    assert list(history.nodes) == [1]
+
+
+def test_least_recently_requested_node_is_dropped():
+    history = History(60, 3600, max_nodes=2)
+    history.query(0, 0, 60, 10)
+    history.query(1, 0, 60, 10)
+    history.query(0, 0, 60, 10)
+    history.query(2, 0, 60, 10)
+    assert list(history.nodes) == [0, 2]
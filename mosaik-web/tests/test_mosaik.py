@@ -0,0 +1,59 @@
+from mosaik_web.mosaik import MosaikWeb
+
+
+class FakeServer(object):
+    topology = {'nodes': []}
+
+    def set_new_data(self, time, progress, values):
+        self.data = (time, progress, list(values))
+
+
+class FakeMosaik(object):
+    def get_progress(self):
+        return 'get_progress'
+
+
+def make_sim():
+    sim = MosaikWeb()
+    sim.eid = 'topo'
+    sim.step_size = 60
+    sim.server = FakeServer()
+    sim.mosaik = FakeMosaik()
+    sim.config['etypes'] = {'PQBus': {'attr': 'Vm'}, 'House': {'attr': 'P_out'}}
+    sim._make_attr_idx([{'name': 'Grid-0.node_1', 'type': 'PQBus'}, {'name': 'Grid-0.node_2', 'type': 'PQBus'},
+                        {'name': 'House-0.House_0', 'type': 'House'}])
+    return sim
+
+
+def step(sim, time, inputs):
+    gen = sim.step(time, {'topo': inputs})
+    assert next(gen) == 'get_progress'
+    try:
+        gen.send(50.0)
+    except StopIteration as e:
+        return e.value
+
+
+def test_step_stores_values_by_node_index():
+    sim = make_sim()
+    inputs = {'Vm': {'Grid-0.node_2': 10.5, 'Grid-0.unknown': 1}, 'P_out': {'House-0.House_0': 300}, 'P': {'x': 1}}
+    assert step(sim, 0, inputs) == 60
+    assert sim.server.data == (0, 50.0, [0, 10.5, 300])
+
+
+def test_step_keeps_the_last_value_for_none():
+    sim = make_sim()
+    step(sim, 0, {'Vm': {'Grid-0.node_1': 9.5}})
+    step(sim, 60, {'Vm': {'Grid-0.node_1': None, 'Grid-0.node_2': None}})
+    assert sim.server.data[2] == [9.5, 0, 0]
+
+
+def test_config_is_not_shared():
+    sim = MosaikWeb()
+    sim.set_views({'feeder': {'include': ['node_b1']}})
+    sim.set_etypes({'PV': {'attr': 'P'}})
+    sim.set_config(timeline_hours=1)
+    other = MosaikWeb()
+    assert other.config['views'] == {}
+    assert other.config['etypes'] == {}
+    assert other.config['timeline_hours'] == 24
@@ -0,0 +1,98 @@
+from array import array
+import json
+import struct
+
+import pytest
+
+from mosaik_web.server import (BINARY_HEADER, BINARY_VERSION, FLAG_KEYFRAME,
+                               encode_binary, encode_json, etag_matches,
+                               merge_deltas)
+
+
+ETAG = '"0123456789abcdef0123"'
+
+
+@pytest.mark.parametrize('header, match', [
+    (None, False),
+    ('', False),
+    (ETAG, True),
+    ('W/' + ETAG, True),
+    ('"other", ' + ETAG, True),
+    ('"other",W/' + ETAG + ' ', True),
+    ('*', True),
+    ('"0123456789abcdef012"', False),  # A prefix of the tag
+    ('"x' + ETAG[1:], False),
+    ('"other"', False),
+])
+def test_etag_matches(header, match):
+    assert etag_matches(header, ETAG) is match
+
+
+def make_data(keyframe=None):
+    data = {
+        'time': 120,
+        'progress': 12.5,
+        'num_nodes': 3,
+        'node_data': [(array('I', [0, 2]), array('d', [1.5, -2.0])),
+                      (array('I', []), array('d', []))],
+    }
+    if keyframe is not None:
+        data['keyframe'] = keyframe
+    return data
+
+
+def test_encode_binary_deltas():
+    msg = encode_binary(make_data())
+    header = BINARY_HEADER.unpack_from(msg)
+    assert header == (BINARY_VERSION, 0, 2, 12.5, 120, 3, 0)
+    offset = BINARY_HEADER.size
+    assert struct.unpack_from('<I2I2f', msg, offset) == (2, 0, 2, 1.5, -2.0)
+    offset += 4 + 8 + 8
+    assert struct.unpack_from('<I', msg, offset) == (0,)
+    assert len(msg) == offset + 4
+
+
+def test_encode_binary_keyframe():
+    msg = encode_binary(make_data(keyframe=array('d', [1, 2, 3])))
+    assert BINARY_HEADER.unpack_from(msg)[1] == FLAG_KEYFRAME
+    assert struct.unpack('<3f', msg[-12:]) == (1, 2, 3)
+
+
+def test_encode_json():
+    msg = json.loads(encode_json(make_data(keyframe=[1, 2, 3]),
+                                 ['a', 'b', 'c']))
+    assert msg == ['update_data', {
+        'time': 120,
+        'progress': 12.5,
+        'node_data': [{'a': 1.5, 'c': -2.0}, {}],
+        'keyframe': {'a': 1, 'b': 2, 'c': 3},
+    }]
+
+
+def test_merge_deltas_keeps_the_latest_value():
+    idx, vals = merge_deltas([(array('I', [2, 0]), array('d', [1, 2])),
+                              (array('I', [2]), array('d', [3]))])
+    assert list(idx) == [0, 2]
+    assert list(vals) == [2, 3]
+
+
+@pytest.fixture
+def server():
+    from mosaik_web.server import Server, backend
+    env = backend.Environment()
+    sock = backend.TCPSocket.server(env, ('127.0.0.1', 0))
+    server = Server(env, sock)
+    server.topology = {'nodes': [{'name': 'a'}, {'name': 'b'}],
+                       'update_interval': 60, 'timeline_hours': 1}
+    yield server
+    sock.close()
+
+
+def test_history_records_the_raw_values(server):
+    server.delta_epsilon = 1.0
+    server.set_new_data(0, 0, [10.0, 0.0])
+    server.history.query(0, 0, 600, 10)
+    server.set_new_data(60, 1, [10.5, 0.0])
+    server.set_new_data(120, 2, {'a': 10.75})
+    assert list(server.state) == [10, 0]  # Changes below delta_epsilon
+    assert server.history.query(0, 0, 600, 10)['mean'] == [10.5, 10.75]
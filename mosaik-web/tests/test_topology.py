@@ -0,0 +1,90 @@
+import pytest
+
+from mosaik_web.mosaik import default_config
+from mosaik_web.topology import filter_topology, make_topology
+
+
+def make(nodes, edges, **config):
+    config = dict(default_config, **config)
+    return make_topology(nodes, edges, config, '2014-01-01T00:00:00+00:00', 60)
+
+
+def names(topology):
+    return [n['name'] for n in topology['nodes']]
+
+
+def links(topology):
+    nodes = topology['nodes']
+    return sorted((nodes[l['source']]['name'], nodes[l['target']]['name']) for l in topology['links'])
+
+
+NODES = {
+    'Grid-0.node_a': {'type': 'PQBus'},
+    'Grid-0.node_b': {'type': 'PQBus'},
+    'Grid-0.node_c': {'type': 'PQBus'},
+    'Grid-0.branch_1': {'type': 'Branch'},
+    'Grid-0.branch_2': {'type': 'Branch'},
+    'Grid-0.branch_3': {'type': 'Branch'},
+    'House-0.House_0': {'type': 'House'},
+    'WebVis-0.topo': {'type': 'Topology'},
+}
+EDGES = [
+    ('Grid-0.node_a', 'Grid-0.branch_1'), ('Grid-0.branch_1', 'Grid-0.node_b'),  # a - b
+    ('Grid-0.node_b', 'Grid-0.branch_2'), ('Grid-0.branch_2', 'Grid-0.branch_3'),  # Chain b - c
+    ('Grid-0.branch_3', 'Grid-0.node_c'),
+    ('House-0.House_0', 'Grid-0.node_c'),
+    ('House-0.House_0', 'WebVis-0.topo'), ('Grid-0.node_a', 'WebVis-0.topo'),
+]
+
+
+def test_make_topology_merges_and_ignores():
+    topology = make(NODES, EDGES)
+    assert sorted(names(topology)) == ['Grid-0.node_a', 'Grid-0.node_b', 'Grid-0.node_c', 'House-0.House_0']
+    assert links(topology) == [('Grid-0.node_a', 'Grid-0.node_b'), ('Grid-0.node_b', 'Grid-0.node_c'),
+                               ('Grid-0.node_c', 'House-0.House_0')]
+    assert topology['update_interval'] == 60
+    assert all(n['value'] == 0 for n in topology['nodes'])
+
+
+def test_make_topology_deduplicates_links():
+    topology = make(NODES, EDGES + [('Grid-0.node_c', 'House-0.House_0')])
+    assert len(topology['links']) == 3
+
+
+def test_make_topology_drops_ignored_types():
+    topology = make(NODES, EDGES, ignore_types=['Topology', 'House'])
+    assert 'House-0.House_0' not in names(topology)
+    assert len(topology['links']) == 2
+
+
+def test_make_topology_rejects_dangling_merge_nodes():
+    nodes = dict(NODES, **{'Grid-0.branch_4': {'type': 'Branch'}})
+    with pytest.raises(AssertionError):
+        make(nodes, EDGES + [('Grid-0.node_a', 'Grid-0.branch_4')])
+
+
+@pytest.fixture
+def topology():
+    return make(NODES, EDGES)
+
+
+def test_filter_include_and_neighbors(topology):
+    view, indexes = filter_topology(topology, {'include': [r'node_c$'], 'neighbors': 1})
+    assert sorted(names(view)) == ['Grid-0.node_b', 'Grid-0.node_c', 'House-0.House_0']
+    assert [topology['nodes'][i]['name'] for i in indexes] == names(view)
+    assert links(view) == [('Grid-0.node_b', 'Grid-0.node_c'), ('Grid-0.node_c', 'House-0.House_0')]
+
+
+def test_filter_types_and_exclude(topology):
+    view, indexes = filter_topology(topology, {'types': ['PQBus'], 'exclude': ['node_a']})
+    assert sorted(names(view)) == ['Grid-0.node_b', 'Grid-0.node_c']
+    assert links(view) == [('Grid-0.node_b', 'Grid-0.node_c')]
+    assert indexes == sorted(indexes)
+
+
+def test_filter_keeps_the_topology(topology):
+    before = links(topology)
+    view, _ = filter_topology(topology, {'include': ['House']})
+    assert links(topology) == before
+    assert view['start_date'] == topology['start_date']
+    assert view['links'] == []
@@ -17,8 +17,10 @@ import xlrd
 
 
 from mosaik_pypower import resource_db as rdb
+from output_writer import write_line
 
 logfile = './outputs/times.csv'
+topologyfile = 'data/demo_mv_grid.json'  # Grid with the switch states applied (see topology_refresh)
 
 # The line params that we read are for 1 of 3 wires within a cable,
 # but the loads and feed-in is meant for the complete cable, so we
@@ -435,6 +437,33 @@ TOPOLOGY related classes and functions
 """
 # rtu_info is a dict of the branch name and "True" or "False" indicator, e.g. {"branch_1: 1. branch_16: 0"}
 
+def merge_switch_commands(commands, last_seq, states=None):
+    """
+    Merge the switch commands of all RTUs into one set of changes.
+    :param commands: Dict mapping the source (RTU full id) to its command, either {'seq': n, 'switches': {branch:
+                     state}} or a legacy {branch: state} dict.
+    :param last_seq: Dict mapping sources to the last applied sequence number. Updated in place; commands with a
+                     sequence number not above it are stale and ignored.
+    :param states: Dict of the current switch states (branch: state). Updated in place; changes that match it are
+                   dropped.
+    :return: Dict {branch: state} of the changes to apply. Sources are merged in sorted order, so for conflicting
+             commands the last source wins.
+    """
+    merged = {}
+    for src in sorted(commands):
+        command = commands[src]
+        if 'switches' in command and 'seq' in command:
+            if command['seq'] <= last_seq.get(src, 0):
+                continue
+            last_seq[src] = command['seq']
+            command = command['switches']
+        merged.update(command)
+    if states is not None:
+        merged = {branch: state for branch, state in merged.items() if states.get(branch) != state}
+        states.update(merged)
+    return merged
+
+
 def topology_refresh(ref_topology, rtu_info=""):
     if rtu_info:
         with open(ref_topology) as ref_topology_file:
@@ -457,9 +486,9 @@ def topology_refresh(ref_topology, rtu_info=""):
             if n[1] == 'NONE':
                 n[1] = 'PQ'
 
-    with open('data/demo_mv_grid.json', 'w+') as outfile:
+    with open(topologyfile, 'w+') as outfile:
         json.dump(data, outfile, sort_keys=True, indent=4)
-    newtopology = 'data/demo_mv_grid.json'
+    newtopology = topologyfile
     return newtopology
 
 
@@ -579,6 +608,4 @@ def log_event(event):
         myCsvRow = "{};{};{}\n".format("PYPOWER-API", "New topology received.", format(datetime.now()))
     if event == "NC":
         myCsvRow = "{};{};{}\n".format("PYPOWER-API", "New command. Refresh topology.", format(datetime.now()))
-    fd = open(logfile, 'a')
-    fd.write(myCsvRow)
-    fd.close()
\ No newline at end of file
+    write_line(logfile, myCsvRow)
\ No newline at end of file
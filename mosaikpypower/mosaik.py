@@ -9,6 +9,7 @@ import os
 import mosaik_api
 
 from mosaikpypower import model
+import output_writer
 from datetime import datetime
 from topology_loader.topology_loader import topology_loader
 from distutils.util import strtobool
@@ -119,6 +120,10 @@ class PyPower(mosaik_api.Simulator):
         RECORD_TIMES = bool(strtobool(conf['recordtimes'].lower()))
         global RTU_STATS_OUTPUT
         RTU_STATS_OUTPUT = bool(strtobool(conf['rtu_stats_output'].lower()))
+        if conf.get('output_dir'):  # Per-run outputs instead of the shared outputs/ and data/ files
+            model.logfile = os.path.join(conf['output_dir'], 'times.csv')
+            model.topologyfile = os.path.join(conf['output_dir'], conf['grid_name'] + '.json')
+        self._outputs = [output_writer.acquire(model.logfile)]  # Output files closed in finalize
 
         # In PYPOWER loads are positive numbers and feed-in is expressed via
         # negative numbers. "init()" will that this flag to "1" in this case.
@@ -130,6 +135,8 @@ class PyPower(mosaik_api.Simulator):
         self._relations = []  # List of pair-wise related entities (IDs)
         self._ppcs = []  # The pypower cases
         self._cache = {}  # Cache for load flow outputs
+        self._switch_seq = {}  # Last applied switch command sequence number per RTU
+        self._switch_states = {}  # Switch states applied to the topology (branch: state)
 
     def init(self, sid, step_size, pos_loads=True):
         logger.debug('Power flow will be computed every %d seconds.' %
@@ -197,7 +204,13 @@ class PyPower(mosaik_api.Simulator):
         # First change the topology
         if 'PyPower' in inputs:
             if 'switchstates' in inputs['PyPower'].keys():   # sid: PyPower-0%    grideid: 0-grid
-                self.rtu_info = list(inputs['PyPower']['switchstates'].values())[0] #['RTUSim-0.0-rtu']
+                # Switch deltas of all RTUs, e.g. {'RTUSim-0.0-rtu': {'seq': 3, 'switches': {'branch_19': False}}}
+                changes = model.merge_switch_commands(inputs['PyPower']['switchstates'], self._switch_seq,
+                                                      self._switch_states)
+                self.rtu_info = changes
+            else:
+                changes = None
+            if changes:  # one topology update per step for all RTUs
                 if RECORD_TIMES:
                     model.log_event("NC")
                 self.newgrid = model.topology_refresh(self.newgrid, self.rtu_info)
@@ -283,6 +296,10 @@ class PyPower(mosaik_api.Simulator):
 
         return data
 
+    def finalize(self):
+        for path in self._outputs:
+            output_writer.release(path)
+
 
 
 def main():
@@ -0,0 +1,227 @@
+# benchmark.py
+
+"""
+Load generator for the RTU Modbus server.
+
+N client threads send a configurable mix of read and write requests to the registers of an RTU XML configuration
+and report the throughput, latency percentiles and error rate:
+
+    python -m mosaikrtu.benchmark data/basic_normal/rtu_info.xml --clients 16 --duration 30
+    python -m mosaikrtu.benchmark data/basic_normal/rtu_info.xml --serve --port 15020 --rate 2000 --write-ratio 0.1
+
+With --serve the RTU is served in-process on --host/--port, otherwise a running simulation is targeted (the address
+defaults to the one in the XML). Writes put the initial values of the XML back into the coils and holding registers,
+so they change the state of a running simulation; the default mix is read-only.
+"""
+import argparse
+import random
+import threading
+import time
+
+from pymodbus3.client.sync import ModbusTcpClient
+from pymodbus3.constants import Endian
+from pymodbus3.payload import BinaryPayloadBuilder
+
+from mosaikrtu import rtu_model
+from mosaikrtu.dvcd.loader import parse_rtu
+
+def percentile(values, q):
+    """
+    q-quantile of a sorted list.
+    """
+    if not values:
+        return 0.0
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def make_requests(conf, low=None, high=None):
+    """
+    Build the request targets from the register map.
+    :param conf: RTU configuration, see loader.parse_rtu.
+    :param low: Only use registers with an index of at least low.
+    :param high: Only use registers with an index of at most high.
+    :return: Tuple of the read and the write targets, lists of (type, index, count, values).
+    """
+    reads, writes = [], []
+    for label, reg in conf["register_list"]:
+        if (low is not None and reg.index < low) or (high is not None and reg.index > high):
+            continue
+        reads.append((reg.type, reg.index, reg.width, None))
+        if reg.type == "co":
+            writes.append((reg.type, reg.index, 1, bool(reg.value)))
+        elif reg.type == "hr" and reg.datatype in ("32bit_float", "64bit_float"):
+            writes.append((reg.type, reg.index, reg.width, reg.value))
+    return reads, writes
+
+
+class LoadClient(threading.Thread):
+    """
+    One Modbus client sending requests at a fixed rate (or as fast as possible) until the deadline.
+    """
+    def __init__(self, host, port, unit, reads, writes, write_ratio, rate, deadline, seed):
+        threading.Thread.__init__(self, daemon=True)
+        self.host = host
+        self.port = port
+        self.unit = unit
+        self.reads = reads
+        self.writes = writes
+        self.write_ratio = write_ratio if writes else 0.0
+        self.rate = rate
+        self.deadline = deadline
+        self.random = random.Random(seed)
+        self.latencies = {"read": [], "write": []}
+        self.errors = {"read": 0, "write": 0}
+
+    def run(self):
+        client = ModbusTcpClient(self.host, port=self.port)
+        client.connect()
+        interval = 1.0 / self.rate if self.rate else 0.0
+        due = time.perf_counter()
+        try:
+            while True:
+                now = time.perf_counter()
+                if now >= self.deadline:
+                    break
+                if interval:
+                    if now < due:
+                        time.sleep(due - now)
+                    due += interval
+                if self.random.random() < self.write_ratio:
+                    op, target = "write", self.random.choice(self.writes)
+                else:
+                    op, target = "read", self.random.choice(self.reads)
+                started = time.perf_counter()
+                try:
+                    response = self.send(client, op, target)
+                    error = response is None or getattr(response, "function_code", 0) > 0x80
+                except Exception:
+                    error = True
+                    client.close()
+                    client.connect()
+                self.latencies[op].append(time.perf_counter() - started)
+                self.errors[op] += error
+        finally:
+            client.close()
+
+    def send(self, client, op, target):
+        _type, index, count, value = target
+        if op == "read":
+            if _type == "co":
+                return client.read_coils(index, count, unit=self.unit)
+            if _type == "di":
+                return client.read_discrete_inputs(index, count, unit=self.unit)
+            if _type == "hr":
+                return client.read_holding_registers(index, count, unit=self.unit)
+            return client.read_input_registers(index, count, unit=self.unit)
+        if _type == "co":
+            return client.write_coil(index, value, unit=self.unit)
+        return client.write_registers(index, float_registers(value, count), unit=self.unit)
+
+
+def float_registers(value, count):
+    builder = BinaryPayloadBuilder(endian=Endian.Big)
+    if count == 2:
+        builder.add_32bit_float(value)
+    else:
+        builder.add_64bit_float(value)
+    return builder.to_registers()
+
+
+def report(clients, duration):
+    """
+    Print throughput, latency percentiles and error rate per operation and in total.
+    """
+    print("{:<6} {:>9} {:>10} {:>9} {:>9} {:>9} {:>9} {:>8}".format(
+        "op", "requests", "req/s", "p50 ms", "p90 ms", "p99 ms", "max ms", "errors"))
+    total = []
+    total_errors = 0
+    for op in ("read", "write", "total"):
+        if op == "total":
+            latencies, errors = sorted(total), total_errors
+        else:
+            latencies = sorted(l for c in clients for l in c.latencies[op])
+            errors = sum(c.errors[op] for c in clients)
+            total.extend(latencies)
+            total_errors += errors
+        if not latencies:
+            continue
+        print("{:<6} {:>9} {:>10.1f} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>7.2f}%".format(
+            op, len(latencies), len(latencies) / duration, percentile(latencies, 0.5) * 1e3,
+            percentile(latencies, 0.9) * 1e3, percentile(latencies, 0.99) * 1e3, latencies[-1] * 1e3,
+            100.0 * errors / len(latencies)))
+
+
+def serve(conf, host, port, step=0.1):
+    """
+    Serve the RTU of the configuration in this process. A thread publishes the datablock every step seconds, like
+    the simulation does, so client writes are taken over.
+    :return: Tuple of the started Server object and the unit id.
+    """
+    conf = dict(conf, ip=host, port=port)
+    datablock = rtu_model.create_datablock(conf)
+    server, unit = rtu_model.attach_server({}, conf, datablock)
+    server.daemon = True
+    server.start()
+
+    def publish():
+        while not server.do_stop.wait(step):
+            datablock.publish()
+    threading.Thread(target=publish, daemon=True).start()
+    time.sleep(0.5)
+    return server, unit
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Modbus load generator for the RTU server.")
+    parser.add_argument("rtu_file", help="RTU XML configuration with the register map")
+    parser.add_argument("--host", help="server address (default: ip of the XML, 127.0.0.1 with --serve)")
+    parser.add_argument("--port", type=int, help="server port (default: port of the XML)")
+    parser.add_argument("--unit", type=int, help="Modbus unit id (default: unit of the XML, else 1)")
+    parser.add_argument("--clients", type=int, default=4, help="number of concurrent clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="test duration in seconds")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="total request rate in requests/s, 0 for as fast as possible")
+    parser.add_argument("--write-ratio", type=float, default=0.0, help="fraction of write requests (0..1)")
+    parser.add_argument("--range", help="register index range LOW:HIGH to use")
+    parser.add_argument("--serve", action="store_true", help="serve the RTU in this process")
+    parser.add_argument("--publish-interval", type=float, default=0.1,
+                        help="with --serve, seconds between datablock publishes (simulation steps)")
+    parser.add_argument("--seed", type=int, default=23)
+    args = parser.parse_args(argv)
+
+    conf = parse_rtu(args.rtu_file)
+    host = args.host or ("127.0.0.1" if args.serve else conf["ip"])
+    port = args.port or conf["port"]
+    unit = args.unit or conf["unit"] or 1
+    low = high = None
+    if args.range:
+        low, high = [int(x) if x else None for x in args.range.split(":")]
+    reads, writes = make_requests(conf, low, high)
+    if not reads:
+        parser.error("no registers in range {}".format(args.range))
+
+    server = None
+    if args.serve:
+        server, unit = serve(conf, host, port, args.publish_interval)
+
+    print("[*] {} clients against {}:{} unit {} for {} s ({} read / {} write targets)".format(
+        args.clients, host, port, unit, args.duration, len(reads), len(writes)))
+    started = time.perf_counter()
+    deadline = started + args.duration
+    clients = [LoadClient(host, port, unit, reads, writes, args.write_ratio, args.rate / args.clients, deadline,
+                          args.seed + i) for i in range(args.clients)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    report(clients, time.perf_counter() - started)
+
+    if server is not None:
+        stats = server.stats.snapshot(unit)
+        print("[*] Server side: {} requests, {} errors, {} dropped writes, p50 {} us, p99 {} us".format(
+            stats["requests"], stats["errors"], server.datablocks[unit].dropped(), stats["p50_us"], stats["p99_us"]))
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
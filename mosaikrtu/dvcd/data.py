@@ -1,5 +1,10 @@
-from pymodbus3.datastore import ModbusSequentialDataBlock
+import threading
+import time
+from array import array
+from collections import deque
+
 from pymodbus3.datastore import ModbusSlaveContext
+from pymodbus3.datastore.store import BaseModbusDataBlock
 from pymodbus3.payload import BinaryPayloadBuilder
 from pymodbus3.payload import BinaryPayloadDecoder
 from pymodbus3.constants import Endian
@@ -15,19 +20,216 @@ ch.setFormatter(formatter)
 log.addHandler(ch)
 
 
+# Dense blocks are used when at least this fraction of the address span is configured, sparse blocks otherwise.
+DENSE_MIN_FILL = 0.5
 
-class DataBlock(object):
+# Seconds between two log messages about client writes dropped on a full queue.
+DROP_LOG_INTERVAL = 10.0
+
+# Storage type codes of the dense blocks: 16 bit registers and single byte coils / inputs.
+TYPECODES = {"di": "B", "co": "B", "hr": "H", "ir": "H"}
+
+
+def _as_list(values):
+    if isinstance(values, (list, array)):
+        return values
+    if isinstance(values, tuple):
+        return list(values)
+    return [values]
+
+
+class BufferedDataBlock(BaseModbusDataBlock):
+    """
+    Double-buffered sequential Modbus data block.
+
+    The simulation writes into a back buffer (stage) and makes it visible with publish(), which is a single
+    reference swap. The Modbus server threads read the published front buffer (self.values) without any lock, so a
+    multi-register value is never seen half written.
+    Client writes (coils, holding registers) are applied to a copy of the front buffer and queued, the simulation
+    merges them into the back buffer. The queue is bounded; when it is full the write fails and the client gets an
+    exception response; the dropped writes are counted in self.dropped.
+    With a typecode the buffers are array.array objects ('H' for registers, 'B' for bits) instead of lists.
+    """
+    def __init__(self, address, values, max_pending=64, typecode=None):
+        self.address = address
+        self.typecode = typecode
+        self.values = self._copy(values)  # Front buffer, read by the server threads
+        self.default_value = 0
+        self._back = self._copy(values)  # Back buffer, only touched by the simulation
+        self._pending = deque()
+        self.max_pending = max_pending
+        self.dropped = 0  # Client writes dropped on a full queue
+        self._dropped_logged = 0  # Value of self.dropped at the last log message
+        self._drop_log_time = None
+        self._write_lock = threading.Lock()  # Serializes client writes and publish(), never taken by readers
+
+    def validate(self, address, count=1):
+        """
+        Check if the requested range lies within the block.
+        """
+        return self.address <= address and self.address + len(self.values) >= address + count
+
+    def get_values(self, address, count=1):
+        """
+        Read values from the published front buffer. Used by the Modbus server.
+        """
+        return self._read(self.values, address - self.address, count)
+
+    def set_values(self, address, values):
+        """
+        Write values on behalf of a Modbus client. Used by the Modbus server.
+        """
+        values = _as_list(values)
+        start = address - self.address
+        with self._write_lock:
+            if len(self._pending) >= self.max_pending:
+                self._drop(address)
+                raise IOError("Client write queue full")
+            self._pending.append((start, values))
+            front = self._copy(self.values)
+            self._write(front, start, values)
+            self.values = front
+
+    def reset(self):
+        with self._write_lock:
+            self._pending.clear()
+            self._back = self._copy([self.default_value] * len(self._back))
+            self.values = self._copy(self._back)
+
+    def peek(self, address, count=1):
+        """
+        Read values from the back buffer. Used by the simulation.
+        """
+        return self._read(self._back, address - self.address, count)
+
+    def stage(self, address, values):
+        """
+        Write values into the back buffer. Used by the simulation; not visible to clients before publish().
+        """
+        self._write(self._back, address - self.address, _as_list(values))
+
+    def merge(self):
+        """
+        Apply the queued client writes to the back buffer.
+        :return: Number of merged writes.
+        """
+        with self._write_lock:
+            return self._merge()
+
+    def publish(self):
+        """
+        Merge pending client writes and make the back buffer the new front buffer.
+        """
+        with self._write_lock:
+            self._merge()
+            self.values = self._back
+            self._back = self._copy(self._back)
+
+    def _drop(self, address):
+        # Log the first drop and then at most every DROP_LOG_INTERVAL seconds, a flooding client would flood the log.
+        self.dropped += 1
+        now = time.monotonic()
+        if self._drop_log_time is None or now - self._drop_log_time >= DROP_LOG_INTERVAL:
+            log.warning("Client write queue full, dropped {} write(s) (last to {})".format(
+                self.dropped - self._dropped_logged, address))
+            self._drop_log_time = now
+            self._dropped_logged = self.dropped
+
+    def _merge(self):
+        merged = len(self._pending)
+        while self._pending:
+            start, values = self._pending.popleft()
+            self._write(self._back, start, values)
+        return merged
+
+    # Storage access, overridden by SparseDataBlock. Offsets are relative to self.address.
+    def _copy(self, values):
+        if self.typecode is None:
+            return list(values)
+        return array(self.typecode, values)
+
+    def _read(self, buf, start, count):
+        if self.typecode is None:
+            return buf[start:start + count]
+        return buf[start:start + count].tolist()
+
+    def _write(self, buf, start, values):
+        if self.typecode is not None and not isinstance(values, array):
+            values = array(self.typecode, values)
+        buf[start:start + len(values)] = values
+
+
+class SparseDataBlock(BufferedDataBlock):
     """
-    Not locked at the moment! =)
+    Double-buffered Modbus data block for scattered addresses. Only the configured addresses are stored (in dicts
+    mapping the offset from self.address to the value), reads of the gaps in between return 0.
+    """
+    def __init__(self, address, size, values, max_pending=64):
+        """
+        :param address: First address of the block.
+        :param size: Number of addresses spanned by the block.
+        :param values: Dict mapping the configured addresses to their initial values.
+        """
+        self.size = size
+        BufferedDataBlock.__init__(self, address, {a - address: v for a, v in values.items()}, max_pending)
+
+    def validate(self, address, count=1):
+        return self.address <= address and self.address + self.size >= address + count
+
+    def reset(self):
+        with self._write_lock:
+            self._pending.clear()
+            self._back = dict.fromkeys(self._back, self.default_value)
+            self.values = dict(self._back)
+
+    def _copy(self, values):
+        return dict(values)
 
-    Locking Datablock.
-    Can't be simultaniously read from and/or written to. Threads beyond the first would get in line.
+    def _read(self, buf, start, count):
+        return [buf.get(offset, 0) for offset in range(start, start + count)]
+
+    def _write(self, buf, start, values):
+        for offset, value in enumerate(values, start):
+            buf[offset] = value
+
+
+def make_block(_type, addresses=None):
+    """
+    Create the data block for one register type.
+    :param _type: Type of modbus register ('co', 'di', 'hr', 'ir')
+    :param addresses: Register indexes used by the configuration, or None for the legacy 0xFF register block.
+    :return: BufferedDataBlock spanning the used addresses; dense if they fill at least DENSE_MIN_FILL of the span.
     """
-    def __init__(self):
-        self.di = ModbusSequentialDataBlock(0x00, [0]*0xFF)
-        self.co = ModbusSequentialDataBlock(0x00, [0]*0xFF)
-        self.hr = ModbusSequentialDataBlock(0x00, [0]*0xFF)
-        self.ir = ModbusSequentialDataBlock(0x00, [0]*0xFF)
+    typecode = TYPECODES[_type]
+    if addresses is None:
+        return BufferedDataBlock(0x00, [0]*0xFF, typecode=typecode)
+    addresses = set(addresses)
+    if not addresses:
+        return BufferedDataBlock(0x01, [], typecode=typecode)
+    # The slave context adds 1 to the requested address, the blocks start one above the lowest index.
+    low, high = min(addresses) + 1, max(addresses) + 1
+    span = high - low + 1
+    if len(addresses) >= DENSE_MIN_FILL * span:
+        return BufferedDataBlock(low, [0] * span, typecode=typecode)
+    return SparseDataBlock(low, span, dict.fromkeys((a + 1 for a in addresses), 0))
+
+
+class DataBlock(object):
+    """
+    Double-buffered Datablock.
+    The simulation reads and writes the back buffers, the Modbus server reads the published snapshot.
+    Call merge() before reading values written by clients and publish() after a complete update.
+    """
+    def __init__(self, layout=None):
+        """
+        :param layout: Dict mapping register types to the register indexes they use (see loader.register_layout). Register
+        spaces are sized to fit; types missing from the layout get the legacy 0xFF register block.
+        """
+        layout = layout or {}
+        self.di = make_block("di", layout.get("di"))
+        self.co = make_block("co", layout.get("co"))
+        self.hr = make_block("hr", layout.get("hr"))
+        self.ir = make_block("ir", layout.get("ir"))
 
         self.store = ModbusSlaveContext(
             di=self.di,  # Single Byte, Read-Only
@@ -151,30 +353,50 @@ class DataBlock(object):
                 print("t: {}   a: {}   v: {}")
                 raise ValueError
 
+    def merge(self):
+        """
+        Merge the writes of Modbus clients into the back buffers.
+        :return: Number of merged client writes.
+        """
+        return sum(block.merge() for block in (self.di, self.co, self.hr, self.ir))
+
+    def dropped(self):
+        """
+        :return: Number of client writes dropped on a full queue.
+        """
+        return sum(block.dropped for block in (self.di, self.co, self.hr, self.ir))
+
+    def publish(self):
+        """
+        Publish the back buffers to the Modbus server in one step per register type.
+        """
+        for block in (self.di, self.co, self.hr, self.ir):
+            block.publish()
+
     def _get_di(self, address, count):
-        values = self.di.get_values(address+1, count)
+        values = self.di.peek(address+1, count)
         return values
 
     def _set_di(self, address, values):
-        self.di.set_values(address+1, values)
+        self.di.stage(address+1, values)
 
     def _get_co(self, address, count):
-        values = self.co.get_values(address+1, count)
+        values = self.co.peek(address+1, count)
         return values
 
     def _set_co(self, address, values):
-        self.co.set_values(address+1, values)
+        self.co.stage(address+1, values)
 
     def _get_hr(self, address, count):
-        values = self.hr.get_values(address+1, count)
+        values = self.hr.peek(address+1, count)
         return values
 
     def _set_hr(self, address, values):
-        self.hr.set_values(address+1, values)
+        self.hr.stage(address+1, values)
 
     def _get_ir(self, address, count):
-        values = self.ir.get_values(address+1, count)
+        values = self.ir.peek(address+1, count)
         return values
 
     def _set_ir(self, address, values):
-        self.ir.set_values(address+1, values)
+        self.ir.stage(address+1, values)
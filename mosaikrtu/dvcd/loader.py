@@ -1,8 +1,173 @@
-import xml.dom.minidom
+import hashlib
+import io
+import xml.etree.ElementTree as ET
+from collections import namedtuple
 
 
 COMPATIBLE_VERSION = ["0.5"]
 
+REGISTER_TYPES = ("di", "co", "hr", "ir")
+
+# Number of consecutive addresses taken by a value of the datatype (registers are 16 bit, coils 1 bit)
+DATATYPE_WIDTH = {
+    "bool": 1,
+    "8bit_uint": 1,
+    "8bit_int": 1,
+    "16bit_uint": 1,
+    "16bit_int": 1,
+    "32bit_uint": 2,
+    "32bit_int": 2,
+    "32bit_float": 2,
+    "64bit_uint": 4,
+    "64bit_int": 4,
+    "64bit_float": 4,
+    "string": 1,
+}
+
+_cache = {}  # Maps the SHA-1 of a configuration file to its parsed configuration
+
+
+class Register(namedtuple("Register", ["type", "index", "datatype", "value"])):
+    """
+    One register of the RTU configuration. Unpacks like the former [type, index, datatype, value] lists.
+    """
+    __slots__ = ()
+
+    @property
+    def width(self):
+        if self.datatype == "string":
+            return max(1, (len(self.value) + 1) // 2)
+        return DATATYPE_WIDTH.get(self.datatype, 1)
+
+
+def parse_value(datatype, value):
+    """
+    Convert the text of a <reg> tag to the type given by its datatype.
+    """
+    if datatype == "bool":
+        return value in ("True", "T", "1")
+    if datatype in ("32bit_float", "64bit_float"):
+        return float(value)
+    if datatype is not None and datatype.endswith("int"):
+        return int(value)
+    return value
+
+
+def check_registers(reg_list):
+    """
+    Check that no two registers of the same type share an address, taking the datatype width into account.
+    :param reg_list: List of (label, Register) in document order.
+    :raise ValueError: On unknown register types or datatypes, bool values in 16 bit registers and overlaps.
+    """
+    used = {}
+    for position, (label, reg) in enumerate(reg_list):
+        if reg.type not in REGISTER_TYPES:
+            raise ValueError("Register '{}' has unknown type '{}'".format(label, reg.type))
+        if reg.datatype is not None and reg.datatype not in DATATYPE_WIDTH:
+            raise ValueError("Register '{}' has unknown datatype '{}'".format(label, reg.datatype))
+        if reg.type in ("di", "co") and reg.datatype not in (None, "bool"):
+            raise ValueError("Register '{}' of type '{}' can only hold bool values".format(label, reg.type))
+        for address in range(reg.index, reg.index + reg.width):
+            other = used.setdefault((reg.type, address), position)
+            if other != position:
+                raise ValueError("Register '{}' ({} {}, {}) overlaps '{}' at address {}".format(
+                    label, reg.type, reg.index, reg.datatype, reg_list[other][0], address))
+
+
+def register_layout(reg_list):
+    """
+    Collect the addresses used by the registers, per register type.
+    :param reg_list: Iterable of (label, Register).
+    :return: Dict mapping the register types to the sorted list of used addresses. Types without registers map to
+    an empty list.
+    """
+    used = {ty: set() for ty in REGISTER_TYPES}
+    for label, reg in reg_list:
+        used[reg.type].update(range(reg.index, reg.index + reg.width))
+    return {ty: sorted(addresses) for ty, addresses in used.items()}
+
+
+def parse_rtu(path):
+    """
+    Parse and validate an RTU XML configuration. Results are cached by the hash of the file content, so
+    configurations shared by many RTUs are parsed once.
+    :param path: String with the path to config file.
+    :return: Dict[config_label]: config_value, see rtu_model.load_rtu.
+    """
+    with open(path, "rb") as f:
+        content = f.read()
+    digest = hashlib.sha1(content).hexdigest()
+    conf = _cache.get(digest)
+    if conf is None:
+        conf = _parse(io.BytesIO(content))
+        _cache[digest] = conf
+    # Registers are immutable tuples; copy the containers so callers can't change the cached configuration.
+    return dict(conf, identity=dict(conf["identity"]), registers=dict(conf["registers"]),
+                rules=[dict(rule) for rule in conf["rules"]])
+
+
+def _parse(source):
+    conf = {"unit": None, "scan_cycle": None, "on_change": True}
+    identity = {}
+    reg_list = []
+    rules = []
+    in_rules = False
+    root = None
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            if root is None:
+                root = elem
+                conf["label"] = elem.get("label", "")
+            elif tag == "rules":
+                in_rules = True
+            continue
+
+        if tag == "reg":
+            datatype = elem.get("dt")
+            reg = Register(elem.get("type"), int(elem.get("index")), datatype,
+                           parse_value(datatype, (elem.text or "").strip()))
+            reg_list.append((elem.get("label"), reg))
+        elif tag == "rules":
+            in_rules = False
+        elif in_rules:
+            rule = dict(elem.attrib)
+            rule["kind"] = tag
+            rules.append(rule)
+        elif tag == "ip":
+            conf["ip"] = elem.text.strip()
+        elif tag == "port":
+            conf["port"] = int(elem.text)
+        elif tag == "unit":
+            conf["unit"] = int(elem.text)
+        elif tag == "vendor":
+            identity["vendorname"] = elem.get("name", "")
+            identity["vendorurl"] = elem.get("url", "")
+        elif tag == "product":
+            identity["productname"] = elem.get("name", "")
+            identity["productcode"] = elem.get("code", "")
+            identity["modelname"] = elem.get("model", "")
+        elif tag == "version":
+            identity["versionmajor"] = elem.get("major", "")
+            identity["versionminor"] = elem.get("minor", "")
+        elif tag == "code":
+            conf["code"] = elem.text.strip()
+            # Optional PLC trigger: scan="<seconds>" for a fixed scan cycle, trigger="cycle" to not scan on changes
+            conf["scan_cycle"] = int(elem.get("scan")) if elem.get("scan") else None
+            conf["on_change"] = elem.get("trigger") != "cycle"
+        if elem is not root:
+            elem.clear()
+
+    check_registers(reg_list)
+    version = "{}.{}".format(identity.get("versionmajor"), identity.get("versionminor"))
+    if version not in COMPATIBLE_VERSION:
+        print("[-] Configuration version {} is not known to be compatible.".format(version))
+    conf["identity"] = identity
+    conf["registers"] = dict(reg_list)  # Later registers with the same label win
+    conf["register_list"] = tuple(reg_list)  # All registers in document order, including repeated labels
+    conf["rules"] = rules
+    return conf
+
 
 def loader(path):
     """
@@ -11,46 +176,10 @@ def loader(path):
     :return: Dict[config_label]: config_value
     """
     print("[*] Loading configuration XML: '{}'.".format(path))
-    conf = {}
     try:
-        parser = xml.dom.minidom.parse(path)
-        root = parser.documentElement
-
-        label = root.getAttribute("label")
-        ip = root.getElementsByTagName("ip")[0].childNodes[0].data
-        port = int(root.getElementsByTagName("port")[0].childNodes[0].data)
-
-        identity = {}
-        identity_tag = root.getElementsByTagName("identity")[0]
-        vendor_tag = identity_tag.getElementsByTagName("vendor")[0]
-        identity["vendorname"] = vendor_tag.getAttribute("name")
-        identity["vendorurl"] = vendor_tag.getAttribute("url")
-        product_tag = identity_tag.getElementsByTagName("product")[0]
-        identity["productname"] = product_tag.getAttribute("name")
-        identity["productcode"] = product_tag.getAttribute("code")
-        identity["modelname"] = product_tag.getAttribute("model")
-        version_tag = identity_tag.getElementsByTagName("version")[0]
-        identity["versionmajor"] = version_tag.getAttribute("major")
-        identity["versionminor"] = version_tag.getAttribute("minor")
-
-        registers = {}
-        register_tags = root.getElementsByTagName("reg")
-        for register_tag in register_tags:
-            reg_label = register_tag.getAttribute("label")
-            reg_type = register_tag.getAttribute("type")
-            reg_index = int(register_tag.getAttribute("index"))
-            reg_value = register_tag.childNodes[0].data
-            registers[reg_label] = [reg_type, reg_index, [reg_value]]
-
-        code = root.getElementsByTagName("code")[0].childNodes[0].data
-
-        conf["label"] = label
-        conf["ip"] = ip
-        conf["port"] = port
-        conf["identity"] = identity
-        conf["registers"] = registers
-        conf["code"] = code
+        conf = parse_rtu(path)
     except:
         print("[-] Problem loading configuration XML: '{}'.".format(path))
         raise
+    conf["registers"] = {label: [reg.type, reg.index, [reg.value]] for label, reg in conf["registers"].items()}
     return conf
@@ -1,8 +1,10 @@
-from pymodbus3.server.sync import ModbusTcpServer, ModbusSocketFramer
+from pymodbus3.server.sync import ModbusTcpServer, ModbusSocketFramer, ModbusConnectedRequestHandler
 from pymodbus3.device import ModbusDeviceIdentification
 from pymodbus3.datastore import ModbusServerContext
+from pymodbus3.pdu import ModbusExceptions
+from mosaikrtu.dvcd.stats import RequestStats
 import threading
-from datetime import datetime
+import time
 import logging
 
 logging.basicConfig()
@@ -13,9 +15,49 @@ formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(messag
 ch.setFormatter(formatter)
 log.addHandler(ch)
 
+DEFAULT_UNIT = 0x00  # Unit id of the pymodbus clients by default
+BROADCAST_UNIT = 0xFF  # "Unit not used" of Modbus/TCP, served like DEFAULT_UNIT
+MAX_UNIT = 0xF7  # Highest unit id of a slave (247), so one listener serves at most 247 RTUs on units 1..247
+
+class InstrumentedRequestHandler(ModbusConnectedRequestHandler):
+    """
+    Request handler recording the latency of every request (execution and sending the response) in the
+    RequestStats of the server.
+    """
+    def execute(self, request):
+        started = time.perf_counter()
+        try:
+            unit = DEFAULT_UNIT if request.unit_id == BROADCAST_UNIT else request.unit_id
+            context = self.server.context[unit]
+            response = request.execute(context)
+        except Exception as ex:
+            log.debug('Datastore unable to fulfill request: ' + str(ex))
+            response = request.do_exception(ModbusExceptions.SlaveFailure)
+        response.transaction_id = request.transaction_id
+        response.unit_id = request.unit_id
+        self.send(response)
+        unit = self.server.aliases.get(request.unit_id, request.unit_id)  # Unit of the datablock that served it
+        self.server.stats.record(unit, request.function_code, getattr(request, 'address', None),
+                                 time.perf_counter() - started, response.function_code > 0x80)
+
+
+class InstrumentedTcpServer(ModbusTcpServer):
+    """
+    Modbus TCP server collecting request statistics. Requests to a unit id in aliases are counted for the unit it
+    maps to.
+    """
+    def __init__(self, context, framer=None, identity=None, address=None, stats=None, aliases=None):
+        self.stats = stats if stats is not None else RequestStats()
+        self.aliases = aliases if aliases is not None else {}
+        ModbusTcpServer.__init__(self, context, framer, identity, address)
+        self.RequestHandlerClass = InstrumentedRequestHandler
+
+
 class Server(threading.Thread):
     """
-    Modbus Server class. Holds a datablock and identity. Serves forever (blocks calling thread).
+    Modbus Server class. Holds the datablocks of all RTUs sharing one listener and the identity.
+    Requests are dispatched to a datablock on the Modbus unit id. While only one datablock is attached, it is also
+    served on unit 0 and 0xFF, like a single-context server. Serves forever (blocks calling thread).
     """
     def __init__(self, datablock, identity):
         threading.Thread.__init__(self)
@@ -26,11 +68,14 @@ class Server(threading.Thread):
         self.id = None
 
         self.srv = None
-        self.context = None
-        self.datablock = datablock
+        self.datablocks = {}  # Maps unit ids to datablocks
+        self.stats = RequestStats()  # Request counters and latencies per unit id
+        self.aliases = {}  # Maps DEFAULT_UNIT and BROADCAST_UNIT to the unit id of the datablock they serve
 
         self.framer = ModbusSocketFramer
-        self.context = ModbusServerContext(slaves=self.datablock.store, single=True)
+        self.context = ModbusServerContext(slaves={}, single=False)
+        if datablock is not None:
+            self.add_slave(datablock)
 
         self.identity = ModbusDeviceIdentification()
         self.identity.VendorName = identity["vendorname"]
@@ -41,24 +86,64 @@ class Server(threading.Thread):
         self.identity.MajorMinorRevision = '0.3'
         #self.identity.Filter = ''
 
+    def add_slave(self, datablock, unit=None):
+        """
+        Register a datablock with the listener. Can be called while the server is running.
+        :param datablock: Datablock of the RTU to serve.
+        :param unit: Modbus unit id of the RTU. If None, the next free unit id (starting at 1) is taken.
+        :return: The unit id the datablock is served on.
+        """
+        if unit is None:
+            unit = self.free_unit()
+            if unit is None:
+                raise ValueError('All {} unit ids in use on {}:{}'.format(MAX_UNIT, self.ip, self.port))
+        if not 0 <= unit <= MAX_UNIT:
+            raise ValueError('Unit id {} out of range 0..{}'.format(unit, MAX_UNIT))
+        if unit in self.datablocks:
+            raise ValueError('Unit id {} already in use on {}:{}'.format(unit, self.ip, self.port))
+        self.datablocks[unit] = datablock
+        self.context[unit] = datablock.store
+        self._update_default_unit()
+        return unit
+
+    def free_unit(self):
+        """
+        :return: The lowest unit id from 1 to MAX_UNIT without a datablock, None if the listener is full.
+        """
+        for unit in range(1, MAX_UNIT + 1):
+            if unit not in self.datablocks:
+                return unit
+        return None
+
+    def _update_default_unit(self):
+        """
+        Serve the only datablock on DEFAULT_UNIT too; with more than one, clients have to address them by unit id.
+        """
+        self.aliases.clear()
+        if DEFAULT_UNIT in self.datablocks:
+            self.aliases[BROADCAST_UNIT] = DEFAULT_UNIT
+            return
+        if len(self.datablocks) == 1:
+            unit, datablock = next(iter(self.datablocks.items()))
+            self.context[DEFAULT_UNIT] = datablock.store
+            self.aliases.update({DEFAULT_UNIT: unit, BROADCAST_UNIT: unit})
+        elif DEFAULT_UNIT in self.context:
+            del self.context[DEFAULT_UNIT]
+
     def run(self):
         """
         Start the server.
         """
         while not self.do_stop.is_set():
             try:
-                self.srv = ModbusTcpServer(self.context, self.framer, self.identity, (self.ip, self.port))
+                self.srv = InstrumentedTcpServer(self.context, self.framer, self.identity, (self.ip, self.port),
+                                                 self.stats, self.aliases)
                 self.srv.allow_reuse_address = True
                 self.srv.serve_forever()
             except Exception:
                 raise
         print("[*] Server stopping.")
 
-    def verify_request(self, request, client_address):
-        print('verify_request(%s, %s)', request, client_address)
-        log.warning('     SERVER NEW REQUEST, {}'.format(datetime.now()))
-        return socketserver.ThreadingTCPServer.verify_request(self, request, client_address)
-
     def stop(self):
         """
         Stop the server.
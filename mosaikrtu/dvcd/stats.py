@@ -0,0 +1,99 @@
+import threading
+import time
+
+HISTOGRAM_BUCKETS = 32  # Bucket b counts latencies of [2**(b-1), 2**b) microseconds, bucket 0 counts < 1 us
+RANGE_SIZE = 16  # Requests are grouped by start address in ranges of this many registers
+
+
+class RequestStats(object):
+    """
+    Request counters and log2 latency histograms of a Modbus listener, per unit id, function code and register
+    range. record() is called from the server threads and only updates a few list entries under a lock.
+    """
+    def __init__(self, range_size=RANGE_SIZE):
+        self.range_size = range_size
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._units = {}  # Maps unit id to {(function code, range start): [requests, errors, seconds, histogram]}
+
+    def record(self, unit, function_code, address, elapsed, error=False):
+        """
+        Count one request.
+        :param unit: Modbus unit id of the request.
+        :param function_code: Function code of the request.
+        :param address: Start address of the request, None for requests without one.
+        :param elapsed: Time in seconds taken to execute the request and send the response.
+        :param error: Whether the response was an exception response.
+        """
+        start = None if address is None else address - address % self.range_size
+        bucket = min(int(elapsed * 1e6).bit_length(), HISTOGRAM_BUCKETS - 1)
+        with self._lock:
+            ranges = self._units.get(unit)
+            if ranges is None:
+                ranges = self._units[unit] = {}
+            entry = ranges.get((function_code, start))
+            if entry is None:
+                entry = ranges[(function_code, start)] = [0, 0, 0.0, [0] * HISTOGRAM_BUCKETS]
+            entry[0] += 1
+            entry[1] += error
+            entry[2] += elapsed
+            entry[3][bucket] += 1
+
+    def snapshot(self, unit):
+        """
+        Statistics of one unit id.
+        :return: Dict with the totals (requests, errors, requests per second since the start, mean/p50/p99 latency in
+                 microseconds) and a list of the same values per function code and register range ('ranges').
+        """
+        with self._lock:
+            entries = [(key, [entry[0], entry[1], entry[2], list(entry[3])])
+                       for key, entry in self._units.get(unit, {}).items()]
+        uptime = max(time.time() - self.started, 1e-9)
+        histogram = [0] * HISTOGRAM_BUCKETS
+        ranges = []
+        for (function_code, start), (requests, errors, seconds, hist) in sorted(entries, key=_sort_key):
+            summary = _summary(requests, errors, seconds, hist)
+            summary.update({'function': function_code, 'start': start,
+                            'end': None if start is None else start + self.range_size - 1, 'histogram': hist})
+            ranges.append(summary)
+            histogram = [a + b for a, b in zip(histogram, hist)]
+        stats = _summary(sum(r['requests'] for r in ranges), sum(r['errors'] for r in ranges),
+                         sum(r['mean_us'] * r['requests'] for r in ranges) / 1e6, histogram)
+        stats['rate'] = stats['requests'] / uptime
+        stats['ranges'] = ranges
+        return stats
+
+    def units(self):
+        with self._lock:
+            return sorted(self._units)
+
+
+def _sort_key(item):
+    (function_code, start), entry = item
+    return function_code, -1 if start is None else start
+
+
+def _summary(requests, errors, seconds, histogram):
+    return {
+        'requests': requests,
+        'errors': errors,
+        'mean_us': seconds * 1e6 / requests if requests else 0.0,
+        'p50_us': percentile(histogram, 0.5),
+        'p99_us': percentile(histogram, 0.99),
+    }
+
+
+def percentile(histogram, q):
+    """
+    Upper bound in microseconds of the histogram bucket holding the q-quantile.
+    """
+    total = sum(histogram)
+    if not total:
+        return 0
+    rank = q * total
+    seen = 0
+    for bucket, count in enumerate(histogram):
+        seen += count
+        if seen >= rank:
+            return 2 ** bucket
+    return 2 ** (len(histogram) - 1)
@@ -5,39 +5,151 @@ logging.basicConfig()
 log = logging.getLogger()
 log.setLevel(logging.WARNING)
 
-class Worker(threading.Thread):
+# Number of 16 bit registers taken by the register datatypes
+REGISTER_COUNT = {
+    '32bit_float': 2,
+    '64bit_float': 4,
+}
+
+
+class RegisterView(object):
+    """
+    Typed access to the registers of one RTU by their label, e.g. reg["sensor_1-branch_19"].
+    Float registers are decoded and encoded according to their datatype, all others are plain values.
+    """
+    def __init__(self, datablock, registers):
+        self._datablock = datablock
+        self._registers = registers
+
+    def __getitem__(self, label):
+        t, i, dt = self._registers[label][:3]
+        if dt in REGISTER_COUNT:
+            return self._datablock.get(t, i, REGISTER_COUNT[dt], dt)
+        return self._datablock.get(t, i, 1)[0]
+
+    def __setitem__(self, label, value):
+        t, i, dt = self._registers[label][:3]
+        if dt in REGISTER_COUNT:
+            self._datablock.set(t, i, float(value), dt)
+        else:
+            self._datablock.set(t, i, value)
+
+    def __contains__(self, label):
+        return label in self._registers
+
+    def labels(self):
+        return list(self._registers)
+
+
+class LimitView(object):
+    """
+    The limits of an RTU by the name of the branch (or node) they protect, e.g. max_current["branch_19"] for the
+    register "max-branch_19". Values are read from the registers on every access, so limits written over Modbus
+    take effect on the next scan.
+    """
+    def __init__(self, reg, prefix="max-"):
+        self._reg = reg
+        self._prefix = prefix
+
+    def __getitem__(self, name):
+        label = self._prefix + name
+        if label not in self._reg:
+            raise KeyError(name)
+        return self._reg[label]
+
+    def __contains__(self, name):
+        return self._prefix + name in self._reg
+
+    def keys(self):
+        return [label[len(self._prefix):] for label in self._reg.labels() if label.startswith(self._prefix)]
+
+
+class Worker(object):
     """
-    Thread holding the Modbus Client, its Datablock, and its Functions.
+    PLC engine of an RTU. Holds the compiled logic, its Datablock, and its Functions.
+
+    The logic file is compiled once. Every scan executes the code object in the same namespace, so names assigned by
+    the logic keep their value between scans. Scans are triggered from the simulation step, either when a sensor
+    register changed or every scan_cycle seconds of simulation time.
     """
-    def __init__(self, datablock, code, cache):
-        threading.Thread.__init__(self)
+    def __init__(self, datablock, code, cache, registers=None, scan_cycle=None, on_change=True):
         self.cached_val = cache
         self.datablock = datablock
         self.code = code
+        self.scan_cycle = scan_cycle
+        self.on_change = on_change
+        self.next_scan = None
         self.do_stop = threading.Event()
-        #TODO: change max_current reference further to the logic.
-        self.max_current={}
-        self.max_current["branch_16"] = self.db("hr", 6)
-        self.max_current["branch_17"] = self.db("hr", 7)
-        self.max_current["branch_16a"] = self.db("hr", 8)
+        self.registers = registers or {}
+        self.reg = RegisterView(self.datablock, self.registers)
+        self.max_current = LimitView(self.reg)
 
-    def run(self):
+        with open(self.code) as f:
+            self.program = compile(f.read(), self.code, 'exec')
+        self.namespace = {
+            'self': self,
+            'reg': self.reg,
+            'max_current': self.max_current,
+            'time': None,
+        }
+
+        self.scans = 0
+        self.scan_time_total = 0.0
+        self.scan_time_min = None
+        self.scan_time_max = 0.0
+        self.scan_time_last = 0.0
+
+    def scan(self, sim_time, changed=False):
         """
-        Client's endless run-loop. 
-        Client reads the new values from the file 
+        Run one scan of the logic if it is due.
+        :param sim_time: Current simulation time in seconds.
+        :param changed: Whether sensor registers changed since the last scan.
+        :return: True if the logic was executed.
         """
+        if self.do_stop.is_set():
+            return False
+        due = self.scan_cycle is not None and (self.next_scan is None or sim_time >= self.next_scan)
+        if not (due or (changed and self.on_change)):
+            return False
+        if self.scan_cycle is not None:
+            # Stay aligned to multiples of the scan cycle
+            self.next_scan = (sim_time // self.scan_cycle + 1) * self.scan_cycle
+
+        self.namespace['time'] = sim_time
+        start = time.perf_counter()
+        try:
+            exec(self.program, self.namespace)
+        except Exception:
+            log.exception("PLC logic '{}' failed, stopping the worker.".format(self.code))
+            self.stop()
+            return False
+        elapsed = time.perf_counter() - start
 
-        while not self.do_stop.is_set():
-            #start = time.clock()
-            #with open(self.code) as f:
-            #    code = compile(f.read(), self.code, 'exec')
-            #    exec(code)
-            time.sleep(1)
-        print("[*] Worker stopping.")
+        self.scans += 1
+        self.scan_time_total += elapsed
+        self.scan_time_last = elapsed
+        self.scan_time_max = max(self.scan_time_max, elapsed)
+        if self.scan_time_min is None or elapsed < self.scan_time_min:
+            self.scan_time_min = elapsed
+        return True
+
+    def stats(self):
+        """
+        Scan time statistics in seconds.
+        :return: Dict with the number of scans and the last, min, max and mean scan time.
+        """
+        return {
+            'scans': self.scans,
+            'last': self.scan_time_last,
+            'min': self.scan_time_min or 0.0,
+            'max': self.scan_time_max,
+            'mean': self.scan_time_total / self.scans if self.scans else 0.0,
+            'running': not self.do_stop.is_set(),
+        }
 
     def stop(self):
         """
-        Signal the client to stop its run-loop.
+        Stop scanning the logic.
         """
         self.do_stop.set()
         print("[*] Worker given stop signal...")
@@ -0,0 +1,95 @@
+# reading_sink.py
+
+"""
+Columnar HDF5 output for RTU sensor readings.
+
+The file uses the Series group layout of the mosaik-hdf5 database (see the DB simulator in demo_vuln.py), with one
+group per register label:
+
+    Series/<sid>.<rtu eid>/<register label>/time     simulation time [s] of each reading (int64)
+    Series/<sid>.<rtu eid>/<register label>/<attr>   the readings, e.g. I_real or Vm (float64)
+
+All attrs of a label share the time dataset: row i of each attr is the reading at time[i], NaN if the attr had no
+reading at that time.
+
+Datasets are chunked, gzip compressed and resizable, so readings are appended during the simulation without
+rewriting the file.
+"""
+import h5py
+import numpy as np
+
+
+class HDF5ReadingSink(object):
+    """
+    Buffers readings per register label, one row per time, and appends them to the HDF5 file in blocks of buf_size
+    rows.
+    """
+    def __init__(self, filename, buf_size=1000, dataset_opts=None):
+        self.filename = filename
+        self.buf_size = buf_size
+        self.dataset_opts = {'compression': 'gzip', 'chunks': (buf_size,)}
+        if dataset_opts:
+            self.dataset_opts.update(dataset_opts)
+        self.db = h5py.File(filename, 'w')
+        self.series = self.db.require_group('Series')
+        self._bufs = {}  # Maps (entity, label) to a pair (times, dict mapping attrs to their values)
+        print("[*] Writing RTU readings to '{}'.".format(filename))
+
+    def add(self, time, entity, label, attr, value):
+        """
+        Buffer one reading.
+        :param time: Simulation time in seconds.
+        :param entity: Full id of the RTU entity, e.g. RTUSim-0.0-rtu
+        :param label: Register label, e.g. sensor_1-branch_19
+        :param attr: Measured attribute, e.g. I_real
+        :param value: The reading.
+        """
+        key = (entity, label)
+        buf = self._bufs.get(key)
+        if buf is None:
+            buf = self._bufs[key] = ([], {})
+        times, columns = buf
+        if not times or times[-1] != time:  # Start a row, written in full once buf_size rows are buffered
+            if len(times) >= self.buf_size:
+                self._write(key, buf)
+            times.append(time)
+            for values in columns.values():
+                values.append(np.nan)
+        values = columns.get(attr)
+        if values is None:
+            values = columns[attr] = [np.nan] * len(times)
+        values[-1] = value
+
+    def flush(self):
+        """
+        Write all buffered readings to the file.
+        """
+        for key, buf in self._bufs.items():
+            if buf[0]:
+                self._write(key, buf)
+        self.db.flush()
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def _write(self, key, buf):
+        entity, label = key
+        times, columns = buf
+        group = self.series.require_group('%s/%s' % (entity, label))
+        ds = self._dataset(group, 'time', np.int64)
+        start = ds.shape[0]
+        ds.resize((start + len(times),))
+        ds[start:] = np.asarray(times, dtype=np.int64)
+        for attr, values in columns.items():
+            ds = self._dataset(group, attr, np.float64, fillvalue=np.nan)
+            ds.resize((start + len(times),))  # Rows before the first reading of a new attr stay NaN
+            ds[start:] = np.asarray(values, dtype=np.float64)
+            del values[:]
+        del times[:]
+
+    def _dataset(self, group, name, dtype, **kwargs):
+        if name not in group:
+            kwargs.update(self.dataset_opts)
+            group.create_dataset(name, (0,), maxshape=(None,), dtype=dtype, **kwargs)
+        return group[name]
@@ -0,0 +1,238 @@
+# register_file.py
+
+"""
+Memory-mapped mirror of the RTU registers for local analysis tools.
+
+The RTU simulator writes the published register values of every RTU into one file (config key rtu_register_file,
+e.g. /dev/shm/rtu_registers to keep it in shared memory). Readers map the same file and see all registers of all
+RTUs at simulation speed without going through Modbus/TCP.
+
+Layout (little-endian):
+
+    Header, 16 bytes:     magic b"MOSAIKRF" | version u32 | number of RTUs u32
+    Directory, one 72 byte entry per RTU:
+                          eid 32s (NUL padded) | offset of the RTU section u64 |
+                          di start i32 | di count u32 | co start i32 | co count u32 |
+                          hr start i32 | hr count u32 | ir start i32 | ir count u32
+    RTU section, 8 byte aligned:
+                          sequence u64 | simulation time i64 |
+                          di u8[di count] | co u8[co count] | padding to 2 bytes | hr u16[hr count] | ir u16[ir count]
+
+start is the register index of the first value of the space (-1 for the legacy 0xFF blocks), addresses without a
+configured register read 0.
+The sequence counter of an RTU is odd while its section is written and incremented to the next even number when
+the update is complete (a seqlock): readers copy the section and retry if the counter was odd or changed meanwhile.
+"""
+import mmap
+import os
+import struct
+import sys
+import time as _time
+from array import array
+
+MAGIC = b"MOSAIKRF"
+VERSION = 1
+HEADER = struct.Struct("<8sII")
+ENTRY = struct.Struct("<32sQiIiIiIiI")
+SECTION = struct.Struct("<Qq")  # sequence, simulation time
+SPACES = ("di", "co", "hr", "ir")
+TYPECODES = {"di": "B", "co": "B", "hr": "H", "ir": "H"}
+
+
+def _space(block):
+    """
+    Register index and number of addresses of a data block (the blocks start one above the register index).
+    """
+    size = getattr(block, "size", None)
+    if size is None:
+        size = len(block.values)
+    return block.address - 1, size
+
+
+def _layout(spaces):
+    """
+    Offsets of the register spaces in an RTU section and its total size.
+    :param spaces: List of (start, count) in the order of SPACES.
+    """
+    offsets = []
+    pos = SECTION.size
+    for name, (start, count) in zip(SPACES, spaces):
+        if name == "hr":
+            pos += pos % 2
+        offsets.append(pos)
+        pos += count * array(TYPECODES[name]).itemsize
+    return offsets, pos + (-pos % 8)
+
+
+class RegisterFile(object):
+    """
+    Writer side of the register file. Register RTUs with add(), then call publish() after each
+    DataBlock.publish(). The file is laid out on the first publish, when all RTUs are known.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._rtus = []
+        self._sections = {}  # Maps RTU eids to (offset, space offsets, space sizes)
+        self._fd = None
+        self.mm = None
+
+    def add(self, rtu):
+        """
+        Mirror the registers of an RTU.
+        :param rtu: rtu_model.RTU object.
+        """
+        self._rtus.append(rtu)
+
+    def publish(self, rtu, time):
+        """
+        Copy the published registers of the RTU to the file.
+        :param rtu: rtu_model.RTU object.
+        :param time: Simulation time in seconds.
+        """
+        if len(self._sections) != len(self._rtus):
+            self._open()
+        offset, space_offsets, spaces = self._sections[rtu.eid]
+        mm = self.mm
+        seq = SECTION.unpack_from(mm, offset)[0]
+        SECTION.pack_into(mm, offset, seq + 1, time)
+        for name, pos, (start, count) in zip(SPACES, space_offsets, spaces):
+            block = getattr(rtu.data, name)
+            values = block.values
+            pos += offset
+            if isinstance(values, dict):  # SparseDataBlock, offsets relative to the block address
+                itemsize = array(TYPECODES[name]).itemsize
+                fmt = "<" + TYPECODES[name]
+                for key, value in values.items():
+                    struct.pack_into(fmt, mm, pos + key * itemsize, value)
+                continue
+            if not isinstance(values, array):
+                values = array(TYPECODES[name], values)
+            if sys.byteorder != "little" and values.itemsize > 1:
+                values = array(values.typecode, values)
+                values.byteswap()
+            data = values.tobytes()
+            mm[pos:pos + len(data)] = data
+        struct.pack_into("<Q", mm, offset, seq + 2)
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            os.close(self._fd)
+            self.mm = None
+            self._fd = None
+
+    def _open(self):
+        self.close()
+        entries = []
+        pos = HEADER.size + ENTRY.size * len(self._rtus)
+        pos += -pos % 8
+        for rtu in self._rtus:
+            spaces = [_space(getattr(rtu.data, name)) for name in SPACES]
+            space_offsets, size = _layout(spaces)
+            self._sections[rtu.eid] = (pos, space_offsets, spaces)
+            entries.append((rtu.eid, pos, spaces))
+            pos += size
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.ftruncate(self._fd, pos)
+        self.mm = mmap.mmap(self._fd, pos)
+        HEADER.pack_into(self.mm, 0, MAGIC, VERSION, len(entries))
+        for i, (eid, offset, spaces) in enumerate(entries):
+            ENTRY.pack_into(self.mm, HEADER.size + i * ENTRY.size, eid.encode()[:32], offset,
+                            *[n for space in spaces for n in space])
+        print("[*] Mirroring the registers of {} RTUs to '{}'.".format(len(entries), self.path))
+
+
+class RegisterFileReader(object):
+    """
+    Reader side of the register file, for tools running next to the simulation.
+
+        reader = RegisterFileReader('/dev/shm/rtu_registers')
+        seq, time, regs = reader.read('0-rtu')
+        regs['hr'][12]  # holding register 12
+
+    view() returns zero-copy memoryviews on the mapping; they may change while being read, use read() for a
+    consistent snapshot.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("'{}' is not a version {} register file".format(path, VERSION))
+        self.rtus = {}  # Maps RTU eids to (offset, space offsets, spaces)
+        for i in range(count):
+            entry = ENTRY.unpack_from(self.mm, HEADER.size + i * ENTRY.size)
+            spaces = list(zip(entry[2::2], entry[3::2]))
+            self.rtus[entry[0].rstrip(b"\0").decode()] = (entry[1], _layout(spaces)[0], spaces)
+
+    def sequence(self, eid):
+        """
+        Sequence counter of an RTU. Increases by 2 with every publish.
+        """
+        return SECTION.unpack_from(self.mm, self.rtus[eid][0])[0]
+
+    def view(self, eid, space):
+        """
+        Zero-copy view on one register space of an RTU.
+        :param space: Register type ('di', 'co', 'hr', 'ir').
+        :return: Tuple of the register index of the first value and a memoryview of the values.
+        """
+        offset, space_offsets, spaces = self.rtus[eid]
+        i = SPACES.index(space)
+        start, count = spaces[i]
+        itemsize = array(TYPECODES[space]).itemsize
+        pos = offset + space_offsets[i]
+        return start, memoryview(self.mm)[pos:pos + count * itemsize].cast(TYPECODES[space])
+
+    def read(self, eid, retries=1000):
+        """
+        Consistent copy of all registers of an RTU.
+        :return: Tuple of the sequence counter, the simulation time and a dict mapping register types to
+        RegisterSpace objects.
+        """
+        offset, space_offsets, spaces = self.rtus[eid]
+        end = offset + _layout(spaces)[1]
+        for _ in range(retries):
+            seq = SECTION.unpack_from(self.mm, offset)[0]
+            if seq % 2:
+                _time.sleep(0)
+                continue
+            data = self.mm[offset:end]
+            if SECTION.unpack_from(self.mm, offset)[0] == seq:
+                break
+        else:
+            raise IOError("RTU '{}' in '{}' is not readable".format(eid, self.path))
+        seq, sim_time = SECTION.unpack_from(data, 0)
+        regs = {}
+        for name, pos, (start, count) in zip(SPACES, space_offsets, spaces):
+            values = array(TYPECODES[name])
+            values.frombytes(data[pos:pos + count * values.itemsize])
+            if sys.byteorder != "little" and values.itemsize > 1:
+                values.byteswap()
+            regs[name] = RegisterSpace(start, values)
+        return seq, sim_time, regs
+
+    def close(self):
+        self.mm.close()
+
+
+class RegisterSpace(object):
+    """
+    Values of one register space, indexed by register index.
+    """
+    def __init__(self, start, values):
+        self.start = start
+        self.values = values
+
+    def __getitem__(self, index):
+        if index < self.start or index >= self.start + len(self.values):
+            return 0
+        return self.values[index - self.start]
+
+    def __len__(self):
+        return len(self.values)
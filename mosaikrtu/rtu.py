@@ -4,9 +4,12 @@ Mosaik interface for the example simulator.
 
 """
 import mosaik_api
+import json
 import os
 from datetime import datetime
 from mosaikrtu import rtu_model
+from mosaikrtu.rules import RuleEngine
+import output_writer
 import logging
 logger = logging.getLogger('demo_main')
 ch = logging.StreamHandler()
@@ -17,17 +20,12 @@ logger.addHandler(ch)
 from topology_loader.topology_loader import topology_loader
 from distutils.util import strtobool
 
-try:
-    os.remove('./outputs/readings.csv')
-except OSError:
-    pass
-
 META = {
     'models': {
         'RTU': {
             'public': True,
             'params': ['rtu_ref'],
-            'attrs': ['switchstates'], 
+            'attrs': ['switchstates', 'plc_stats', 'modbus_stats'], 
         },
         'sensor': {
             'public': True,
@@ -46,46 +44,100 @@ META = {
 class MonitoringRTU(mosaik_api.Simulator):
     def __init__(self):
         super().__init__(META)
-        self.rtu_ref = ""
-        self.conf=""
         self.sid = None
-        self.data = ""    #Datablock
-        self.rtueid = ""
-        self._rtus = []
-        self.entities = {}  # Maps EIDs to model indices in self.simulator ??
+        self.step_size = 60
+        self.max_step_size = 60
+        self.deadband = 0.01
+        self._interval = 60
+        self._rtus = []  # RTU objects, one per RTU entity
         self._entities = {}
-        self._cache = {} 
-        self.worker=""
-        self.server=""
+        self._entity_rtu = {}  # Maps child EIDs to the RTU object they belong to
+        self._rtu_by_eid = {}
+        self.servers = {}  # Maps (ip, port) to the shared Modbus listener
+        self.rules = RuleEngine()  # Protection rules of all RTUs
         topoloader = topology_loader()
         conf = topoloader.get_config()
         global RECORD_TIMES
         RECORD_TIMES = bool(strtobool(conf['recordtimes'].lower()))
         global RTU_STATS_OUTPUT
         RTU_STATS_OUTPUT = bool(strtobool(conf['rtu_stats_output'].lower()))
+        self.output_dir = conf.get('output_dir')  # Per-run outputs instead of the shared outputs/ files
+        if self.output_dir:
+            rtu_model.readingfile = os.path.join(self.output_dir, 'readings.csv')
+            rtu_model.logfile = os.path.join(self.output_dir, 'times.csv')
+        try:
+            os.remove(rtu_model.readingfile)
+        except OSError:
+            pass
+        self._outputs = [output_writer.acquire(path) for path in (rtu_model.readingfile, rtu_model.logfile)]
+        self.sink = None  # Optional HDF5 output of the readings, config key rtu_readings_hdf5
+        if conf.get('rtu_readings_hdf5'):
+            from mosaikrtu.reading_sink import HDF5ReadingSink
+            self.sink = HDF5ReadingSink(self._output_path(conf['rtu_readings_hdf5']))
+        self.modbus_stats_file = None  # Optional JSON file with the Modbus request statistics
+        if conf.get('rtu_modbus_stats'):
+            self.modbus_stats_file = self._output_path(conf['rtu_modbus_stats'])
+        self.register_file = None  # Optional memory-mapped mirror of the registers, config key rtu_register_file
+        if conf.get('rtu_register_file'):
+            from mosaikrtu.register_file import RegisterFile
+            self.register_file = RegisterFile(self._output_path(conf['rtu_register_file']))
+        # Concurrent runs bind their Modbus servers to other ports (and optionally another address) than the XML
+        self.port_offset = int(conf.get('rtu_port_offset', 0))
+        self.ip = conf.get('rtu_ip')
+        # The PLC logic of the RTU XML only runs if enabled, the reference scenarios run without it
+        self.plc_logic = bool(strtobool(conf.get('rtu_plc_logic', 'False').lower()))
+
+    def _output_path(self, path):
+        """
+        Relative paths of output files are taken relative to the output directory of the run, if there is one.
+        """
+        if self.output_dir:
+            return os.path.join(self.output_dir, path)
+        return path
 
-    def init(self, sid):
+    def init(self, sid, step_size=60, max_step_size=None, deadband=0.01):
+        """
+        :param step_size: Step interval in seconds.
+        :param max_step_size: Enables adaptive stepping: while no reading changes by more than deadband (relative)
+                              and no switch changes, the interval doubles up to max_step_size. Any activity resets
+                              it to step_size.
+        """
         self.sid = sid
+        self.step_size = step_size
+        self.max_step_size = max(max_step_size or step_size, step_size)
+        self.deadband = deadband
+        self._interval = step_size
         return self.meta
 
     def create(self, num, model, rtu_ref=None):
-        rtu = []
+        if not rtu_ref:
+            raise ValueError('RTU entities need an rtu_ref (path to the RTU XML).')
+        rtus = []
         for i in range(num):
             rtu_idx = len(self._rtus)
-            if rtu_ref:
-                self.rtu_ref = rtu_ref
-                self.conf = rtu_model.load_rtu(self.rtu_ref) # use rtu_model.load_rtu to load the configuration
-                self.data = rtu_model.create_datablock(self.conf) # create_datablock should take the dt into account
-                self._cache, entities = rtu_model.create_cache(self.conf["registers"])
-                self.server = rtu_model.create_server(self.conf, self.data)
-                #self.worker = rtu_model.create_worker(self.conf, self.data, self._cache)
-                #self.worker.start()
-                self.server.start()
+            conf = rtu_model.load_rtu(rtu_ref) # use rtu_model.load_rtu to load the configuration
+            conf["port"] += self.port_offset
+            if self.ip:
+                conf["ip"] = self.ip
+            rtu = rtu_model.RTU(rtu_model.make_eid('rtu', rtu_idx), conf)
+            rtu.stats_output = RTU_STATS_OUTPUT
+            rtu.server, rtu.unit = rtu_model.attach_server(self.servers, conf, rtu.data)
+            rtu.worker = rtu_model.create_worker(conf, rtu.data, rtu.cache) if self.plc_logic else None
+            if conf["rules"]:
+                rtu.rules = self.rules
+                self.rules.add_rtu(rtu)
+            if not rtu.server.is_alive():
+                rtu.server.start()
+            if self.register_file is not None:
+                self.register_file.add(rtu)
             self._rtus.append(rtu)
+            self._rtu_by_eid[rtu.eid] = rtu
             children = []
-            for eid, attrs in sorted(entities.items()):
+            for dev, attrs in sorted(rtu.entities.items()):
+                eid = rtu_model.make_eid(dev, rtu_idx)
                 assert eid not in self._entities
                 self._entities[eid] = attrs
+                self._entity_rtu[eid] = rtu
                 if 'node' not in attrs:
                     print("Entity without the node is {}".format(eid))
                     print("Attrs: {}".format(attrs))
@@ -95,41 +147,25 @@ class MonitoringRTU(mosaik_api.Simulator):
                     'node': attrs['node'],
                     'branch': attrs['branch'],
                 })
-            self.rtueid = rtu_model.make_eid('rtu', rtu_idx)
-            rtu.append({
-                'eid': self.rtueid, #model.make_eid('grid', grid_idx),
+            rtus.append({
+                'eid': rtu.eid,
                 'type': 'RTU',
                 'children': children,
             })
-        return rtu
+        return rtus
 
     def step(self, time, inputs):
         commands = {}  # set commands for switches
-        switchstates = {}
-        src = self.sid +'.'+ self.rtueid # RTUSim-0.0-rtu%
         dest = 'PyPower-0.PyPower'
-        commands[src] = {}
-        commands[src][dest] = {}
-
-        for s, v in self._cache.items():
-            if 'switch' in s or 'transformer' in s:
-                if self.data.get(v['reg_type'], v['index'], 1)[0] != v['value']: # TODO: operation on datablock!
-                    if RTU_STATS_OUTPUT: 
-                        rtu_model.save_readings(v['reg_type']+str(v['index']), "state", v['value'])
-                    self._cache[s]['value'] = self.data.get(v['reg_type'], v['index'], 1)[0]
-                    switchstates[v['place']] = v['value']
-                    if commands[src][dest] == {}:
-                        commands[src][dest]['switchstates'] = switchstates
-                    else:
-                        commands[src][dest]['switchstates'].update(switchstates)
-
-        # if bool(switchstates):
-        #     if commands[src][dest] == {}:
-        #         commands[src][dest]['switchstates'] = switchstates
-        #     else:
-        #         commands[src][dest]['switchstates'].update(switchstates)
+        changed = False
+
+        for rtu in self._rtus:
+            if rtu.data.merge() and rtu.rules is not None: # take over the writes of Modbus clients
+                self.rules.refresh_limits(rtu)
 
         for eid, data in inputs.items():
+            rtu = self._entity_rtu[eid]
+            dev = eid.split("-", 1)[1]
             for attr, values in data.items(): # attr is like I_real etc.
                 if attr in ['I_real', 'Vm']:
                     for src, value in values.items():
@@ -137,25 +173,58 @@ class MonitoringRTU(mosaik_api.Simulator):
                             continue
                         else:
                             src=src.split("-")[2]
-                            dev_id = eid+"-"+src   # dev_id, e.g. sensor_2-node_d1, sensor_2-branch_17, sensor_1-branch_16
-                            assert dev_id in self._cache
-                            self._cache[dev_id]["value"] = value
-                            #print(self.conf['registers'][dev_id][0])
-                            # logger.warning("Sensor {} value changed to {} ".format(dev_id, value))
-                            #print("Stuff in data.set: {} {} {} {}".format(self.conf['registers'][dev_id][0], self.conf['registers'][dev_id][1], value, self.conf['registers'][dev_id][2]))
-                            self.data.set(self.conf['registers'][dev_id][0], self.conf['registers'][dev_id][1], value, self.conf['registers'][dev_id][2])
-                            if RTU_STATS_OUTPUT:
-                                rtu_model.save_readings(dev_id, attr, value)
-        if bool(switchstates) and RECORD_TIMES:
-            rtu_model.log_event("NC")
-        yield self.mosaik.set_data(commands)
-        return time + 60
+                            dev_id = dev+"-"+src   # dev_id, e.g. sensor_2-node_d1, sensor_2-branch_17, sensor_1-branch_16
+                            rtu.set_reading(dev_id, attr, value)
+                            if self.sink is not None:
+                                self.sink.add(time, self.sid + '.' + rtu.eid, dev_id, attr, value)
+
+        for rtu, coil, value in self.rules.evaluate():
+            rtu.reg[coil] = value
+
+        activity = 0.0
+        for rtu in self._rtus:
+            rtu.run_logic(time) # local protection logic may switch on the new readings
+            activity = max(activity, rtu.activity)
+            rtu.activity = 0.0
+            command = rtu.switch_command() # delta of the switch states with a sequence number
+            if command is not None:
+                src = self.sid + '.' + rtu.eid # RTUSim-0.0-rtu%
+                commands[src] = {dest: {'switchstates': command}}
+                changed = True
+            rtu.data.publish() # make the new readings visible to Modbus clients at once
+            if self.register_file is not None:
+                self.register_file.publish(rtu, time)
+        if changed:
+            if RECORD_TIMES:
+                rtu_model.log_event("NC")
+            yield self.mosaik.set_data(commands) # only talk to PyPower when a switch moved
+        return time + self._next_interval(changed or activity > self.deadband)
+
+    def _next_interval(self, active):
+        """
+        Step interval after this step: step_size, or with adaptive stepping doubled while the grid is quiet.
+        """
+        if active or self.max_step_size == self.step_size:
+            self._interval = self.step_size
+        else:
+            self._interval = min(2 * self._interval, self.max_step_size)
+        return self._interval
 
     def finalize(self):
-        #self.worker.stop()
-        #print("Worker Stopped")
-        self.server.stop()
-        print("Server Stopped")
+        for rtu in self._rtus:
+            if rtu.worker is not None:
+                rtu.worker.stop()
+        for server in self.servers.values():
+            server.stop()
+        print("Servers Stopped")
+        if self.modbus_stats_file:
+            self._save_modbus_stats(self.modbus_stats_file)
+        for path in self._outputs:  # Only the files of this simulator, others may still write to theirs
+            output_writer.release(path)
+        if self.sink is not None:
+            self.sink.close()
+        if self.register_file is not None:
+            self.register_file.close()
         print("\n\n\n")
         print("#########################################")
         print('Finished')
@@ -169,6 +238,9 @@ class MonitoringRTU(mosaik_api.Simulator):
         data = {}
         for eid, attrs in outputs.items():
             for attr in attrs:
+                if eid in self._rtu_by_eid:
+                    data.setdefault(eid, {})[attr] = self._get_rtu_data(self._rtu_by_eid[eid], attr)
+                    continue
                 try:
                     val = self._entities[eid][attr]
                 except KeyError:
@@ -177,6 +249,24 @@ class MonitoringRTU(mosaik_api.Simulator):
                 data.setdefault(eid, {})[attr] = val
         return data
 
+    def _get_rtu_data(self, rtu, attr):
+        if attr == 'plc_stats':
+            return rtu.worker.stats() if rtu.worker is not None else None
+        if attr == 'modbus_stats':
+            return self._modbus_stats(rtu)
+        return None
+
+    def _modbus_stats(self, rtu):
+        stats = rtu.server.stats.snapshot(rtu.unit)
+        stats['dropped_writes'] = rtu.data.dropped()  # Client writes refused on a full write queue
+        return stats
+
+    def _save_modbus_stats(self, path):
+        stats = {self.sid + '.' + rtu.eid: self._modbus_stats(rtu) for rtu in self._rtus}
+        with open(path, 'w') as f:
+            json.dump(stats, f, indent=2, sort_keys=True)
+        print("[*] Modbus request statistics written to '{}'.".format(path))
+
 def main():
     return mosaik_api.start_simulation(MonitoringRTU())
 
@@ -5,11 +5,13 @@
 This module contains the RTU model with sensors and switches. 
 
 """
-import xml.dom.minidom
 from mosaikrtu.dvcd.data import DataBlock
+from mosaikrtu.dvcd.loader import parse_rtu, register_layout
 from mosaikrtu.dvcd.server import Server
-from mosaikrtu.dvcd.worker import Worker
+from mosaikrtu.dvcd.worker import Worker, RegisterView
+from output_writer import write_line
 import struct
+import os
 from datetime import datetime
 
 
@@ -21,17 +23,15 @@ logfile = './outputs/times.csv'
 
 
 def create_datablock(conf): # changes : to include the datatype of the data.
-    # TODO: add a check on the configuration file that if a register is of a certain datatype then it may or may not
-    # have certain length (the addresses of the consecutive registers have to be checked)
     """
     Create a Modbus datablock holding the registers described in the XML config file.
     :param conf: Dictionary holding configuration values. See: load_rtu function
-    :return: Modbus datablock object that locks when reading or writing.
+    :return: Double-buffered Modbus datablock object with the initial values published. The register spaces are
+    sized from the configured addresses.
     """
-    datablock = DataBlock()
-    regs = conf["registers"]
-    for reg_label in regs:
-        ty, addr, datatype, value = regs[reg_label]
+    regs = conf["register_list"]
+    datablock = DataBlock(register_layout(regs))
+    for reg_label, (ty, addr, datatype, value) in regs:
         if datatype == 'bool':
             if value == "True" or value == 1 or value == 'T':
                 value = bool(True)
@@ -66,14 +66,15 @@ def create_datablock(conf): # changes : to include the datatype of the data.
         elif datatype == 'string':
             continue
 
+    datablock.publish()
     return datablock
 
 
-def create_server(conf, datablock):
+def create_server(conf, datablock=None):
     """
     Create a Server with supplied datablock and configured identity.
     :param conf: Dictionary holding configuration values. See: tools/loader.py
-    :param datablock: Modbus datablock object.
+    :param datablock: Modbus datablock object. If None, datablocks are added later with Server.add_slave.
     :return: Modbus Server object.
     """
     #global args
@@ -91,16 +92,44 @@ def create_server(conf, datablock):
     return server
 
 
+def attach_server(servers, conf, datablock):
+    """
+    Serve the datablock on the listener for the configured ip and port. RTUs with the same ip and port
+    share one listener and are told apart by their Modbus unit id. RTUs without a configured unit id go to the next
+    port once all unit ids of a listener are taken (see server.MAX_UNIT).
+    :param servers: Dict mapping (ip, port) to the Server objects created so far. New servers are added to it.
+    :param conf: Dictionary holding configuration values. See: load_rtu function
+    :param datablock: Modbus datablock object.
+    :return: Tuple of the Server object and the unit id of the datablock.
+    """
+    port = conf["port"]
+    while True:
+        server = servers.get((conf["ip"], port))
+        if server is None:
+            server = create_server(dict(conf, port=port))
+            servers[(conf["ip"], port)] = server
+        if conf.get("unit") is not None or server.free_unit() is not None:
+            break
+        port += 1
+    unit = server.add_slave(datablock, conf.get("unit"))
+    print("[*] RTU '{}' served @ {}:{} as unit {}".format(conf["label"], server.ip, server.port, unit))
+    return server, unit
+
+
 def create_worker(conf, datablock, cache):
     """
-    Create a Client with supplied datablock and configured values to pull.
-    :param conf: Dictionary holding configuration values. See: tools/loader.py
+    Create the PLC engine running the configured logic on the supplied datablock.
+    :param conf: Dictionary holding configuration values. See: load_rtu function
     :param datablock: Modbus datablock object.
-    :return: ThreadClient object.
+    :param cache: Register cache of the RTU. See: create_cache function
+    :return: Worker object, or None if the configuration has no logic.
     """
-    code = conf["code"]
-    worker = Worker(datablock, code, cache)
-    print("[*] Worker created.".format(worker.name))
+    code = conf.get("code")
+    if not code:
+        print("[*] No PLC logic configured, RTU '{}' runs without a worker.".format(conf["label"]))
+        return None
+    worker = Worker(datablock, code, cache, conf["registers"], conf.get("scan_cycle"), conf.get("on_change", True))
+    print("[*] Worker created for '{}'.".format(code))
     return worker
 
 def create_cache(conf):
@@ -133,6 +162,89 @@ def create_cache(conf):
     return cache, entities
 
 
+class RTU(object):
+    """
+    State of a single simulated RTU: its configuration, datablock, register cache and child entities.
+    """
+    def __init__(self, eid, conf):
+        self.eid = eid
+        self.conf = conf
+        self.data = create_datablock(conf)
+        self.cache, self.entities = create_cache(conf["registers"])
+        self.reg = RegisterView(self.data, conf["registers"])
+        self.rules = None  # RuleEngine evaluating the rules of this RTU
+        self.server = None
+        self.unit = None
+        self.worker = None
+        self.changed = False  # Whether a sensor reading changed since the last logic scan
+        self.switch_seq = 0  # Sequence number of the last switch command, see switch_command
+        self.activity = 0.0  # Largest relative change of a reading since the last step, see MonitoringRTU.step
+        self.stats_output = False
+
+    def set_reading(self, dev_id, attr, value):
+        """
+        Store a sensor reading in the cache and in the datablock.
+        :param dev_id: Register label of the sensor, e.g. sensor_2-branch_17
+        :param attr: Name of the measured attribute, e.g. I_real
+        :param value: The new reading.
+        """
+        assert dev_id in self.cache
+        old = self.cache[dev_id]["value"]
+        if old != value:
+            self.changed = True
+            try:
+                self.activity = max(self.activity, abs(value - old) / max(abs(old), 1e-9))
+            except TypeError:  # No numeric reading yet
+                self.activity = float('inf')
+        self.cache[dev_id]["value"] = value
+        reg_type, index, datatype = self.conf['registers'][dev_id][:3]
+        self.data.set(reg_type, index, value, datatype)
+        if self.rules is not None:
+            self.rules.set_value(self, dev_id, value)
+        if self.stats_output:
+            save_readings(dev_id, attr, value)
+
+    def run_logic(self, time):
+        """
+        Scan the PLC logic if it is due, i.e. a reading changed or the scan cycle elapsed.
+        :param time: Current simulation time in seconds.
+        """
+        if self.worker is not None:
+            self.worker.scan(time, self.changed)
+        self.changed = False
+
+    def switch_changes(self):
+        """
+        Compare the switch and transformer registers with the cached values and update the cache.
+        :return: Dict mapping the place (branch) of every changed switch to its new state.
+        """
+        switchstates = {}
+        for s, v in self.cache.items():
+            if 'switch' in s or 'transformer' in s:
+                value = self.data.get(v['reg_type'], v['index'], 1)[0]
+                if v['reg_type'] in ('co', 'di'):
+                    value = bool(value)  # coils are stored as bytes
+                if value != v['value']:
+                    if self.stats_output:
+                        save_readings(v['reg_type']+str(v['index']), "state", value)
+                    v['value'] = value
+                    switchstates[v['place']] = value
+        return switchstates
+
+
+    def switch_command(self):
+        """
+        Collect the switch changes since the last call as a command for PyPower.
+        :return: None if no switch changed, else {'seq': sequence number, 'switches': {branch: state}}. The sequence
+                 number increases with every command, so PyPower can drop stale or repeated commands.
+        """
+        switches = self.switch_changes()
+        if not switches:
+            return None
+        self.switch_seq += 1
+        return {'seq': self.switch_seq, 'switches': switches}
+
+
 def broadcast_values(values, ip, port):
     sock = socket.socket(socket.AF_INET,  # Internet
                          socket.SOCK_DGRAM)  # UDP
@@ -140,58 +252,23 @@ def broadcast_values(values, ip, port):
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
     sock.sendto(values.encode("utf-8"), (ip, port))
 
-# content of the dvcd.loader
 def load_rtu(path):
+    """
+    Load an RTU XML configuration. See dvcd/loader.py for the parser, validation and caching.
+    :param path: String with the path to config file.
+    :return: Dict with label, ip, port, unit, identity, registers (label -> Register), rules, code, scan_cycle
+             and on_change. A relative path of the PLC logic (code) is taken relative to the XML file.
+    """
     print("[*] Loading configuration XML: '{}'.".format(path))
-    conf = {}
     try:
-        parser = xml.dom.minidom.parse(path)
-        root = parser.documentElement
-
-        label = root.getAttribute("label")
-        ip = root.getElementsByTagName("ip")[0].childNodes[0].data
-        port = int(root.getElementsByTagName("port")[0].childNodes[0].data)
-
-        identity = {}
-        identity_tag = root.getElementsByTagName("identity")[0]
-        vendor_tag = identity_tag.getElementsByTagName("vendor")[0]
-        identity["vendorname"] = vendor_tag.getAttribute("name")
-        identity["vendorurl"] = vendor_tag.getAttribute("url")
-        product_tag = identity_tag.getElementsByTagName("product")[0]
-        identity["productname"] = product_tag.getAttribute("name")
-        identity["productcode"] = product_tag.getAttribute("code")
-        identity["modelname"] = product_tag.getAttribute("model")
-        version_tag = identity_tag.getElementsByTagName("version")[0]
-        identity["versionmajor"] = version_tag.getAttribute("major")
-        identity["versionminor"] = version_tag.getAttribute("minor")
-
-        registers = {}
-        register_tags = root.getElementsByTagName("reg")
-        for register_tag in register_tags:
-            reg_datatype = register_tag.getAttribute("dt")
-            reg_label = register_tag.getAttribute("label")
-            reg_type = register_tag.getAttribute("type")
-            reg_index = int(register_tag.getAttribute("index"))
-            reg_value = register_tag.childNodes[0].data
-            if reg_datatype == 'bool':
-                if reg_value == "True" or reg_value == 1 or reg_value == 'T':
-                    reg_value = bool(True)
-                elif reg_value == "False" or reg_value == 0 or reg_value == 'F':
-                    reg_value = bool(False)
-            registers[reg_label] = [reg_type, reg_index, reg_datatype, reg_value]
-
-
-        code = root.getElementsByTagName("code")[0].childNodes[0].data
-
-        conf["label"] = label
-        conf["ip"] = ip
-        conf["port"] = port
-        conf["identity"] = identity
-        conf["registers"] = registers
-        conf["code"] = code
+        conf = parse_rtu(path)
     except:
         print("[-] Problem loading configuration XML: '{}'.".format(path))
         raise
+    if conf.get("code"):
+        conf["code"] = os.path.join(os.path.dirname(path), conf["code"])
+    if conf.get("code") and not os.path.isfile(conf["code"]):
+        raise ValueError("PLC logic '{}' of RTU '{}' not found".format(conf["code"], conf["label"]))
     return conf
 
 class UniqueKeyDict(dict):
@@ -210,12 +287,8 @@ def make_eid(name, grid_idx):
 def log_event(event):
     if event == "NC": 
         myCsvRow = "{};{};{}\n".format("RTU-API", "Pass the commands to TOPOLOGY", format(datetime.now()))
-    fd = open(logfile, 'a')
-    fd.write(myCsvRow)
-    fd.close()
+    write_line(logfile, myCsvRow)
 
 def save_readings(dev_id, attr, value):
     myCsvRow = "{};{};{};{}\n".format(format(datetime.now()), dev_id, attr, value)
-    fd = open(readingfile, 'a')
-    fd.write(myCsvRow)
-    fd.close()
\ No newline at end of file
+    write_line(readingfile, myCsvRow)
\ No newline at end of file
@@ -0,0 +1,153 @@
+# rules.py
+
+"""
+Declarative protection rules for the simulated RTUs.
+
+Rules are configured in the RTU XML inside a <rules> tag:
+
+    <rules>
+        <threshold sensor="sensor_1-branch_19" limit="max-branch_19" coil="switch_1-branch_19"
+                   trip="1.0" reset="0.8" value="False" />
+        <interlock coil="switch_2-branch_24" requires="switch_1-branch_19" state="True" />
+    </rules>
+
+A threshold rule trips when the sensor exceeds trip*limit and resets when it drops below reset*limit (instead of
+reset, hysteresis="0.2" gives reset = trip - hysteresis). On trip the coil is set to value, on reset to the opposite.
+The limit is either a register label or a number. Only the edges are emitted, so Modbus clients can still operate
+the coil in between.
+An interlock blocks every rule-driven change of coil while the coil requires is not in state; the blocked change is
+made as soon as the interlock clears (if the sensor still calls for it). Sensor values are compared by magnitude.
+
+The RuleEngine evaluates the threshold rules of all RTUs of a simulator at once with NumPy.
+"""
+import numpy as np
+
+
+def parse_bool(value):
+    return value in ("True", "T", "1", 1, True)
+
+
+class RuleEngine(object):
+    """
+    Evaluates the threshold and interlock rules of many RTUs as array operations.
+    """
+    def __init__(self):
+        self._slots = {}  # Maps (rtu eid, sensor label) to the index in self.values
+        self.values = np.zeros(0)
+        self._thresholds = []  # (rtu, sensor slot, limit label or None, limit value, trip, reset, coil, value)
+        self._interlocks = {}  # Maps (rtu eid, coil) to a list of (requires, state)
+        self._built = True
+
+        self.tripped = np.zeros(0, dtype=bool)
+        self.limits = np.zeros(0)
+        self.trip = np.zeros(0)
+        self.reset = np.zeros(0)
+        self._sensor_idx = np.zeros(0, dtype=int)
+
+    def add_rtu(self, rtu):
+        """
+        Register the rules of an RTU (rtu.conf["rules"]).
+        :param rtu: rtu_model.RTU object.
+        """
+        rules = rtu.conf.get("rules", [])
+        if not rules:
+            return
+        for rule in rules:
+            try:
+                self._add_rule(rtu, rule)
+            except KeyError as e:
+                raise ValueError("Rule '{}' in RTU '{}' is missing the attribute {}".format(
+                    rule["kind"], rtu.conf["label"], e))
+        self._built = False
+
+    def _add_rule(self, rtu, rule):
+        registers = rtu.conf["registers"]
+        for attr in ("sensor", "coil", "requires"):
+            if attr in rule and rule[attr] not in registers:
+                raise ValueError("Rule '{}' in RTU '{}' refers to the unknown register '{}'".format(
+                    rule["kind"], rtu.conf["label"], rule[attr]))
+        if rule["kind"] == "threshold":
+            slot = self._slot(rtu, rule["sensor"])
+            limit = rule["limit"]
+            if limit in registers:
+                limit_label, limit_value = limit, rtu.reg[limit]
+            else:
+                limit_label, limit_value = None, float(limit)
+            if rule.get("reset") is not None:
+                reset = float(rule["reset"])
+            else:
+                reset = float(rule["trip"]) - float(rule.get("hysteresis") or 0)
+            self._thresholds.append((rtu, slot, limit_label, limit_value, float(rule["trip"]), reset,
+                                     rule["coil"], parse_bool(rule["value"])))
+        elif rule["kind"] == "interlock":
+            self._interlocks.setdefault((rtu.eid, rule["coil"]), []).append(
+                (rule["requires"], parse_bool(rule["state"])))
+        else:
+            raise ValueError("Unknown rule '{}' in RTU '{}'".format(rule["kind"], rtu.conf["label"]))
+
+    def set_value(self, rtu, label, value):
+        """
+        Store a sensor reading if any rule depends on it.
+        """
+        slot = self._slots.get((rtu.eid, label))
+        if slot is not None:
+            self.values[slot] = value
+
+    def refresh_limits(self, rtu):
+        """
+        Re-read the limit registers of an RTU, e.g. after Modbus clients wrote to it.
+        """
+        self._build()
+        for i, t in enumerate(self._thresholds):
+            if t[0] is rtu and t[2] is not None:
+                self._thresholds[i] = t[:3] + (rtu.reg[t[2]],) + t[4:]
+                self.limits[i] = self._thresholds[i][3]
+
+    def evaluate(self):
+        """
+        Evaluate all threshold rules against the current sensor values.
+        :return: List of (rtu, coil label, value) for every coil a rule wants to change.
+        """
+        self._build()
+        if not self._thresholds:
+            return []
+        readings = np.abs(self.values[self._sensor_idx])  # The sign of a branch current depends on the flow
+        above = readings > self.trip * self.limits
+        below = readings < self.reset * self.limits
+        tripped = (self.tripped | above) & ~below
+        edges = np.flatnonzero(tripped != self.tripped)
+
+        changes = []
+        for i in edges:
+            rtu, coil, value = self._thresholds[i][0], self._thresholds[i][6], self._thresholds[i][7]
+            if not tripped[i]:
+                value = not value
+            if self._interlocked(rtu, coil):
+                continue  # Not applied, the edge is seen again on the next evaluation
+            self.tripped[i] = tripped[i]
+            changes.append((rtu, coil, value))
+        return changes
+
+    def _interlocked(self, rtu, coil):
+        for requires, state in self._interlocks.get((rtu.eid, coil), ()):
+            if bool(rtu.reg[requires]) != state:
+                return True
+        return False
+
+    def _slot(self, rtu, label):
+        key = (rtu.eid, label)
+        if key not in self._slots:
+            self._slots[key] = len(self._slots)
+            self.values = np.append(self.values, np.nan)
+        return self._slots[key]
+
+    def _build(self):
+        if self._built:
+            return
+        n_old = len(self.tripped)
+        self._sensor_idx = np.array([t[1] for t in self._thresholds], dtype=int)
+        self.limits = np.array([t[3] for t in self._thresholds], dtype=float)
+        self.trip = np.array([t[4] for t in self._thresholds], dtype=float)
+        self.reset = np.array([t[5] for t in self._thresholds], dtype=float)
+        self.tripped = np.concatenate([self.tripped, np.zeros(len(self._thresholds) - n_old, dtype=bool)])
+        self._built = True
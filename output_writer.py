@@ -0,0 +1,144 @@
+# output_writer.py
+
+"""
+Buffered writer for the CSV outputs (readings, event times) of the simulators.
+
+Lines are collected in memory and appended to the file by a background thread, either when the buffer holds
+max_lines lines or every flush_interval seconds. Shared by the simulators running in one process: each simulator
+acquire()s the files it writes and release()s them in its finalize, a file is closed when its last user released it.
+close_all() (at exit) writes whatever is left.
+"""
+import atexit
+import os
+import threading
+
+
+class OutputWriter(threading.Thread):
+    """
+    Background thread appending buffered lines to one output file. The file stays open while the writer runs.
+    """
+    def __init__(self, path, max_lines=1000, flush_interval=1.0):
+        threading.Thread.__init__(self, daemon=True)
+        self.path = path
+        self.max_lines = max_lines
+        self.flush_interval = flush_interval
+        self.do_stop = threading.Event()
+        self._wake = threading.Event()
+        self._buf = []
+        self._buf_lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._fd = None
+
+    def write(self, line):
+        """
+        Queue a line (including the newline) for writing.
+        """
+        with self._buf_lock:
+            self._buf.append(line)
+            full = len(self._buf) >= self.max_lines
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """
+        Write all buffered lines to the file.
+        """
+        with self._buf_lock:
+            lines, self._buf = self._buf, []
+        if not lines:
+            return
+        with self._file_lock:
+            if self._fd is None:
+                directory = os.path.dirname(self.path)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+                self._fd = open(self.path, 'a')
+            self._fd.writelines(lines)
+            self._fd.flush()
+
+    def run(self):
+        while not self.do_stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def stop(self):
+        """
+        Stop the thread, write the remaining lines and close the file.
+        """
+        self.do_stop.set()
+        self._wake.set()
+        if self.is_alive():
+            self.join()
+        self.flush()
+        with self._file_lock:
+            if self._fd is not None:
+                self._fd.close()
+                self._fd = None
+
+
+_writers = {}
+_users = {}  # Maps the paths to the number of simulators that acquired them
+_writers_lock = threading.Lock()
+
+
+def get_writer(path):
+    """
+    Get the running writer for path, starting one if needed.
+    :param path: Path of the output file.
+    :return: OutputWriter object.
+    """
+    with _writers_lock:
+        writer = _writers.get(path)
+        if writer is None:
+            writer = OutputWriter(path)
+            writer.start()
+            _writers[path] = writer
+    return writer
+
+
+def write_line(path, line):
+    """
+    Append a line to the output file at path through its buffered writer.
+    """
+    get_writer(path).write(line)
+
+
+def acquire(path):
+    """
+    Register a user of the output file at path.
+    :return: path
+    """
+    with _writers_lock:
+        _users[path] = _users.get(path, 0) + 1
+    return path
+
+
+def release(path):
+    """
+    Unregister a user of the output file at path. The file is flushed and closed when no user is left.
+    """
+    with _writers_lock:
+        users = _users.get(path, 0) - 1
+        if users > 0:
+            _users[path] = users
+            return
+        _users.pop(path, None)
+        writer = _writers.pop(path, None)
+    if writer is not None:
+        writer.stop()
+
+
+def close_all():
+    """
+    Flush and close all output files.
+    """
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+        _users.clear()
+    for writer in writers:
+        writer.stop()
+
+
+atexit.register(close_all)
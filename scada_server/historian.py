@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+'''
+Historian for SCADA poll results
+--------------------------------------------------------------------------
+
+Keeps the recent history of every tag in fixed-size NumPy ring buffers: the raw samples plus min/max/mean rollups
+at several resolutions (default 1 s, 1 min and 1 h). Completed rollups and raw samples are written to compressed
+.npz chunks, so older history can be read back without scanning logs:
+
+    historian = Historian('outputs/historian')
+    historian.record('RTU_3.RTU_BUS5_M19_I', time.time(), 12.3)
+    times, means, mins, maxs = historian.query('RTU_3.RTU_BUS5_M19_I', time.time() - 3600, resolution=1)
+
+Chunks are stored as <directory>/<resolution>/<tag>/<first timestamp>_<last timestamp>.npz (resolution 0 for the raw
+samples), each holding the arrays time, mean, min and max. Queries only open the chunks whose name overlaps the
+requested time range. flush() also writes the open rollup buckets; if recording goes on, the completed bucket is
+written again with the same timestamp and replaces the partial row when reading.
+'''
+import os
+import re
+
+import numpy as np
+
+RESOLUTIONS = (1, 60, 3600)  # Rollup resolutions in seconds
+COLUMNS = 4  # time, mean, min, max
+
+
+class RingBuffer(object):
+    """
+    Fixed-size buffer of rows (time, mean, min, max); the oldest rows are overwritten.
+    """
+    def __init__(self, capacity):
+        self.data = np.empty((capacity, COLUMNS))
+        self.capacity = capacity
+        self.head = 0  # Index of the next row to write
+        self.count = 0
+
+    def append(self, row):
+        self.data[self.head] = row
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def rows(self):
+        """
+        All rows, oldest first (a copy).
+        """
+        if self.count < self.capacity:
+            return self.data[:self.count].copy()
+        return np.concatenate((self.data[self.head:], self.data[:self.head]))
+
+    def last(self, n):
+        """
+        The last n rows, oldest first (a copy).
+        """
+        n = min(n, self.count)
+        idx = (self.head - n + np.arange(n)) % self.capacity
+        return self.data[idx]
+
+
+class TagHistory(object):
+    """
+    History of one tag: raw samples and one rollup ring buffer per resolution.
+    """
+    def __init__(self, capacity, resolutions, rollup_capacity):
+        self.raw = RingBuffer(capacity)
+        self.resolutions = resolutions
+        self.rollups = {r: RingBuffer(rollup_capacity) for r in resolutions}
+        self.current = {r: None for r in resolutions}  # Open bucket per resolution: [start, sum, count, min, max]
+        self.unsaved = {0: 0}  # Rows written to the buffers since the last chunk, per resolution (0: raw)
+        self.unsaved.update({r: 0 for r in resolutions})
+
+    def record(self, timestamp, value):
+        """
+        Add a sample. Samples must arrive in time order.
+        :return: List of the resolutions that completed a row.
+        """
+        self.raw.append((timestamp, value, value, value))
+        self.unsaved[0] += 1
+        completed = [0]
+        for r in self.resolutions:
+            start = timestamp - timestamp % r
+            bucket = self.current[r]
+            if bucket is not None and bucket[0] != start:
+                self.rollups[r].append((bucket[0], bucket[1] / bucket[2], bucket[3], bucket[4]))
+                self.unsaved[r] += 1
+                completed.append(r)
+                bucket = None
+            if bucket is None:
+                self.current[r] = [start, value, 1, value, value]
+            else:
+                bucket[1] += value
+                bucket[2] += 1
+                bucket[3] = min(bucket[3], value)
+                bucket[4] = max(bucket[4], value)
+        return completed
+
+    def buffer(self, resolution):
+        return self.raw if resolution == 0 else self.rollups[resolution]
+
+    def open_row(self, resolution):
+        """
+        The row of the open bucket of a rollup resolution, None if there is none.
+        """
+        bucket = self.current.get(resolution)
+        if bucket is None:
+            return None
+        return bucket[0], bucket[1] / bucket[2], bucket[3], bucket[4]
+
+
+class Historian(object):
+    """
+    Ring-buffered history of many tags with rollups and compressed chunk files.
+    """
+    def __init__(self, directory=None, capacity=3600, resolutions=RESOLUTIONS, rollup_capacity=1440,
+                 chunk_size=None):
+        """
+        :param directory: Directory for the chunk files; None keeps the history in memory only.
+        :param capacity: Raw samples kept in memory per tag.
+        :param resolutions: Rollup resolutions in seconds.
+        :param rollup_capacity: Rollup rows kept in memory per tag and resolution.
+        :param chunk_size: Rows per chunk file; defaults to half the buffer capacity, so a chunk is written before
+                           its rows are overwritten.
+        """
+        self.directory = directory
+        self.capacity = capacity
+        self.resolutions = tuple(sorted(resolutions))
+        self.rollup_capacity = rollup_capacity
+        self.chunk_size = chunk_size
+        self.tags = {}
+
+    def record(self, tag, timestamp, value):
+        """
+        Add a sample of a tag.
+        :param timestamp: Unix time in seconds.
+        :param value: Number or bool.
+        """
+        history = self.tags.get(tag)
+        if history is None:
+            history = self.tags[tag] = TagHistory(self.capacity, self.resolutions, self.rollup_capacity)
+        completed = history.record(timestamp, float(value))
+        if self.directory is not None:
+            for resolution in completed:
+                buf = history.buffer(resolution)
+                if history.unsaved[resolution] >= min(self.chunk_size or buf.capacity // 2, buf.capacity):
+                    self._save(tag, resolution, buf.last(history.unsaved[resolution]))
+                    history.unsaved[resolution] = 0
+
+    def record_many(self, prefix, timestamp, values):
+        """
+        Add the values of one poll, e.g. as the Poller callback.
+        :param prefix: Prefix of the tag names (the RTU name).
+        :param values: Dict mapping tag names to values.
+        """
+        for tag, value in values.items():
+            self.record('{}.{}'.format(prefix, tag), timestamp, value)
+
+    def query(self, tag, start, end=None, resolution=0):
+        """
+        History of a tag between start and end.
+        :param resolution: Requested resolution in seconds; the coarsest available rollup not above it is used, 0
+                           for the raw samples.
+        :return: Tuple of arrays (time, mean, min, max), oldest first. Rows older than the buffers are read from the
+                 chunk files.
+        """
+        history = self.tags.get(tag)
+        resolution = max([0] + [r for r in self.resolutions if r <= resolution])
+        if history is None:
+            rows = np.empty((0, COLUMNS))
+        else:
+            rows = history.buffer(resolution).rows()
+        oldest = rows[0, 0] if len(rows) else np.inf
+        if self.directory is not None and start < oldest:
+            old = self.load(tag, resolution, start, oldest)
+            rows = np.concatenate((old[old[:, 0] < oldest], rows))
+        mask = rows[:, 0] >= start
+        if end is not None:
+            mask &= rows[:, 0] <= end
+        rows = rows[mask]
+        return rows[:, 0], rows[:, 1], rows[:, 2], rows[:, 3]
+
+    def load(self, tag, resolution, start=-np.inf, end=np.inf):
+        """
+        Read the rows of a tag from the chunk files.
+        :return: Array of rows (time, mean, min, max).
+        """
+        path = self._tag_dir(tag, resolution)
+        chunks = []
+        if os.path.isdir(path):
+            for first, last, name in sorted(_chunk_range(name) + (name,) for name in os.listdir(path)):
+                if last < start or first > end:
+                    continue
+                with np.load(os.path.join(path, name)) as f:
+                    chunks.append(np.column_stack((f['time'], f['mean'], f['min'], f['max'])))
+        if not chunks:
+            return np.empty((0, COLUMNS))
+        rows = np.concatenate(chunks)
+        # Rows written again (open buckets flushed before they were completed): keep the last one of each time
+        _, last = np.unique(rows[::-1, 0], return_index=True)
+        return rows[len(rows) - 1 - last]
+
+    def flush(self):
+        """
+        Write all rows not yet in a chunk file, including the open rollup buckets (e.g. the last minute and hour
+        before shutdown).
+        """
+        if self.directory is None:
+            return
+        for tag, history in self.tags.items():
+            for resolution, unsaved in history.unsaved.items():
+                rows = history.buffer(resolution).last(unsaved)
+                row = history.open_row(resolution)
+                if row is not None:
+                    rows = np.concatenate((rows, [row]))
+                if len(rows):
+                    self._save(tag, resolution, rows)
+                history.unsaved[resolution] = 0
+
+    def _tag_dir(self, tag, resolution):
+        return os.path.join(self.directory, str(resolution), re.sub(r'[^\w.-]', '_', tag))
+
+    def _save(self, tag, resolution, rows):
+        path = self._tag_dir(tag, resolution)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        np.savez_compressed(os.path.join(path, '{:.3f}_{:.3f}.npz'.format(rows[0, 0], rows[-1, 0])),
+                            time=rows[:, 0], mean=rows[:, 1], min=rows[:, 2], max=rows[:, 3])
+
+
+def _chunk_range(name):
+    """
+    First and last timestamp of a chunk file from its name.
+    """
+    first, last = name[:-4].split('_')
+    return float(first), float(last)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+'''
+Asyncio SCADA poller
+--------------------------------------------------------------------------
+
+Polls many RTUs concurrently from one event loop over persistent Modbus/TCP connections. The configured tags of
+each RTU are merged into the smallest number of contiguous reads per register type.
+
+Tags come from the RTU XML files (address and unit from the XML) or from a tag list like data/basic_normal/RTU_3.csv
+(RtuNo is the unit id, RegisterNo the holding register, "Switch State" rows are coils; all RTUs of the CSV are
+polled on --host/--port). Run from the repository root:
+
+    python3 -m scada_server.poller data/basic_normal/rtu_info.xml --interval 0.5
+    python3 -m scada_server.poller --csv data/basic_normal/RTU_3.csv --host 192.168.33.1 --port 10502
+'''
+import argparse
+import asyncio
+import csv
+import struct
+import time
+from collections import namedtuple
+
+from mosaikrtu.dvcd.loader import parse_rtu
+
+import logging
+logging.basicConfig()
+log = logging.getLogger('poller')
+log.setLevel(logging.INFO)
+
+#---------------------------------------------------------------------------#
+# Tags and read coalescing
+#---------------------------------------------------------------------------#
+Tag = namedtuple('Tag', ['name', 'type', 'index', 'count', 'datatype'])
+Read = namedtuple('Read', ['type', 'start', 'count', 'tags'])
+RTU = namedtuple('RTU', ['name', 'host', 'port', 'unit', 'tags'])
+
+FUNCTION_CODES = {'co': 1, 'di': 2, 'hr': 3, 'ir': 4}
+MAX_COUNT = {'co': 2000, 'di': 2000, 'hr': 125, 'ir': 125}  # Modbus limits per read
+STRUCT_FORMATS = {
+    '16bit_int': '>h', '16bit_uint': '>H', '32bit_int': '>i', '32bit_uint': '>I', '32bit_float': '>f',
+    '64bit_int': '>q', '64bit_uint': '>Q', '64bit_float': '>d',
+}
+
+
+def load_xml_tags(path, host=None, port=None):
+    """
+    Tags of all registers of an RTU XML configuration.
+    :return: RTU tuple; host and port default to the ones of the XML.
+    """
+    conf = parse_rtu(path)
+    tags = [Tag(label, reg.type, reg.index, reg.width, reg.datatype) for label, reg in conf['register_list']]
+    return RTU(conf['label'], host or conf['ip'], port or conf['port'], conf['unit'] or 1, tags)
+
+
+def load_csv_tags(path, host, port):
+    """
+    Tags of a SCADA tag list (RtuNo, RegisterNo, RegisterTyp, Description, Name, TagName, ...).
+    :return: List of RTU tuples, one per RtuNo.
+    """
+    rtus = {}
+    with open(path) as f:
+        for row in csv.DictReader(f):
+            unit = int(row['RtuNo'])
+            if row['Description'] == 'Switch State':
+                tag = Tag(row['TagName'], 'co', int(row['RegisterNo']), 1, 'bool')
+            else:
+                tag = Tag(row['TagName'], 'hr', int(row['RegisterNo']), 1, '16bit_int')
+            rtus.setdefault(unit, []).append(tag)
+    return [RTU('RTU_{}'.format(unit), host, port, unit, tags) for unit, tags in sorted(rtus.items())]
+
+
+def coalesce(tags, max_gap=8):
+    """
+    Merge tags into contiguous reads.
+    :param tags: List of Tag.
+    :param max_gap: Largest number of unused addresses between two tags read together.
+    :return: List of Read, sorted by register type and start address.
+    """
+    reads = []
+    for _type in sorted(FUNCTION_CODES):
+        current = None
+        for tag in sorted((t for t in tags if t.type == _type), key=lambda t: t.index):
+            end = tag.index + tag.count
+            if (current is not None and tag.index <= current[0] + current[1] + max_gap
+                    and end - current[0] <= MAX_COUNT[_type]):
+                current[1] = max(current[1], end - current[0])
+                current[2].append(tag)
+            else:
+                if current is not None:
+                    reads.append(Read(_type, *current))
+                current = [tag.index, tag.count, [tag]]
+        if current is not None:
+            reads.append(Read(_type, *current))
+    return reads
+
+
+def decode(read, values):
+    """
+    Values of the tags of a read.
+    :param values: Bits (coils, inputs) or 16 bit registers returned for the read.
+    :return: Dict mapping tag names to values.
+    """
+    result = {}
+    for tag in read.tags:
+        offset = tag.index - read.start
+        if read.type in ('co', 'di'):
+            result[tag.name] = values[offset]
+            continue
+        raw = struct.pack('>%dH' % tag.count, *values[offset:offset + tag.count])
+        fmt = STRUCT_FORMATS.get(tag.datatype)
+        if fmt is None:
+            result[tag.name] = values[offset]
+        else:
+            result[tag.name] = struct.unpack(fmt, raw[:struct.calcsize(fmt)])[0]
+    return result
+
+
+#---------------------------------------------------------------------------#
+# Minimal Modbus/TCP client
+#---------------------------------------------------------------------------#
+class ModbusError(Exception):
+    pass
+
+
+class AsyncModbusClient(object):
+    """
+    Modbus/TCP client on asyncio streams, one outstanding request at a time. Reconnects on the next request after a
+    connection error.
+    """
+    def __init__(self, host, port, timeout=2.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.transaction = 0
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def read(self, unit, _type, start, count):
+        """
+        Read coils, discrete inputs, holding or input registers.
+        :return: List of bools (coils, inputs) or 16 bit register values.
+        """
+        if self.writer is None:
+            await self.connect()
+        self.transaction = (self.transaction + 1) & 0xFFFF
+        function_code = FUNCTION_CODES[_type]
+        self.writer.write(struct.pack('>HHHBBHH', self.transaction, 0, 6, unit, function_code, start, count))
+        try:
+            header = await asyncio.wait_for(self.reader.readexactly(7), self.timeout)
+            transaction, _, length, _ = struct.unpack('>HHHB', header)
+            pdu = await asyncio.wait_for(self.reader.readexactly(length - 1), self.timeout)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, OSError):
+            self.close()
+            raise
+        if transaction != self.transaction:
+            self.close()
+            raise ModbusError('Unexpected transaction id {}'.format(transaction))
+        if pdu[0] != function_code:
+            raise ModbusError('Exception response {} to function {} at {}'.format(pdu[1], function_code, start))
+        data = pdu[2:2 + pdu[1]]
+        if _type in ('co', 'di'):
+            return [bool(data[i // 8] >> (i % 8) & 1) for i in range(count)]
+        return list(struct.unpack('>%dH' % count, data[:2 * count]))
+
+
+#---------------------------------------------------------------------------#
+# Poller
+#---------------------------------------------------------------------------#
+class Poller(object):
+    """
+    Polls a set of RTUs every interval seconds. callback(rtu name, timestamp, {tag: value}) is called with the
+    values of every completed poll.
+    """
+    def __init__(self, rtus, interval=1.0, callback=None, max_gap=8):
+        self.rtus = rtus
+        self.interval = interval
+        self.callback = callback
+        self.reads = {rtu.name: coalesce(rtu.tags, max_gap) for rtu in rtus}
+        self.polls = 0
+        self.errors = 0
+        self.requests = 0
+        self.latency = 0.0  # Sum of the poll durations
+        self.overruns = 0  # Polls that took longer than the interval
+
+    async def poll_rtu(self, rtu, stop):
+        client = AsyncModbusClient(rtu.host, rtu.port)
+        reads = self.reads[rtu.name]
+        loop = asyncio.get_event_loop()
+        due = loop.time()
+        while not stop.is_set():
+            started = loop.time()
+            values = {}
+            try:
+                for read in reads:
+                    values.update(decode(read, await client.read(rtu.unit, read.type, read.start, read.count)))
+                    self.requests += 1
+            except (ModbusError, asyncio.TimeoutError, asyncio.IncompleteReadError, OSError) as e:
+                self.errors += 1
+                log.warning('Polling {} @ {}:{} failed: {}'.format(rtu.name, rtu.host, rtu.port, e))
+            else:
+                self.polls += 1
+                if self.callback is not None:
+                    self.callback(rtu.name, time.time(), values)
+            self.latency += loop.time() - started
+            due += self.interval
+            delay = due - loop.time()
+            if delay < 0:  # Skip the missed cycles
+                self.overruns += 1
+                due = loop.time()
+                delay = 0
+            try:
+                await asyncio.wait_for(stop.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+        client.close()
+
+    async def run(self, duration=None, report_interval=10.0):
+        stop = asyncio.Event()
+        tasks = [asyncio.ensure_future(self.poll_rtu(rtu, stop)) for rtu in self.rtus]
+        log.info('Polling {} RTUs with {} reads every {} s'.format(
+            len(self.rtus), sum(len(r) for r in self.reads.values()), self.interval))
+        started = time.time()
+        try:
+            while duration is None or time.time() - started < duration:
+                await asyncio.sleep(min(report_interval, duration or report_interval))
+                self.report(time.time() - started)
+        finally:
+            stop.set()
+            await asyncio.gather(*tasks)
+            self.report(time.time() - started)
+
+    def report(self, elapsed):
+        log.info('{} polls ({:.1f}/s), {} requests, {} errors, {} overruns, mean poll {:.2f} ms'.format(
+            self.polls, self.polls / elapsed, self.requests, self.errors, self.overruns,
+            1e3 * self.latency / max(self.polls + self.errors, 1)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Asyncio SCADA poller for the simulated RTUs.')
+    parser.add_argument('rtu_files', nargs='*', help='RTU XML configurations')
+    parser.add_argument('--csv', help='SCADA tag list (e.g. RTU_3.csv), polled on --host/--port')
+    parser.add_argument('--host', help='server address (overrides the XML)')
+    parser.add_argument('--port', type=int, help='server port (overrides the XML)')
+    parser.add_argument('--interval', type=float, default=1.0, help='poll cycle in seconds')
+    parser.add_argument('--duration', type=float, help='stop after this many seconds')
+    parser.add_argument('--max-gap', type=int, default=8, help='unused addresses bridged by one read')
+    parser.add_argument('--verbose', action='store_true', help='print the polled values')
+    parser.add_argument('--historian', help='keep the polled values in a historian writing to this directory')
+    args = parser.parse_args(argv)
+
+    rtus = [load_xml_tags(path, args.host, args.port) for path in args.rtu_files]
+    if args.csv:
+        if not args.host or not args.port:
+            parser.error('--csv needs --host and --port')
+        rtus.extend(load_csv_tags(args.csv, args.host, args.port))
+    if not rtus:
+        parser.error('no RTUs given')
+
+    historian = None
+    if args.historian:
+        from scada_server.historian import Historian
+        historian = Historian(args.historian)
+
+    def callback(name, timestamp, values):
+        if args.verbose:
+            print('{};{};{}'.format(timestamp, name, values))
+        if historian is not None:
+            historian.record_many(name, timestamp, values)
+    poller = Poller(rtus, args.interval, callback, args.max_gap)
+    try:
+        asyncio.run(poller.run(args.duration))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if historian is not None:
+            historian.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+from array import array
+
+import pytest
+
+from mosaikrtu.dvcd import data
+from mosaikrtu.dvcd.data import BufferedDataBlock, DataBlock, SparseDataBlock, make_block
+from mosaikrtu.dvcd.loader import Register, register_layout
+
+
+@pytest.fixture(params=[None, 'H'])
+def block(request):
+    return BufferedDataBlock(1, [0] * 4, max_pending=2, typecode=request.param)
+
+
+def test_stage_is_invisible_until_publish(block):
+    block.stage(2, [5, 6])
+    assert block.get_values(1, 4) == [0, 0, 0, 0]
+    assert block.peek(1, 4) == [0, 5, 6, 0]
+    block.publish()
+    assert block.get_values(1, 4) == [0, 5, 6, 0]
+
+
+def test_published_snapshot_is_not_changed_by_stage(block):
+    block.stage(1, [1])
+    block.publish()
+    front = block.values
+    block.stage(1, [2])
+    assert front[0] == 1
+    assert block.get_values(1) == [1]
+
+
+def test_client_write_is_visible_and_merged(block):
+    block.set_values(3, [9])
+    assert block.get_values(3) == [9]
+    assert block.peek(3) == [0]
+    assert block.merge() == 1
+    assert block.peek(3) == [9]
+    block.publish()
+    assert block.get_values(3) == [9]
+
+
+def test_publish_merges_pending_writes(block):
+    block.set_values(1, [4])
+    block.stage(2, [5])
+    block.publish()
+    assert block.get_values(1, 2) == [4, 5]
+
+
+def test_full_queue_drops_and_counts_writes(block, caplog):
+    block.set_values(1, [1])
+    block.set_values(2, [2])
+    for i in range(3):
+        with pytest.raises(IOError):
+            block.set_values(3, [3])
+    assert block.dropped == 3
+    assert len([r for r in caplog.records if 'queue full' in r.getMessage()]) == 1
+    block.merge()
+    block.set_values(3, [3])
+    assert block.dropped == 3
+
+
+def test_datablock_sums_dropped_writes():
+    datablock = DataBlock({'hr': [0], 'co': [0]})
+    datablock.hr.max_pending = 0
+    with pytest.raises(IOError):
+        datablock.hr.set_values(1, [1])
+    assert datablock.dropped() == 1
+
+
+def test_sparse_block_reads_gaps_as_zero():
+    block = SparseDataBlock(10, 100, {10: 1, 109: 2})
+    assert block.validate(10, 100)
+    assert not block.validate(10, 101)
+    block.stage(109, [3])
+    block.publish()
+    assert block.get_values(108, 2) == [0, 3]
+    assert len(block.values) == 2
+
+
+def test_make_block_dense():
+    block = make_block('hr', [0, 1, 3])
+    assert type(block) is BufferedDataBlock
+    assert isinstance(block.values, array)
+    assert block.address == 1
+    assert len(block.values) == 4
+
+
+def test_make_block_sparse():
+    block = make_block('hr', [0, 100])
+    assert isinstance(block, SparseDataBlock)
+    assert block.address == 1
+    assert block.size == 101
+
+
+def test_make_block_fill_threshold(monkeypatch):
+    addresses = [0, 3]  # Fills half of the span
+    assert type(make_block('co', addresses)) is BufferedDataBlock
+    monkeypatch.setattr(data, 'DENSE_MIN_FILL', 0.6)
+    assert isinstance(make_block('co', addresses), SparseDataBlock)
+
+
+def test_make_block_legacy():
+    block = make_block('di')
+    assert block.address == 0
+    assert len(block.values) == 0xFF
+
+
+def test_register_layout_takes_the_datatype_width():
+    layout = register_layout([('a', Register('hr', 0, '64bit_float', 0.0)), ('b', Register('hr', 10, '16bit_int', 0)),
+                              ('c', Register('co', 3, 'bool', True))])
+    assert layout == {'di': [], 'co': [3], 'hr': [0, 1, 2, 3, 10], 'ir': []}
+
+
+def test_datablock_sized_from_layout():
+    datablock = DataBlock({'hr': [0, 1, 2, 3, 10], 'co': [3], 'di': [], 'ir': []})
+    assert isinstance(datablock.hr, SparseDataBlock)
+    assert type(datablock.co) is BufferedDataBlock and len(datablock.co.values) == 1
+    datablock.set('hr', 0, 1.5, '64bit_float')
+    datablock.set('co', 3, [True])
+    datablock.publish()
+    assert datablock.get('hr', 0, 4, '64bit_float') == 1.5
+    assert datablock.get('co', 3, 1) == [True]
+    assert datablock.store.get_values(3, 10, 1) == [0]  # Read over Modbus
@@ -0,0 +1,73 @@
+import pytest
+
+from mosaikrtu.dvcd import loader
+from mosaikrtu.dvcd.loader import Register, check_registers, parse_rtu
+
+
+XML = '''<?xml version="1.0" encoding="UTF-8" standalone="no" ?>
+<DVCD label="Test RTU">
+    <ip>127.0.0.1</ip>
+    <port>10502</port>
+    <identity>
+        <vendor name="UTwente" url="https://www.utwente.nl" />
+        <product name="PoorSecuritySubstation" code="PSS" model="PSS 1.0" />
+        <version major="0" minor="5" />
+    </identity>
+    <reg type="co" index="0" label="switch_1-branch_19" dt="bool">True</reg>
+    <reg type="hr" index="0" label="sensor_1-branch_19" dt="64bit_float">1.5</reg>
+    {}
+    <code scan="60" trigger="cycle">logic.py</code>
+</DVCD>
+'''
+
+
+def write(tmp_path, regs=''):
+    path = tmp_path / 'rtu.xml'
+    path.write_text(XML.format(regs))
+    return str(path)
+
+
+def test_parse(tmp_path):
+    conf = parse_rtu(write(tmp_path))
+    assert conf['label'] == 'Test RTU'
+    assert conf['port'] == 10502
+    assert conf['registers']['switch_1-branch_19'] == Register('co', 0, 'bool', True)
+    assert conf['registers']['sensor_1-branch_19'].value == 1.5
+    assert (conf['code'], conf['scan_cycle'], conf['on_change']) == ('logic.py', 60, False)
+
+
+def test_parse_is_cached_by_content(tmp_path):
+    path = write(tmp_path)
+    first = parse_rtu(path)
+    first['registers']['x'] = None
+    first['identity']['vendorname'] = 'changed'
+    second = parse_rtu(path)
+    assert 'x' not in second['registers']
+    assert second['identity']['vendorname'] == 'UTwente'
+    assert len([c for c in loader._cache.values() if c['label'] == 'Test RTU']) == 1
+
+
+def test_float_overlap_is_rejected(tmp_path):
+    regs = '<reg type="hr" index="2" label="max-branch_19" dt="64bit_float">0.4</reg>'
+    with pytest.raises(ValueError, match="'max-branch_19' .* overlaps 'sensor_1-branch_19' at address 2"):
+        parse_rtu(write(tmp_path, regs))
+
+
+def test_adjacent_registers_do_not_overlap():
+    check_registers([('a', Register('hr', 0, '64bit_float', 0.0)), ('b', Register('hr', 4, '32bit_float', 0.0)),
+                     ('c', Register('hr', 6, '16bit_int', 0)), ('d', Register('co', 0, 'bool', False))])
+
+
+@pytest.mark.parametrize('reg, message', [
+    (Register('xx', 0, 'bool', False), "unknown type 'xx'"),
+    (Register('hr', 0, '128bit_float', 0), "unknown datatype '128bit_float'"),
+    (Register('co', 0, '16bit_int', 0), "can only hold bool values"),
+])
+def test_invalid_registers(reg, message):
+    with pytest.raises(ValueError, match=message):
+        check_registers([('a', reg)])
+
+
+def test_string_width():
+    assert Register('hr', 0, 'string', 'abc').width == 2
+    assert Register('hr', 0, 'string', '').width == 1
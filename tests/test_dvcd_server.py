@@ -0,0 +1,101 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+from pymodbus3.client.sync import ModbusTcpClient
+
+from mosaikrtu.dvcd.data import DataBlock
+from mosaikrtu.dvcd.server import MAX_UNIT, Server
+from mosaikrtu.rtu import MonitoringRTU
+from mosaikrtu.rtu_model import attach_server
+
+
+IDENTITY = dict.fromkeys(['vendorname', 'productcode', 'vendorurl', 'productname', 'modelname'], 'test')
+
+
+def make_datablock(values):
+    datablock = DataBlock({'hr': list(range(len(values)))})
+    datablock.set('hr', 0, values)
+    datablock.publish()
+    return datablock
+
+
+@pytest.fixture
+def server():
+    server = Server(make_datablock([7, 8, 9]), IDENTITY)
+    server.ip = '127.0.0.1'
+    server.port = 0
+    server.daemon = True
+    server.start()
+    while server.srv is None:
+        time.sleep(0.01)
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def client(server):
+    client = ModbusTcpClient('127.0.0.1', server.srv.server_address[1])
+    yield client
+    client.close()
+
+
+@pytest.mark.parametrize('unit', [0, 1, 0xFF])
+def test_single_rtu_on_default_units(client, unit):
+    assert client.read_holding_registers(0, 3, unit=unit).registers == [7, 8, 9]
+
+
+def wait_for_requests(server, unit, count):
+    # The stats are recorded after the response is sent
+    deadline = time.time() + 2
+    while server.stats.snapshot(unit)['requests'] < count and time.time() < deadline:
+        time.sleep(0.01)
+    return server.stats.snapshot(unit)['requests']
+
+
+def test_default_units_count_for_the_rtu(server, client):
+    client.read_holding_registers(0, 3, unit=0)
+    client.read_holding_registers(0, 3, unit=0xFF)
+    client.read_holding_registers(0, 3, unit=1)
+    assert wait_for_requests(server, 1, 3) == 3
+    assert server.stats.units() == [1]
+
+    rtu = SimpleNamespace(server=server, unit=1, data=server.datablocks[1])
+    stats = MonitoringRTU.__new__(MonitoringRTU)._modbus_stats(rtu)
+    assert (stats['requests'], stats['errors'], stats['dropped_writes']) == (3, 0, 0)
+
+
+def test_many_rtus_by_unit_id(server, client):
+    assert server.add_slave(make_datablock([4])) == 2
+    assert client.read_holding_registers(0, 1, unit=2).registers == [4]
+    assert client.read_holding_registers(0, 3, unit=1).registers == [7, 8, 9]
+    assert client.read_holding_registers(0, 1, unit=0).function_code > 0x80
+
+
+def test_unit_out_of_range_leaves_server_unchanged():
+    server = Server(make_datablock([1]), IDENTITY)
+    with pytest.raises(ValueError, match='out of range'):
+        server.add_slave(make_datablock([2]), MAX_UNIT + 1)
+    assert list(server.datablocks) == [1]
+    assert server.add_slave(make_datablock([2])) == 2
+
+
+def test_full_listener_raises():
+    server = Server(None, IDENTITY)
+    for unit in range(1, MAX_UNIT + 1):
+        server.datablocks[unit] = None
+    assert server.free_unit() is None
+    with pytest.raises(ValueError, match='unit ids in use'):
+        server.add_slave(make_datablock([1]))
+    assert len(server.datablocks) == MAX_UNIT
+
+
+def test_attach_server_moves_to_next_port_when_full():
+    conf = {'label': 'rtu', 'ip': '127.0.0.1', 'port': 10502, 'unit': None, 'identity': IDENTITY}
+    servers = {}
+    server, unit = attach_server(servers, conf, make_datablock([1]))
+    for i in range(2, MAX_UNIT + 1):
+        server.datablocks[i] = None
+    other, unit = attach_server(servers, conf, make_datablock([2]))
+    assert (other.port, unit) == (10503, 1)
+    assert sorted(servers) == [('127.0.0.1', 10502), ('127.0.0.1', 10503)]
@@ -0,0 +1,40 @@
+from mosaikrtu.dvcd.stats import HISTOGRAM_BUCKETS, RequestStats, percentile
+
+
+def test_record_groups_by_function_and_range():
+    stats = RequestStats(range_size=16)
+    stats.record(1, 3, 0, 1e-6)
+    stats.record(1, 3, 15, 3e-6)
+    stats.record(1, 3, 16, 3e-6, error=True)
+    stats.record(1, 6, None, 1e-6)
+    stats.record(2, 3, 0, 1e-6)
+
+    snapshot = stats.snapshot(1)
+    assert (snapshot['requests'], snapshot['errors']) == (4, 1)
+    assert [(r['function'], r['start'], r['end'], r['requests']) for r in snapshot['ranges']] == [
+        (3, 0, 15, 2), (3, 16, 31, 1), (6, None, None, 1)]
+    assert stats.units() == [1, 2]
+    assert stats.snapshot(3)['requests'] == 0
+
+
+def test_log2_latency_histogram():
+    stats = RequestStats()
+    stats.record(1, 3, 0, 0.5e-6)  # < 1 us: bucket 0
+    stats.record(1, 3, 0, 1.5e-6)  # [1, 2) us: bucket 1
+    stats.record(1, 3, 0, 5e-6)  # [4, 8) us: bucket 3
+    stats.record(1, 3, 0, 1e5)  # Capped at the last bucket
+
+    histogram = stats.snapshot(1)['ranges'][0]['histogram']
+    assert len(histogram) == HISTOGRAM_BUCKETS
+    assert (histogram[0], histogram[1], histogram[3], histogram[-1]) == (1, 1, 1, 1)
+    assert sum(histogram) == 4
+
+
+def test_percentile():
+    histogram = [0] * HISTOGRAM_BUCKETS
+    assert percentile(histogram, 0.5) == 0
+    histogram[2] = 99
+    histogram[10] = 1
+    assert percentile(histogram, 0.5) == 4
+    assert percentile(histogram, 0.99) == 4
+    assert percentile(histogram, 1.0) == 1024
@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+from mosaikrtu import rtu_model
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'basic_normal')
+RTU_XML = os.path.join(DATA_DIR, 'rtu_info.xml')
+
+
+@pytest.fixture
+def rtu():
+    conf = rtu_model.load_rtu(RTU_XML)
+    return rtu_model.RTU('0-rtu', conf)
+
+
+def make_worker(rtu, code=None):
+    conf = dict(rtu.conf, code=code or rtu.conf['code'])
+    return rtu_model.create_worker(conf, rtu.data, rtu.cache)
+
+
+def test_max_current_reads_registers_live(rtu):
+    worker = make_worker(rtu)
+    assert worker.max_current['branch_19'] == 0.4
+    rtu.reg['max-branch_19'] = 2.0
+    assert worker.max_current['branch_19'] == 2.0
+    assert 'branch_24' in worker.max_current
+    with pytest.raises(KeyError):
+        worker.max_current['branch_16']
+
+
+@pytest.mark.parametrize('code', ['rtu_logic_good.py', 'rtu_logic_fail.py'])
+def test_shipped_logic_switches_backup_feed(rtu, code):
+    worker = make_worker(rtu, os.path.join(DATA_DIR, code))
+    rtu.reg['switch_2-branch_24'] = False
+    rtu.reg['sensor_1-branch_19'] = -0.3  # Above 0.6 of the limit, flowing backwards
+    assert worker.scan(0, changed=True)
+    assert rtu.reg['switch_2-branch_24']
+
+    rtu.reg['sensor_1-branch_19'] = 0.1
+    rtu.reg['sensor_2-branch_24'] = 0.1
+    assert worker.scan(60, changed=True)
+    assert not rtu.reg['switch_2-branch_24']
+    assert worker.stats()['running']
+
+
+def test_limit_written_by_client_takes_effect(rtu):
+    worker = make_worker(rtu)
+    rtu.reg['switch_2-branch_24'] = False
+    rtu.reg['sensor_1-branch_19'] = 0.3
+    rtu.reg['max-branch_19'] = 1.0  # 0.3 is below 0.6 of the new limit
+    worker.scan(0, changed=True)
+    assert not rtu.reg['switch_2-branch_24']
+
+
+def test_missing_logic_is_a_load_error(tmp_path):
+    with open(RTU_XML) as f:
+        xml = f.read().replace('rtu_logic_good.py', str(tmp_path / 'missing.py'))
+    path = tmp_path / 'rtu.xml'
+    path.write_text(xml)
+    with pytest.raises(ValueError, match='missing.py'):
+        rtu_model.load_rtu(str(path))
+
+
+def test_logic_path_is_relative_to_the_xml(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    conf = rtu_model.load_rtu(RTU_XML)
+    assert conf['code'] == os.path.join(DATA_DIR, 'rtu_logic_good.py')
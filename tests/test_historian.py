@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+import pytest
+
+from scada_server.historian import Historian, RingBuffer
+
+
+def test_ring_buffer_keeps_the_newest_rows():
+    buf = RingBuffer(3)
+    for t in range(5):
+        buf.append((t, t, t, t))
+    assert buf.rows()[:, 0].tolist() == [2, 3, 4]
+    assert buf.last(2)[:, 0].tolist() == [3, 4]
+
+
+def test_rollups():
+    historian = Historian(resolutions=(60,))
+    for t in range(0, 180, 10):
+        historian.record('tag', t, t // 60)
+    times, means, mins, maxs = historian.query('tag', 0, resolution=60)
+    assert times.tolist() == [0, 60]  # The bucket at 120 is still open
+    assert means.tolist() == [0, 1]
+    times, means, mins, maxs = historian.query('tag', 50, 70)
+    assert times.tolist() == [50, 60, 70]
+
+
+def test_min_max():
+    historian = Historian(resolutions=(60,))
+    for t, value in [(0, 3), (10, -1), (20, 5), (60, 0)]:
+        historian.record('tag', t, value)
+    times, means, mins, maxs = historian.query('tag', 0, resolution=60)
+    assert (means[0], mins[0], maxs[0]) == (pytest.approx(7 / 3), -1, 5)
+
+
+def test_old_rows_are_read_from_chunks(tmp_path):
+    historian = Historian(str(tmp_path), capacity=10, resolutions=(60,), rollup_capacity=4)
+    for t in range(100):
+        historian.record('RTU_3.I', t, t)
+    times, _, _, _ = historian.query('RTU_3.I', 0, resolution=0)
+    assert times.tolist() == list(range(100))
+
+
+def test_chunks_outside_the_range_are_not_opened(tmp_path, monkeypatch):
+    historian = Historian(str(tmp_path), capacity=10, resolutions=(60,))
+    for t in range(100):
+        historian.record('tag', t, t)
+    opened = []
+    load = np.load
+    monkeypatch.setattr(np, 'load', lambda path, *args, **kwargs: opened.append(path) or load(path, *args, **kwargs))
+    historian.load('tag', 0, 20, 24)
+    assert [os.path.basename(p) for p in opened] == ['20.000_24.000.npz']
+
+
+def test_flush_writes_the_open_buckets(tmp_path):
+    historian = Historian(str(tmp_path), resolutions=(60, 3600))
+    for t in range(0, 90, 10):
+        historian.record('tag', t, 1.0)
+    historian.flush()
+
+    restored = Historian(str(tmp_path), resolutions=(60, 3600))
+    assert restored.query('tag', 0, resolution=60)[0].tolist() == [0, 60]
+    assert restored.query('tag', 0, resolution=3600)[0].tolist() == [0]
+    assert restored.query('tag', 0, resolution=0)[0].tolist() == list(range(0, 90, 10))
+
+
+def test_completed_bucket_replaces_the_flushed_partial_row(tmp_path):
+    historian = Historian(str(tmp_path), resolutions=(60,))
+    historian.record('tag', 0, 1.0)
+    historian.flush()
+    historian.record('tag', 30, 3.0)
+    historian.record('tag', 60, 0.0)
+    historian.flush()
+    times, means, mins, maxs = historian.load('tag', 60).T
+    assert times.tolist() == [0, 60]
+    assert means.tolist() == [2.0, 0.0]
+    assert maxs.tolist() == [3.0, 0.0]
@@ -0,0 +1,36 @@
+import output_writer
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def test_writer_appends_lines(tmp_path):
+    path = str(tmp_path / 'sub' / 'times.csv')
+    output_writer.acquire(path)
+    output_writer.write_line(path, 'a;1\n')
+    output_writer.write_line(path, 'b;2\n')
+    output_writer.release(path)
+    assert read(path) == 'a;1\nb;2\n'
+
+
+def test_release_closes_only_when_the_last_user_is_gone(tmp_path):
+    shared = str(tmp_path / 'times.csv')
+    own = str(tmp_path / 'readings.csv')
+    output_writer.acquire(shared)  # PyPower
+    output_writer.acquire(shared)  # RTUs
+    output_writer.acquire(own)
+    output_writer.write_line(shared, 'x\n')
+    output_writer.write_line(own, 'y\n')
+    writer = output_writer.get_writer(shared)
+
+    output_writer.release(shared)
+    output_writer.release(own)
+    assert writer.is_alive()
+    assert read(own) == 'y\n'
+
+    output_writer.write_line(shared, 'z\n')
+    output_writer.release(shared)
+    assert not writer.is_alive()
+    assert read(shared) == 'x\nz\n'
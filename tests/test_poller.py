@@ -0,0 +1,37 @@
+import struct
+
+from scada_server.poller import MAX_COUNT, Read, Tag, coalesce, decode
+
+
+def test_coalesce_merges_close_tags():
+    tags = [Tag('a', 'hr', 0, 4, '64bit_float'), Tag('b', 'hr', 4, 1, '16bit_int'), Tag('c', 'hr', 10, 2, '32bit_float'),
+            Tag('d', 'hr', 40, 1, '16bit_int')]
+    reads = coalesce(tags, max_gap=8)
+    assert [(r.type, r.start, r.count) for r in reads] == [('hr', 0, 12), ('hr', 40, 1)]
+    assert [t.name for t in reads[0].tags] == ['a', 'b', 'c']
+
+
+def test_coalesce_separates_types_and_respects_the_modbus_limit():
+    tags = [Tag('co0', 'co', 0, 1, 'bool'), Tag('hr0', 'hr', 0, 1, '16bit_int'),
+            Tag('hr1', 'hr', MAX_COUNT['hr'] - 1, 2, '32bit_float')]
+    reads = coalesce(tags)
+    assert [(r.type, r.start, r.count) for r in reads] == [('co', 0, 1), ('hr', 0, 1), ('hr', MAX_COUNT['hr'] - 1, 2)]
+
+
+def test_coalesce_with_no_gap():
+    tags = [Tag('a', 'co', 0, 1, 'bool'), Tag('b', 'co', 2, 1, 'bool')]
+    assert len(coalesce(tags, max_gap=0)) == 2
+    assert len(coalesce(tags, max_gap=1)) == 1
+
+
+def test_decode():
+    registers = list(struct.unpack('>4H', struct.pack('>d', 1.5))) + [0xFFFE] + list(struct.unpack('>2H', struct.pack('>f', 0.25)))
+    read = Read('hr', 10, 7, [Tag('a', 'hr', 10, 4, '64bit_float'), Tag('b', 'hr', 14, 1, '16bit_int'),
+                              Tag('c', 'hr', 15, 2, '32bit_float')])
+    assert decode(read, registers) == {'a': 1.5, 'b': -2, 'c': 0.25}
+
+
+def test_decode_bits_and_unknown_datatypes():
+    assert decode(Read('co', 0, 3, [Tag('a', 'co', 0, 1, 'bool'), Tag('b', 'co', 2, 1, 'bool')]),
+                  [True, False, False]) == {'a': True, 'b': False}
+    assert decode(Read('hr', 0, 1, [Tag('s', 'hr', 0, 1, 'string')]), [65]) == {'s': 65}
@@ -0,0 +1,30 @@
+from mosaikpypower.model import merge_switch_commands
+
+
+def test_sequenced_commands():
+    last_seq = {}
+    commands = {'RTUSim-0.0-rtu': {'seq': 1, 'switches': {'branch_19': False}}}
+    assert merge_switch_commands(commands, last_seq) == {'branch_19': False}
+    assert last_seq == {'RTUSim-0.0-rtu': 1}
+    assert merge_switch_commands(commands, last_seq) == {}  # Stale, already applied
+
+
+def test_legacy_commands_are_always_applied():
+    commands = {'RTUSim-0.0-rtu': {'branch_19': True}}
+    assert merge_switch_commands(commands, {}) == {'branch_19': True}
+    assert merge_switch_commands(commands, {}) == {'branch_19': True}
+
+
+def test_last_source_wins():
+    commands = {
+        'RTUSim-0.1-rtu': {'seq': 1, 'switches': {'branch_19': True}},
+        'RTUSim-0.0-rtu': {'seq': 1, 'switches': {'branch_19': False, 'branch_24': False}},
+    }
+    assert merge_switch_commands(commands, {}) == {'branch_19': True, 'branch_24': False}
+
+
+def test_unchanged_states_are_dropped():
+    states = {'branch_19': True, 'branch_24': True}
+    commands = {'RTUSim-0.0-rtu': {'seq': 3, 'switches': {'branch_19': True, 'branch_24': False}}}
+    assert merge_switch_commands(commands, {}, states) == {'branch_24': False}
+    assert states == {'branch_19': True, 'branch_24': False}
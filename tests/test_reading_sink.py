@@ -0,0 +1,28 @@
+import h5py
+import numpy as np
+
+from mosaikrtu.reading_sink import HDF5ReadingSink
+
+
+def test_attrs_of_a_label_share_the_time(tmp_path):
+    path = str(tmp_path / 'readings.hdf5')
+    sink = HDF5ReadingSink(path, buf_size=2)
+    for time in (0, 60, 120):
+        sink.add(time, 'RTUSim-0.0-rtu', 'sensor_1-branch_19', 'I_real', time / 60.0)
+        if time:
+            sink.add(time, 'RTUSim-0.0-rtu', 'sensor_1-branch_19', 'Vm', 10.0 + time)
+        sink.add(time, 'RTUSim-0.0-rtu', 'sensor_2-branch_24', 'I_real', 5.0)
+    sink.add(120, 'RTUSim-0.0-rtu', 'sensor_2-branch_24', 'Vm', 9.0)  # After the first two rows were written
+    sink.close()
+
+    with h5py.File(path, 'r') as db:
+        group = db['Series/RTUSim-0.0-rtu/sensor_1-branch_19']
+        assert list(group['time']) == [0, 60, 120]
+        assert list(group['I_real']) == [0.0, 1.0, 2.0]
+        vm = group['Vm'][:]
+        assert np.isnan(vm[0]) and list(vm[1:]) == [70.0, 130.0]
+        group = db['Series/RTUSim-0.0-rtu/sensor_2-branch_24']
+        assert list(group['time']) == [0, 60, 120]
+        assert list(group['I_real']) == [5.0, 5.0, 5.0]
+        vm = group['Vm'][:]
+        assert np.isnan(vm[:2]).all() and vm[2] == 9.0
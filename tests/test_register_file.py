@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+
+import pytest
+
+from mosaikrtu import register_file
+from mosaikrtu.dvcd.data import DataBlock, SparseDataBlock
+from mosaikrtu.register_file import SECTION, RegisterFile, RegisterFileReader
+
+
+def make_rtu(eid):
+    # hr is dense, ir sparse (2 of 41 addresses), di and co use the legacy 0xFF blocks
+    data = DataBlock({'hr': [10, 11, 12], 'ir': [0, 40]})
+    return SimpleNamespace(eid=eid, data=data)
+
+
+@pytest.fixture
+def files(tmp_path):
+    path = str(tmp_path / 'shm' / 'registers')
+    writer = RegisterFile(path)
+    rtus = [make_rtu('0-rtu'), make_rtu('1-rtu')]
+    for rtu in rtus:
+        writer.add(rtu)
+    writer.publish(rtus[0], 0)  # Lays out the file
+    reader = RegisterFileReader(path)
+    yield writer, reader, rtus
+    reader.close()
+    writer.close()
+
+
+def test_layout(files):
+    writer, reader, rtus = files
+    assert sorted(reader.rtus) == ['0-rtu', '1-rtu']
+    offset, space_offsets, spaces = reader.rtus['0-rtu']
+    assert offset % 8 == 0
+    assert spaces == [(-1, 0xFF), (-1, 0xFF), (10, 3), (0, 41)]
+    assert isinstance(rtus[0].data.ir, SparseDataBlock)
+    assert space_offsets[2] % 2 == 0
+
+
+def test_round_trip(files):
+    writer, reader, rtus = files
+    rtu = rtus[1]
+    rtu.data.set('hr', 10, [1, 2, 3])
+    rtu.data.set('ir', 40, [7])
+    rtu.data.set('co', 5, [1])
+    rtu.data.publish()
+    writer.publish(rtu, 120)
+
+    seq, time, regs = reader.read('1-rtu')
+    assert (seq, time) == (2, 120)
+    assert [regs['hr'][i] for i in range(9, 14)] == [0, 1, 2, 3, 0]
+    assert (regs['ir'][0], regs['ir'][20], regs['ir'][40], regs['ir'][41]) == (0, 0, 7, 0)
+    assert regs['co'][5] == 1
+    assert len(regs['ir']) == 41
+
+    start, view = reader.view('1-rtu', 'hr')
+    assert (start, list(view)) == (10, [1, 2, 3])
+    assert reader.sequence('1-rtu') == 2
+    assert reader.read('0-rtu')[0] == 2  # The first publish of 0-rtu
+
+
+def test_read_retries_during_a_write(files, monkeypatch):
+    writer, reader, rtus = files
+    offset = reader.rtus['0-rtu'][0]
+    SECTION.pack_into(writer.mm, offset, 3, 60)  # A write in progress
+
+    with pytest.raises(IOError):
+        reader.read('0-rtu', retries=5)
+
+    def finish_write(seconds):
+        SECTION.pack_into(writer.mm, offset, 4, 60)
+    monkeypatch.setattr(register_file, '_time', SimpleNamespace(sleep=finish_write))
+    seq, time, regs = reader.read('0-rtu')
+    assert (seq, time) == (4, 60)
+
+
+def test_bad_file(tmp_path):
+    path = tmp_path / 'other'
+    path.write_bytes(b'\0' * 64)
+    with pytest.raises(ValueError, match='register file'):
+        RegisterFileReader(str(path))
@@ -0,0 +1,85 @@
+import os
+import socket
+from types import SimpleNamespace
+
+import pytest
+
+from mosaikrtu.rtu import MonitoringRTU
+
+
+RTU_XML = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'basic_normal',
+                       'rtu_info.xml')
+SENSOR = '0-sensor_1'
+SOURCE = 'PyPower-0.0-branch_19'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def sim(tmp_path, monkeypatch):
+    conf = tmp_path / 'config.cfg'
+    conf.write_text('recordtimes False\nrtu_stats_output False\noutput_dir {}\nrtu_ip 127.0.0.1\n'
+                    'rtu_port_offset {}\n'.format(tmp_path, free_port() - 10502))
+    monkeypatch.setenv('MOSAIK_CONFIG', str(conf))
+    sim = MonitoringRTU()
+    sim.init('RTUSim-0', step_size=60, max_step_size=300, deadband=0.01)
+    sim.create(1, 'RTU', rtu_ref=RTU_XML)
+    sim.mosaik = SimpleNamespace(set_data=lambda commands: ('set_data', commands))
+    yield sim
+    sim.finalize()
+
+
+def step(sim, time, current):
+    """Run one step, return the next time and the set_data calls it yielded."""
+    calls = []
+    gen = sim.step(time, {SENSOR: {'I_real': {SOURCE: current}}})
+    try:
+        while True:
+            calls.append(next(gen))
+    except StopIteration as stop:
+        return stop.value, calls
+
+
+def test_interval_grows_while_quiet_and_resets(sim):
+    time, calls = step(sim, 0, 0.2)
+    assert time == 60
+    intervals = []
+    for _ in range(5):
+        next_time, calls = step(sim, time, 0.2)
+        assert calls == []  # Nothing changed, no set_data
+        intervals.append(next_time - time)
+        time = next_time
+    assert intervals == [120, 240, 300, 300, 300]
+
+    next_time, calls = step(sim, time, 0.2001)  # Below the deadband
+    assert next_time - time == 300
+    time = next_time
+    next_time, calls = step(sim, time, 0.3)
+    assert next_time - time == 60
+
+
+def test_switch_change_is_sent_and_resets(sim):
+    time, calls = step(sim, 0, 0.2)
+    time, calls = step(sim, time, 0.2)
+    assert calls == []
+    sim._rtus[0].reg['switch_1-branch_19'] = False
+    next_time, calls = step(sim, time, 0.2)
+    assert next_time - time == 60
+    assert len(calls) == 1
+    name, commands = calls[0]
+    assert name == 'set_data'
+    command = commands['RTUSim-0.0-rtu']['PyPower-0.PyPower']['switchstates']
+    assert command['switches'] == {'branch_19': False}
+
+
+def test_fixed_step_size_without_max_step_size(sim):
+    sim.init('RTUSim-0', step_size=60)
+    time, calls = step(sim, 0, 0.2)
+    for _ in range(3):
+        next_time, calls = step(sim, time, 0.2)
+        assert next_time - time == 60
+        time = next_time
@@ -0,0 +1,95 @@
+import pytest
+
+from mosaikrtu.rules import RuleEngine
+
+
+class FakeRTU(object):
+    def __init__(self, rules, eid='0-rtu'):
+        self.eid = eid
+        self.reg = {'sensor_1-branch_19': 0.0, 'max-branch_19': 1.0,
+                    'switch_1-branch_19': True, 'switch_2-branch_24': True}
+        self.conf = {'label': 'Test RTU', 'registers': dict.fromkeys(self.reg), 'rules': rules}
+
+
+THRESHOLD = {'kind': 'threshold', 'sensor': 'sensor_1-branch_19', 'limit': 'max-branch_19',
+             'coil': 'switch_1-branch_19', 'trip': '1.0', 'hysteresis': '0.2', 'value': 'False'}
+INTERLOCK = {'kind': 'interlock', 'coil': 'switch_1-branch_19', 'requires': 'switch_2-branch_24', 'state': 'True'}
+
+
+def make_engine(*rules):
+    rtu = FakeRTU(list(rules))
+    engine = RuleEngine()
+    engine.add_rtu(rtu)
+    return engine, rtu
+
+
+def test_trip_and_reset_edges():
+    engine, rtu = make_engine(THRESHOLD)
+    engine.set_value(rtu, 'sensor_1-branch_19', 1.5)
+    assert engine.evaluate() == [(rtu, 'switch_1-branch_19', False)]
+    assert engine.evaluate() == []
+    engine.set_value(rtu, 'sensor_1-branch_19', 0.9)  # Within the hysteresis
+    assert engine.evaluate() == []
+    engine.set_value(rtu, 'sensor_1-branch_19', 0.7)
+    assert engine.evaluate() == [(rtu, 'switch_1-branch_19', True)]
+
+
+def test_negative_current_trips():
+    engine, rtu = make_engine(THRESHOLD)
+    engine.set_value(rtu, 'sensor_1-branch_19', -1.5)
+    assert engine.evaluate() == [(rtu, 'switch_1-branch_19', False)]
+
+
+def test_refresh_limits():
+    engine, rtu = make_engine(THRESHOLD)
+    engine.set_value(rtu, 'sensor_1-branch_19', 1.5)
+    rtu.reg['max-branch_19'] = 2.0
+    engine.refresh_limits(rtu)
+    assert engine.evaluate() == []
+
+
+def test_interlocked_trip_is_applied_when_the_interlock_clears():
+    engine, rtu = make_engine(THRESHOLD, INTERLOCK)
+    rtu.reg['switch_2-branch_24'] = False
+    engine.set_value(rtu, 'sensor_1-branch_19', 1.5)
+    assert engine.evaluate() == []
+    assert engine.evaluate() == []
+    rtu.reg['switch_2-branch_24'] = True
+    assert engine.evaluate() == [(rtu, 'switch_1-branch_19', False)]
+    assert engine.evaluate() == []
+
+
+def test_interlocked_trip_is_dropped_when_the_current_falls():
+    engine, rtu = make_engine(THRESHOLD, INTERLOCK)
+    rtu.reg['switch_2-branch_24'] = False
+    engine.set_value(rtu, 'sensor_1-branch_19', 1.5)
+    assert engine.evaluate() == []
+    engine.set_value(rtu, 'sensor_1-branch_19', 0.5)
+    rtu.reg['switch_2-branch_24'] = True
+    assert engine.evaluate() == []
+
+
+def test_many_rtus():
+    engine = RuleEngine()
+    rtus = [FakeRTU([THRESHOLD], eid='{}-rtu'.format(i)) for i in range(3)]
+    for rtu in rtus:
+        engine.add_rtu(rtu)
+    engine.set_value(rtus[1], 'sensor_1-branch_19', 2.0)
+    assert engine.evaluate() == [(rtus[1], 'switch_1-branch_19', False)]
+
+
+def test_missing_attribute():
+    rule = dict(THRESHOLD)
+    del rule['trip']
+    with pytest.raises(ValueError, match="'threshold' in RTU 'Test RTU' is missing the attribute 'trip'"):
+        make_engine(rule)
+
+
+def test_unknown_register():
+    with pytest.raises(ValueError, match="unknown register 'switch_9'"):
+        make_engine(dict(INTERLOCK, requires='switch_9'))
+
+
+def test_unknown_rule():
+    with pytest.raises(ValueError, match="Unknown rule 'overcurrent'"):
+        make_engine(dict(THRESHOLD, kind='overcurrent'))
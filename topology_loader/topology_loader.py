@@ -3,6 +3,27 @@ import sys
 from shutil import copyfile
 import os
 
+CONFIG_ENV = "MOSAIK_CONFIG"  # Environment variable with the path of the config file of a run (see batch_run.py)
+PATH_KEYS = ('pv_data', 'gen_data', 'profile_file', 'rtu_file', 'attack_script', 'bro_policies')  # Relative to the scenario
+
+
+def read_config(conf_file):
+    """
+    Reads a config file with one "key value" pair per line.
+    :param conf_file: path of the config file
+    :return: configuration as a dict
+    """
+    conf = {}
+    with open(conf_file) as in_stream:
+        for line in in_stream:
+            line = line.rstrip()
+            if not line:
+                continue
+            key, value = line.split(" ", 1)
+            conf[key] = value
+    return conf
+
+
 class topology_loader(threading.Thread):
 
     """
@@ -49,27 +70,17 @@ class topology_loader(threading.Thread):
         :return: configuration as a dict
         """
 
-        conf = {}
         if finalload == True:
-            conf_file = os.path.join(os.getcwd(), "data", self.conf_file_name)
+            conf_file = os.environ.get(CONFIG_ENV) or os.path.join(os.getcwd(), "data", self.conf_file_name)
             #print(conf_file)
         else:
             conf_file = os.path.join(os.getcwd(), self.rootdir, dir, self.conf_file_name)
-        with open(conf_file) as in_stream:
-            for line in in_stream:
-                line = line.rstrip()
-                key, value = line.split(" ", 1)
-                #print(key + ": " + value)
-                conf[key] = value
-        in_stream.close()
+        conf = read_config(conf_file)
         if finalload != True:
             conf['grid_file'] = os.path.join(dir, conf['grid_name'] + ".json")
-            conf['pv_data'] = os.path.join(dir, conf['pv_data'])
-            if 'gen_data' in conf: conf['gen_data'] = os.path.join(dir, conf['gen_data'])
-            conf['profile_file'] = os.path.join(dir, conf['profile_file'])
-            conf['rtu_file'] = os.path.join(dir, conf['rtu_file'])
-            conf['attack_script'] = os.path.join(dir, conf['attack_script'])
-            conf['bro_policies'] = os.path.join(dir, conf['bro_policies'])
+            for key in PATH_KEYS:
+                if key in conf:
+                    conf[key] = os.path.join(dir, conf[key])
             conf['rt_factor'] = self.rt_factor
             conf['rtu_stats_output'] = self.output_rtu_stats
             conf['recordtimes'] = self.recordtimes
@@ -82,7 +93,8 @@ class topology_loader(threading.Thread):
 
     def get_config(self, dir=None):
         """
-        Gets the config dict for the simulation.
+        Gets the config dict for the simulation. Without dir, the file named by the MOSAIK_CONFIG environment
+        variable is read if it is set, data/config.cfg otherwise.
         :param dir: directory to pull the config from
         :return: configuration dict
         """